@@ -0,0 +1,206 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import archive
+from db import archived_through
+
+# Smoothing factor of the daily exponentially weighted weight trend
+TREND_ALPHA = 0.1
+# A day counts as on target when intake is within this fraction of the goal
+ADHERENCE_TOLERANCE = 0.10
+# Users loaded per batch when building cohort reports
+COHORT_BATCH_SIZE = 2000
+
+PROGRESS_DTYPES = {
+    "user_id": "int64",
+    "weight": "float64",
+    "calories": "float64",
+    "protein": "float64",
+    "carbs": "float64",
+    "fats": "float64",
+}
+PLANNED_DTYPES = {"user_id": "int64", "planned_calories": "float64"}
+EXERCISE_DTYPES = {"user_id": "int64", "burned": "float64", "exercise_minutes": "float64"}
+
+
+def _day(value):
+    return pd.Timestamp(value).date().isoformat()
+
+
+def _params(user_ids, start_date, end_date):
+    return (json.dumps([int(u) for u in user_ids]), _day(start_date), _day(end_date))
+
+
+# Archived rows of a range (see archive.py) as an Arrow table with `date`
+# as a timestamp, when `db` is given and the range reaches back past the
+# table's watermark, else None
+def _archived(db, conn, table, user_ids, start_date, end_date):
+    if db is None:
+        return None
+    through = archived_through(conn, table)
+    if not through or _day(start_date) > through:
+        return None
+    data = archive.read_table(db, table, user_ids, _day(start_date), min(_day(end_date), through))
+    if not data.num_rows:
+        return None
+    index = data.schema.get_field_index("date")
+    return data.set_column(index, "date", data.column(index).cast("timestamp[ns]"))
+
+
+def _with_archived(archived, frame):
+    if archived is None:
+        return frame
+    if frame.empty:
+        return archived
+    return pd.concat([archived, frame], ignore_index=True)
+
+
+# Per (user_id, date) columns straight from SQLite, without going through
+# row tuples. With `db`, archived days are read from the memory-mapped archive.
+def load_progress(conn, user_ids, start_date, end_date, db=None):
+    frame = pd.read_sql('''
+        SELECT user_id, date, weight, total_calories AS calories, total_protein AS protein,
+               total_carbs AS carbs, total_fats AS fats, notes
+        FROM Progress
+        WHERE user_id IN (SELECT value FROM json_each(?)) AND date BETWEEN ? AND ?
+    ''', conn, params=_params(user_ids, start_date, end_date),
+        parse_dates=["date"], dtype=PROGRESS_DTYPES)
+    archived = _archived(db, conn, "Progress", user_ids, start_date, end_date)
+    if archived is not None:
+        archived = archived.rename_columns(list(frame.columns)).to_pandas()
+    return _with_archived(archived, frame)
+
+
+def load_planned(conn, user_ids, start_date, end_date):
+    return pd.read_sql('''
+        SELECT user_id, date, calories AS planned_calories
+        FROM DailyNutrition
+        WHERE user_id IN (SELECT value FROM json_each(?)) AND date BETWEEN ? AND ?
+    ''', conn, params=_params(user_ids, start_date, end_date),
+        parse_dates=["date"], dtype=PLANNED_DTYPES)
+
+
+def load_exercise(conn, user_ids, start_date, end_date, db=None):
+    frame = pd.read_sql('''
+        SELECT user_id, date, TOTAL(calories_burned) AS burned,
+               TOTAL(duration_minutes) AS exercise_minutes
+        FROM UserExercises
+        WHERE user_id IN (SELECT value FROM json_each(?)) AND date BETWEEN ? AND ?
+        GROUP BY user_id, date
+    ''', conn, params=_params(user_ids, start_date, end_date),
+        parse_dates=["date"], dtype=EXERCISE_DTYPES)
+    archived = _archived(db, conn, "UserExercises", user_ids, start_date, end_date)
+    if archived is not None:
+        archived = archived.group_by(["user_id", "date"]).aggregate([
+            ("calories_burned", "sum"), ("duration_minutes", "sum"),
+        ]).to_pandas().rename(columns={
+            "calories_burned_sum": "burned", "duration_minutes_sum": "exercise_minutes",
+        })[list(frame.columns)]
+    return _with_archived(archived, frame)
+
+
+def load_goals(conn, user_ids):
+    goals = pd.read_sql('''
+        SELECT user_id, daily_calorie_goal AS goal
+        FROM Users
+        WHERE user_id IN (SELECT value FROM json_each(?))
+    ''', conn, params=(json.dumps([int(u) for u in user_ids]),), dtype={"user_id": "int64", "goal": "float64"})
+    return goals.set_index("user_id")["goal"]
+
+
+# Daily frame indexed by (user_id, date) over the full calendar of the range,
+# with rolling averages, weight trend, net energy balance and goal adherence.
+# intake is the logged Progress calories, or the planned total when nothing was logged.
+# Pass the database as `db` to include days moved to the archive.
+def daily_report(conn, user_ids, start_date, end_date, db=None):
+    user_ids = sorted({int(u) for u in user_ids})
+    calendar = pd.MultiIndex.from_product(
+        [user_ids, pd.date_range(_day(start_date), _day(end_date), freq="D")],
+        names=["user_id", "date"],
+    )
+    frame = pd.DataFrame(index=calendar)
+    for part in (
+        load_progress(conn, user_ids, start_date, end_date, db),
+        load_planned(conn, user_ids, start_date, end_date),
+        load_exercise(conn, user_ids, start_date, end_date, db),
+    ):
+        frame = frame.join(part.set_index(["user_id", "date"]))
+
+    frame["logged"] = frame["weight"].notna() | frame["calories"].notna()
+    frame["intake"] = frame["calories"].where(frame["calories"] > 0, frame["planned_calories"])
+    frame["burned"] = frame["burned"].fillna(0.0)
+    frame["exercise_minutes"] = frame["exercise_minutes"].fillna(0.0)
+    frame["net_energy"] = frame["intake"] - frame["burned"]
+
+    by_user = frame.groupby(level="user_id")
+    for window in (7, 30):
+        frame[f"intake_{window}d"] = (
+            by_user["intake"].rolling(window, min_periods=1).mean().droplevel(0)
+        )
+        frame[f"net_energy_{window}d"] = (
+            by_user["net_energy"].rolling(window, min_periods=1).mean().droplevel(0)
+        )
+    frame["weight_7d"] = by_user["weight"].rolling(7, min_periods=1).mean().droplevel(0)
+    frame["weight_trend"] = by_user["weight"].transform(
+        lambda weight: weight.ewm(alpha=TREND_ALPHA, ignore_na=True).mean()
+    )
+
+    goals = load_goals(conn, user_ids)
+    frame["goal"] = frame.index.get_level_values("user_id").map(goals).to_numpy(dtype="float64")
+    deviation = (frame["intake"] - frame["goal"]).abs()
+    frame["on_target"] = np.where(
+        frame["intake"].notna() & frame["goal"].notna(),
+        deviation <= ADHERENCE_TOLERANCE * frame["goal"],
+        np.nan,
+    )
+    return frame
+
+
+# One row per user: tracking volume, average intake/burn, adherence and trend change
+def summarize(frame):
+    by_user = frame.groupby(level="user_id")
+    summary = pd.DataFrame({
+        "days_logged": by_user["logged"].sum(),
+        "days_with_intake": by_user["intake"].count(),
+        "avg_intake": by_user["intake"].mean(),
+        "avg_burned": by_user["burned"].mean(),
+        "avg_net_energy": by_user["net_energy"].mean(),
+        "adherence": by_user["on_target"].mean(),
+        "weight_start": by_user["weight_trend"].first(),
+        "weight_end": by_user["weight_trend"].last(),
+    })
+    summary["weight_change"] = summary["weight_end"] - summary["weight_start"]
+    return summary
+
+
+# Summaries for many users at once, loaded in batches to bound memory.
+# Defaults to every user with progress in the range on this connection.
+def cohort_report(conn, start_date, end_date, user_ids=None, batch_size=COHORT_BATCH_SIZE, db=None):
+    if user_ids is None:
+        user_ids = [row[0] for row in conn.execute('''
+            SELECT DISTINCT user_id FROM Progress WHERE date BETWEEN ? AND ? ORDER BY user_id
+        ''', (_day(start_date), _day(end_date)))]
+    user_ids = list(user_ids)
+    parts = [
+        summarize(daily_report(conn, user_ids[i:i + batch_size], start_date, end_date, db))
+        for i in range(0, len(user_ids), batch_size)
+    ]
+    return pd.concat(parts) if parts else pd.DataFrame()
+
+
+# Every user with progress in the range, on any shard or in the archive
+def progress_users(db, start_date, end_date):
+    start_date, end_date = _day(start_date), _day(end_date)
+    users = set()
+    for _, rows in db.query_all(
+        "SELECT DISTINCT user_id FROM main.Progress WHERE date BETWEEN ? AND ?", (start_date, end_date)
+    ):
+        users.update(row[0] for row in rows)
+    with db.read() as conn:
+        through = archived_through(conn, "Progress")
+    if through and start_date <= through:
+        archived = archive.read_table(db, "Progress", None, start_date, min(end_date, through))
+        users.update(archived.column("user_id").unique().to_pylist())
+    return sorted(users)
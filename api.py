@@ -0,0 +1,522 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date as Date, timedelta
+from typing import Literal, Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, field_validator
+
+import auth
+import data
+import jobs
+import querystats
+from db import NUTRIENTS, migrate
+from shards import ShardedDatabase
+
+# Headless JSON API over the same data functions as the Streamlit UI
+# (data.py), for mobile clients. Runs as its own process next to Streamlit
+# against the same WAL database:  python api.py --db meal_planner.db --port 8000
+
+DB_PATH = os.environ.get("MEAL_PLANNER_DB", "meal_planner.db")
+# Threads running the blocking sqlite3 calls; each one reuses a pooled
+# reader connection, so this is also the size of the reader pool
+API_WORKERS = int(os.environ.get("MEAL_PLANNER_API_WORKERS", "8"))
+# Key signing bearer tokens. Set it to keep tokens valid across restarts
+# and across several API processes; otherwise a random one is used.
+API_SECRET = os.environ.get("MEAL_PLANNER_API_SECRET", "").encode() or secrets.token_bytes(32)
+TOKEN_TTL = timedelta(days=7)
+MAX_PAGE_SIZE = 100
+MAX_PLAN_DAYS = 14
+
+MealType = Literal["Breakfast", "Lunch", "Dinner", "Snack"]
+Preference = Literal["None", "Vegetarian", "Vegan", "Gluten-Free", "Keto", "Paleo"]
+
+MEAL_COLUMNS = (
+    "meal_id", "meal_name", "description", "calories", "protein", "carbs", "fats", "fiber",
+    "sugar", "sodium", "dietary_preference", "meal_type", "created_by", "created_at",
+)
+SEARCH_COLUMNS = ("meal_id", "meal_name", "calories", "meal_type")
+PLAN_COLUMNS = (
+    "meal_id", "meal_name", "calories", "protein", "carbs", "fats",
+    "portion_size", "meal_type", "dietary_preference",
+)
+NUTRITION_COLUMNS = ("date", "meal_type", "meal_count") + NUTRIENTS
+PROGRESS_COLUMNS = (
+    "date", "weight", "total_calories", "total_protein", "total_carbs", "total_fats", "notes",
+)
+EXERCISE_COLUMNS = ("exercise_id", "exercise_name", "calories_burned_per_hour")
+HISTORY_COLUMNS = ("log_id", "exercise_name", "date", "duration_minutes", "calories_burned")
+PROFILE_FIELDS = (
+    "user_id", "username", "email", "age", "gender", "height", "weight",
+    "fitness_goal", "activity_level", "daily_calorie_goal",
+)
+
+logger = logging.getLogger("meal_planner.api")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    db = ShardedDatabase(app.state.db_path, readers=API_WORKERS, group_commit=data.GROUP_COMMIT)
+    try:
+        migrate(db)
+    except Exception:
+        db.close()
+        raise
+    app.state.db = db
+    app.state.executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="api-db")
+    runner = jobs.JobRunner(db).start() if jobs.RUN_JOBS else None
+    try:
+        yield
+    finally:
+        if runner is not None:
+            runner.stop()
+        app.state.executor.shutdown(wait=True)
+        app.state.db.close()
+
+
+app = FastAPI(title="Meal Planner API", lifespan=lifespan)
+app.state.db_path = DB_PATH
+
+
+# Database errors the endpoints don't handle themselves: a locked or busy
+# database is worth retrying, anything else is a server error
+@app.exception_handler(sqlite3.Error)
+async def database_error(request, exc):
+    logger.error("%s %s: %s", request.method, request.url.path, exc)
+    if isinstance(exc, sqlite3.OperationalError):
+        return JSONResponse({"detail": "Database is busy, try again"}, status_code=503)
+    return JSONResponse({"detail": "Database error"}, status_code=500)
+
+
+# Run a blocking data function with the shared Database on the bounded
+# executor; its queries are reported under the endpoint's name
+async def call(page, fn, *args, **kwargs):
+    db = app.state.db
+
+    def run():
+        with querystats.page(page):
+            return fn(db, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(app.state.executor, run)
+
+
+# Run a password hash or check on the KDF pool itself, so no api-db thread
+# (and its reader connection) waits on it. A saturated pool answers 503.
+async def kdf(fn, *args):
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(auth.submit(fn, *args)), auth.KDF_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(503, auth.KDF_BUSY, headers={"Retry-After": "5"})
+
+
+def records(columns, rows):
+    return [dict(zip(columns, row)) for row in rows]
+
+
+# Tokens are "<user_id>.<expiry>.<hmac>", so verifying one needs no lookup
+def _sign(payload):
+    return hmac.new(API_SECRET, payload.encode(), hashlib.sha256).hexdigest()
+
+
+def issue_token(user_id):
+    payload = f"{user_id}.{int(time.time() + TOKEN_TTL.total_seconds())}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def token_user(token):
+    try:
+        user_id, expires, signature = token.split(".")
+        if not hmac.compare_digest(signature, _sign(f"{user_id}.{expires}")):
+            return None
+        return int(user_id) if int(expires) > time.time() else None
+    except ValueError:
+        return None
+
+
+def current_user(authorization: str = Header("")):
+    scheme, _, token = authorization.partition(" ")
+    user_id = token_user(token) if scheme.lower() == "bearer" else None
+    if user_id is None:
+        raise HTTPException(401, "Invalid or expired token", headers={"WWW-Authenticate": "Bearer"})
+    return user_id
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+# JSON response validated by a hash of its body: a client sending the
+# ETag back in If-None-Match gets an empty 304 when nothing changed
+def etag_response(request, payload):
+    body = json.dumps(payload, separators=(",", ":"), default=str).encode()
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+class Credentials(BaseModel):
+    username: str
+    password: str
+
+
+class NewUser(BaseModel):
+    username: str = Field(min_length=1)
+    password: str
+    email: str = Field(min_length=3)
+    age: int = Field(ge=13, le=120)
+    gender: Literal["Male", "Female", "Other"]
+    height: float = Field(gt=0)
+    weight: float = Field(gt=0)
+    fitness_goal: Literal["Weight Loss", "Muscle Gain", "Maintenance"]
+    activity_level: Literal[
+        "sedentary", "lightly active", "moderately active", "very active", "extra active"
+    ]
+    daily_calorie_goal: Optional[int] = Field(None, gt=0, strict=True)
+
+    # Same policy as the registration form
+    @field_validator("password")
+    @classmethod
+    def check_password(cls, password):
+        problem = auth.password_problem(password)
+        if problem:
+            raise ValueError(problem)
+        return password
+
+
+class NewMeal(BaseModel):
+    meal_name: str = Field(min_length=1)
+    description: str = ""
+    calories: int = Field(ge=0)
+    protein: float = Field(0.0, ge=0)
+    carbs: float = Field(0.0, ge=0)
+    fats: float = Field(0.0, ge=0)
+    fiber: float = Field(0.0, ge=0)
+    sugar: float = Field(0.0, ge=0)
+    sodium: float = Field(0.0, ge=0)
+    dietary_preference: Preference = "None"
+    meal_type: MealType
+
+
+class PlannedMeal(BaseModel):
+    meal_id: int
+    date: Date
+    meal_type: MealType
+    portion_size: float = Field(1.0, gt=0)
+
+
+class PlanRequest(BaseModel):
+    start_date: Optional[Date] = None
+    days: int = Field(1, ge=1, le=MAX_PLAN_DAYS)
+    dietary_preference: Preference = "None"
+    seed: Optional[int] = None
+    save: bool = False
+    replace: bool = False
+
+
+class ProgressEntry(BaseModel):
+    date: Date
+    weight: Optional[float] = Field(None, gt=0)
+    total_calories: Optional[int] = Field(None, ge=0)
+    total_protein: Optional[float] = Field(None, ge=0)
+    total_carbs: Optional[float] = Field(None, ge=0)
+    total_fats: Optional[float] = Field(None, ge=0)
+    notes: Optional[str] = None
+
+
+class ExerciseEntry(BaseModel):
+    exercise_id: int
+    date: Date
+    duration_minutes: int = Field(gt=0, le=24 * 60)
+    # Estimated from the exercise's calories per hour when omitted
+    calories_burned: Optional[int] = Field(None, ge=0)
+
+
+# Accounts
+# As data.authenticate_user, with the database reads and writes on the
+# executor and the KDF awaited on its own pool
+@app.post("/login")
+async def login(credentials: Credentials):
+    row = await call("api:login", data.get_credentials, credentials.username)
+    stored = row[2] if row else await kdf(auth.dummy_hash)
+    if not await kdf(auth.check_hash, credentials.password, stored) or row is None:
+        raise HTTPException(401, "Invalid username or password")
+    user_id, username, _ = row
+    if auth.needs_rehash(stored):
+        upgraded = await kdf(auth.compute_hash, credentials.password)
+        await call("api:login", data.upgrade_password, user_id, stored, upgraded)
+    return {"user_id": user_id, "username": username, "token": issue_token(user_id)}
+
+
+@app.post("/users", status_code=201)
+async def register(user: NewUser):
+    # Whole calories, as the registration form stores them
+    goal = user.daily_calorie_goal or int(data.calculate_daily_calorie_goal(
+        user.age, user.gender, user.height, user.weight, user.activity_level, user.fitness_goal
+    ))
+    password_hash = await kdf(auth.compute_hash, user.password)
+    try:
+        user_id = await call(
+            "api:register", data.create_user, user.username, password_hash, user.email, user.age,
+            user.gender, user.height, user.weight, user.fitness_goal, user.activity_level, goal
+        )
+    except sqlite3.IntegrityError:
+        raise HTTPException(409, "Username or email is already registered")
+    return {"user_id": user_id, "username": user.username, "token": issue_token(user_id)}
+
+
+@app.get("/me")
+async def me(user_id: int = Depends(current_user)):
+    profile = await call("api:me", data.get_user_info, user_id)
+    if profile is None:
+        raise HTTPException(404, "User not found")
+    return {
+        **{field: getattr(profile, field) for field in PROFILE_FIELDS},
+        "bmi": profile.bmi,
+        "suggested_calorie_goal": profile.suggested_calorie_goal,
+    }
+
+
+# Catalog
+@app.get("/meals")
+async def meals(request: Request, q: str = "", dietary_preference: Optional[Preference] = None,
+                meal_type: Optional[MealType] = None,
+                limit: int = Query(data.MEAL_SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                offset: int = Query(0, ge=0)):
+    rows = await call("api:meals", data.search_meals, q, dietary_preference, meal_type, limit, offset)
+    return etag_response(request, records(SEARCH_COLUMNS, rows))
+
+
+@app.get("/meals/{meal_id}")
+async def meal(request: Request, meal_id: int):
+    row = await call("api:meal", data.get_meal_by_id, meal_id)
+    if row is None:
+        raise HTTPException(404, "Meal not found")
+    return etag_response(request, dict(zip(MEAL_COLUMNS, row)))
+
+
+@app.post("/meals", status_code=201)
+async def create_meal(meal: NewMeal, user_id: int = Depends(current_user)):
+    try:
+        meal_id = await call("api:add_meal", data.add_meal, (
+            meal.meal_name, meal.description, meal.calories, meal.protein, meal.carbs, meal.fats,
+            meal.fiber, meal.sugar, meal.sodium, meal.dietary_preference, meal.meal_type, user_id,
+        ))
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(400, f"Could not add meal: {e}")
+    return {"meal_id": meal_id}
+
+
+@app.get("/exercises")
+async def exercises(request: Request):
+    rows = await call("api:exercises", data.get_exercises)
+    return etag_response(request, records(EXERCISE_COLUMNS, rows))
+
+
+# Meal plans
+@app.get("/plans")
+async def plans(start_date: Date, end_date: Optional[Date] = None,
+                user_id: int = Depends(current_user)):
+    end_date = end_date or start_date
+    if (end_date - start_date).days > 366 or end_date < start_date:
+        raise HTTPException(422, "Date range must be between 1 and 366 days")
+    days = await call("api:plans", data.get_user_meal_plans, user_id,
+                      start_date.isoformat(), end_date.isoformat())
+    return {day: records(PLAN_COLUMNS, rows) for day, rows in days.items()}
+
+
+@app.post("/plans", status_code=201)
+async def add_plan(plan: PlannedMeal, user_id: int = Depends(current_user)):
+    try:
+        await call("api:plan_meal", data.plan_meal, user_id, plan.meal_id, plan.date.isoformat(),
+                   plan.portion_size, plan.meal_type)
+    except sqlite3.IntegrityError:
+        raise HTTPException(409, "Meal is already planned for that slot, or does not exist")
+    return {"planned": True}
+
+
+@app.delete("/plans")
+async def remove_plan(meal_id: int, date: Date, meal_type: MealType,
+                      user_id: int = Depends(current_user)):
+    await call("api:remove_plan", data.remove_planned_meal, user_id, meal_id, date.isoformat(), meal_type)
+    return {"removed": True}
+
+
+def _generate(db, user_id, request):
+    import planner
+
+    profile = data.get_user_info(db, user_id)
+    if profile is None:
+        return None
+    plan = planner.generate_plan(
+        db, profile.daily_calorie_goal, profile.fitness_goal, request.dietary_preference,
+        request.start_date, request.days, request.seed
+    )
+    try:
+        saved = request.save and data.plan_meals(db, user_id, plan.rows(), request.replace)
+    except sqlite3.IntegrityError:
+        saved = False
+    return plan, saved
+
+
+def _recommend(db, user_id, day, meal_type, dietary_preference, limit):
+    import planner
+
+    profile = data.get_user_info(db, user_id)
+    if profile is None:
+        return None
+    slot_totals = {row[1]: row[3:7] for row in data.get_nutrition_totals(db, user_id, day, by_meal_type=True)}
+    planned = [sum(totals[i] for totals in slot_totals.values()) for i in range(4)]
+    return planner.recommend(
+        db, profile.daily_calorie_goal, meal_type, planned, slot_totals.keys(), profile.fitness_goal,
+        dietary_preference, limit, [meal[0] for meal in data.get_user_meal_plan(db, user_id, day)]
+    )
+
+
+# Meals of a slot ranked by how well their best portion fits what is left
+# of the day's calorie and macro targets
+@app.get("/recommendations")
+async def recommendations(date: Date, meal_type: MealType, dietary_preference: Preference = "None",
+                          limit: int = Query(data.MEAL_SUGGESTIONS, ge=1, le=MAX_PAGE_SIZE),
+                          user_id: int = Depends(current_user)):
+    rows = await call("api:recommendations", _recommend, user_id, date.isoformat(), meal_type,
+                      dietary_preference, limit)
+    if rows is None:
+        raise HTTPException(404, "User not found")
+    return [
+        {"meal_id": row[0], "meal_name": row[1], "portion_size": row[2],
+         **dict(zip(NUTRIENTS, row[3:7])), "score": round(row[7], 4)}
+        for row in rows
+    ]
+
+
+@app.post("/plans/generate")
+async def generate_plan(request: PlanRequest, user_id: int = Depends(current_user)):
+    result = await call("api:generate_plan", _generate, user_id, request)
+    if result is None:
+        raise HTTPException(404, "User not found")
+    plan, saved = result
+    if request.save and not saved:
+        raise HTTPException(409, "Could not save the generated plan")
+    return {
+        "targets": dict(zip(NUTRIENTS, plan.targets)),
+        "days": [
+            {
+                "date": day,
+                "meals": [
+                    {"meal_type": meal[0], "meal_id": meal[1], "meal_name": meal[2],
+                     "portion_size": meal[3], **dict(zip(NUTRIENTS, meal[4:]))}
+                    for meal in meals
+                ],
+                "totals": dict(zip(NUTRIENTS, totals)),
+            }
+            for day, meals, totals in plan.days
+        ],
+        "saved": bool(saved),
+    }
+
+
+@app.get("/nutrition")
+async def nutrition(start_date: Date, end_date: Optional[Date] = None, by_meal_type: bool = False,
+                    user_id: int = Depends(current_user)):
+    rows = await call("api:nutrition", data.get_nutrition_totals, user_id, start_date.isoformat(),
+                      end_date.isoformat() if end_date else None, by_meal_type)
+    return records(NUTRITION_COLUMNS, rows)
+
+
+# Progress
+@app.get("/progress")
+async def progress(request: Request, start_date: Optional[Date] = None,
+                   end_date: Optional[Date] = None, user_id: int = Depends(current_user)):
+    if (start_date is None) != (end_date is None):
+        raise HTTPException(422, "Pass both start_date and end_date, or neither")
+    rows = await call("api:progress", data.get_user_progress, user_id,
+                      start_date and start_date.isoformat(), end_date and end_date.isoformat())
+    return etag_response(request, records(PROGRESS_COLUMNS, rows))
+
+
+@app.post("/progress", status_code=201)
+async def add_progress(entry: ProgressEntry, user_id: int = Depends(current_user)):
+    try:
+        await call("api:track_progress", data.track_progress, user_id, entry.date.isoformat(),
+                   entry.weight, entry.total_calories, entry.total_protein,
+                   entry.total_carbs, entry.total_fats, entry.notes)
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(400, f"Could not record progress: {e}")
+    return {"recorded": True}
+
+
+# Exercise
+@app.get("/exercise-log")
+async def exercise_log(before_date: Optional[Date] = None, before_id: Optional[int] = None,
+                       limit: int = Query(data.EXERCISE_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       user_id: int = Depends(current_user)):
+    if (before_date is None) != (before_id is None):
+        raise HTTPException(422, "Pass both before_date and before_id, or neither")
+    before = (before_date.isoformat(), before_id) if before_date else None
+    rows = await call("api:exercise_log", data.get_exercise_history, user_id, before, limit + 1)
+    page = records(HISTORY_COLUMNS, rows[:limit])
+    # Keyset cursor of the next page, as in the Exercise History tab
+    following = {"before_date": page[-1]["date"], "before_id": page[-1]["log_id"]} if len(rows) > limit else None
+    return {"entries": page, "next": following}
+
+
+@app.post("/exercise-log", status_code=201)
+async def add_exercise_log(entry: ExerciseEntry, user_id: int = Depends(current_user)):
+    calories = entry.calories_burned
+    if calories is None:
+        per_hour = {row[0]: row[2] for row in await call("api:exercises", data.get_exercises)}
+        if entry.exercise_id not in per_hour:
+            raise HTTPException(404, "Exercise not found")
+        calories = int((per_hour[entry.exercise_id] or 0) * entry.duration_minutes / 60)
+    try:
+        await call("api:log_exercise", data.log_exercise, user_id, entry.exercise_id,
+                   entry.date.isoformat(), entry.duration_minutes, calories)
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(400, f"Could not log exercise: {e}")
+    return {"logged": True, "calories_burned": calories}
+
+
+@app.get("/exercise-totals")
+async def exercise_totals(user_id: int = Depends(current_user)):
+    sessions, calories, minutes = await call("api:exercise_totals", data.get_exercise_totals, user_id)
+    return {"sessions": sessions, "calories_burned": calories, "duration_minutes": minutes}
+
+
+# Query counters of this process, tagged by endpoint, and result cache hits
+# per function, in Prometheus text format
+@app.get("/metrics")
+async def metrics():
+    db = app.state.db
+    return Response(db.queries.prometheus() + db.results.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the meal planner JSON API")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    app.state.db_path = args.db
+    # One worker process: the thread pool and connection pool are per process
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
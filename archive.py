@@ -0,0 +1,249 @@
+import os
+import threading
+from pathlib import Path
+
+from db import archived_through, table_columns
+
+# Directory of the columnar archive; default: "<db name>-archive" next to the database
+ARCHIVE_DIR = os.environ.get("MEAL_PLANNER_ARCHIVE_DIR")
+# Rows per Parquet row group. Parts are sorted by (user_id, date), so the
+# row group statistics let a per-user read skip most of a part.
+ROW_GROUP_SIZE = 50000
+
+# Archived tables: part format and columns, with the Arrow type of each
+# (calories are float64: SQLite may hold fractional values in them, see
+# INTEGER_COLUMNS).
+# Parts hold the rows dated after the previous watermark up to the part's
+# own, sorted by (user_id, date). Plans are read rarely and compress well,
+# so they are Parquet; history is read for every long-range chart, so it is
+# uncompressed Arrow IPC that is memory-mapped instead of decoded.
+ARCHIVE_TABLES = {
+    "UserMealPlans": ("parquet", (
+        ("user_id", "int64"), ("meal_id", "int64"), ("date", "string"),
+        ("portion_size", "float64"), ("meal_type", "string"),
+    )),
+    "Progress": ("arrow", (
+        ("user_id", "int64"), ("date", "string"), ("weight", "float64"), ("total_calories", "float64"),
+        ("total_protein", "float64"), ("total_carbs", "float64"), ("total_fats", "float64"),
+        ("notes", "string"),
+    )),
+    "UserExercises": ("arrow", (
+        ("user_id", "int64"), ("log_id", "int64"), ("exercise_id", "int64"), ("date", "string"),
+        ("duration_minutes", "float64"), ("calories_burned", "float64"), ("notes", "string"),
+        ("created_at", "string"),
+    )),
+}
+# Columns with INTEGER affinity archived as float64. Read back as Python
+# values, whole numbers become int again, as SQLite stores them.
+INTEGER_COLUMNS = {
+    "Progress": ("total_calories",),
+    "UserExercises": ("calories_burned",),
+}
+# Per-user aggregates kept in SQLite for the rows leaving a table, so
+# rollups rebuilt from the table stay complete. Parameters: (since, through).
+ARCHIVE_ROLLUPS = {
+    "UserExercises": '''
+        INSERT INTO main.ArchivedExerciseTotals (user_id, sessions, calories_burned, duration_minutes)
+        SELECT user_id, COUNT(*), TOTAL(calories_burned), TOTAL(duration_minutes)
+        FROM main.UserExercises
+        WHERE date > ? AND date <= ?
+        GROUP BY user_id
+        ON CONFLICT(user_id) DO UPDATE SET
+            sessions = sessions + excluded.sessions,
+            calories_burned = calories_burned + excluded.calories_burned,
+            duration_minutes = duration_minutes + excluded.duration_minutes
+    ''',
+}
+
+
+def archive_dir(db):
+    if ARCHIVE_DIR:
+        return Path(ARCHIVE_DIR)
+    path = Path(db.path).absolute()
+    return path.with_name(f"{path.stem}-archive")
+
+
+def _schema(table):
+    import pyarrow as pa
+
+    return pa.schema([(name, getattr(pa, kind)()) for name, kind in ARCHIVE_TABLES[table][1]])
+
+
+def _write_part(data, path, kind):
+    import pyarrow as pa
+
+    temporary = path.with_name(f".{path.name}.tmp")  # dot files are not read as parts
+    if kind == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(data, temporary, compression="zstd", row_group_size=ROW_GROUP_SIZE)
+    else:
+        # One record batch, so every column maps to a single contiguous buffer
+        with pa.OSFile(str(temporary), "wb") as sink, pa.ipc.new_file(sink, data.schema) as writer:
+            writer.write_table(data, max_chunksize=max(data.num_rows, 1))
+    os.replace(temporary, path)
+
+
+# Move the rows of `table` dated up to `through` from one database (the
+# global one or a shard) into a part named after the watermark and the
+# shard, then advance the watermark. The part is written while the write
+# transaction is open and replaced atomically, so running it again after a
+# crash rewrites the same part from the same rows. Returns rows moved.
+def archive_rows(source, table, through, directory, part):
+    import pyarrow as pa
+
+    kind, columns = ARCHIVE_TABLES[table]
+    with source.write() as conn:
+        since = archived_through(conn, table)
+        if through <= since:
+            return 0
+        # Columns a not yet migrated table lacks are archived as nulls
+        present = table_columns(conn, table)
+        selected = ", ".join(name if name in present else f"NULL AS {name}" for name, _ in columns)
+        rows = conn.execute(f'''
+            SELECT {selected} FROM main.{table}
+            WHERE date > ? AND date <= ?
+            ORDER BY user_id, date, rowid
+        ''', (since, through)).fetchall()
+        if rows:
+            path = directory / table / f"{through}-{part}.{kind}"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            schema = _schema(table)
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            _write_part(pa.Table.from_arrays(arrays, schema=schema), path, kind)
+            if table in ARCHIVE_ROLLUPS:
+                conn.execute(ARCHIVE_ROLLUPS[table], (since, through))
+            conn.execute(f"DELETE FROM main.{table} WHERE date > ? AND date <= ?", (since, through))
+        conn.execute('''
+            INSERT INTO main.ArchiveWatermarks (table_name, through_date) VALUES (?, ?)
+            ON CONFLICT(table_name) DO UPDATE SET through_date = excluded.through_date
+        ''', (table, through))
+    return len(rows)
+
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def _version(path):
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+# Dataset over a table's Parquet parts, reopened when a part is added
+def _dataset(directory, table):
+    import pyarrow.dataset as ds
+
+    path = directory / table
+    version = _version(path)
+    if version is None:
+        return None
+    with _datasets_lock:
+        cached = _datasets.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    dataset = ds.dataset(path, schema=_schema(table), format="parquet")
+    with _datasets_lock:
+        _datasets[path] = (version, dataset)
+    return dataset
+
+
+# Memory-mapped Arrow parts of a table, oldest first: [(file, mtime, table,
+# user_id array)]. Nothing is read until a column is touched, and the
+# user_id array is a view of the mapped file. Parts already mapped are kept
+# when a new one appears.
+def _mapped_parts(directory, table):
+    import pyarrow as pa
+
+    path = directory / table
+    version = _version(path)
+    if version is None:
+        return []
+    with _datasets_lock:
+        cached = _datasets.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    mapped = {(name, mtime): (data, users) for name, mtime, data, users in (cached[1] if cached else ())}
+    parts = []
+    for file in sorted(path.glob("*.arrow")):
+        if file.name.startswith("."):
+            continue
+        mtime = file.stat().st_mtime_ns
+        if (file.name, mtime) in mapped:
+            data, users = mapped[file.name, mtime]
+        else:
+            data = pa.ipc.open_file(pa.memory_map(str(file))).read_all()
+            users = data.column("user_id").to_numpy()
+        parts.append((file.name, mtime, data, users))
+    with _datasets_lock:
+        _datasets[path] = (version, parts)
+    return parts
+
+
+# Rows of a part between two dates; one user's rows are sorted by date, so
+# their range is a zero-copy slice
+def _date_range(data, start_date, end_date, sorted_dates):
+    import pyarrow.compute as pc
+
+    dates = data.column("date")
+    if not sorted_dates:
+        return data.filter(pc.and_(pc.greater_equal(dates, start_date), pc.less_equal(dates, end_date)))
+    first = pc.sum(pc.less(dates, start_date)).as_py() or 0
+    last = pc.sum(pc.less_equal(dates, end_date)).as_py() or 0
+    return data.slice(first, max(last - first, 0))
+
+
+# Archived rows of `table` between two dates (inclusive) as an Arrow table
+# in ARCHIVE_TABLES column order, for the given users (None: every user).
+# Each user's rows come out sorted by date.
+def read_table(db, table, user_ids, start_date, end_date):
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    start_date, end_date = str(start_date), str(end_date)
+    directory = archive_dir(db)
+    if ARCHIVE_TABLES[table][0] == "parquet":
+        dataset = _dataset(directory, table)
+        if dataset is None:
+            return _schema(table).empty_table()
+        condition = (ds.field("date") >= start_date) & (ds.field("date") <= end_date)
+        if user_ids is not None:
+            condition &= ds.field("user_id").isin([int(u) for u in user_ids])
+        return dataset.to_table(filter=condition).sort_by([("user_id", "ascending"), ("date", "ascending")])
+
+    pieces = []
+    wanted = None if user_ids is None else np.unique(np.asarray(list(user_ids), dtype=np.int64))
+    for _, _, data, users in _mapped_parts(directory, table):
+        if wanted is None:
+            pieces.append(_date_range(data, start_date, end_date, False))
+            continue
+        # Binary search of each user's run of rows in the sorted user_id column
+        firsts = np.searchsorted(users, wanted, "left")
+        lasts = np.searchsorted(users, wanted, "right")
+        for first, last in zip(firsts[firsts < lasts], lasts[firsts < lasts]):
+            pieces.append(_date_range(data.slice(first, last - first), start_date, end_date, True))
+    pieces = [piece for piece in pieces if piece.num_rows]
+    return pa.concat_tables(pieces) if pieces else _schema(table).empty_table()
+
+
+# A column of an archived table as Python values of the types SQLite returns
+def column_values(table, data, name):
+    values = data.column(name).to_pylist()
+    if name in INTEGER_COLUMNS.get(table, ()):
+        return [int(value) if value is not None and value.is_integer() else value for value in values]
+    return values
+
+
+# A user's archived rows of `table` between two dates (inclusive), as
+# tuples in ARCHIVE_TABLES column order sorted by date
+def read_rows(db, table, user_id, start_date, end_date):
+    data = read_table(db, table, [user_id], start_date, end_date)
+    return list(zip(*(column_values(table, data, name) for name in data.column_names)))
+
+
+# Archived rows as a DataFrame (numeric columns without nulls are not copied)
+def read_frame(db, table, user_ids, start_date, end_date):
+    return read_table(db, table, user_ids, start_date, end_date).to_pandas()
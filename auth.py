@@ -0,0 +1,126 @@
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Current scrypt cost parameters. Stored hashes carry their own parameters
+# ("scrypt$n$r$p$salt$hash"), so these can be raised later and old hashes
+# are upgraded on the next successful login.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_DKLEN = 32
+SALT_BYTES = 16
+SCRYPT_MAXMEM = 64 * 1024 * 1024
+
+# The KDF runs on a bounded pool (hashlib.scrypt releases the GIL), so a burst
+# of logins uses at most this many cores and other sessions keep rerunning
+KDF_WORKERS = int(os.environ.get("MEAL_PLANNER_KDF_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+KDF_TIMEOUT = 30.0
+# Shown when a hash or check waits past KDF_TIMEOUT for the pool
+KDF_BUSY = "Too many sign-ins at once, please try again in a moment"
+# Shortest password accepted at registration or on a password change
+MIN_PASSWORD_LENGTH = 8
+
+_executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+
+
+def compute_hash(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, salt=None):
+    salt = salt if salt is not None else secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, dklen=SCRYPT_DKLEN, maxmem=SCRYPT_MAXMEM
+    )
+    return f"scrypt${n}${r}${p}${salt.hex()}${digest.hex()}"
+
+
+def is_legacy(stored):
+    return not stored.startswith("scrypt$")
+
+
+# Compare against a stored scrypt hash, or an unsalted SHA-256 hex digest
+# written before scrypt was introduced
+def check_hash(password, stored):
+    if is_legacy(stored):
+        candidate = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(candidate, stored)
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        candidate = hashlib.scrypt(
+            password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p),
+            dklen=len(digest) // 2, maxmem=SCRYPT_MAXMEM
+        )
+    except ValueError:
+        return False
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
+def needs_rehash(stored):
+    if is_legacy(stored):
+        return True
+    params = stored.split("$")[1:4]
+    return params != [str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+
+
+# Why a new password is rejected, or None if it is acceptable. Shared by the
+# UI forms and the API's request models.
+def password_problem(password):
+    if len(password) < MIN_PASSWORD_LENGTH:
+        return f"Password must be at least {MIN_PASSWORD_LENGTH} characters long"
+    return None
+
+
+# Run fn on the KDF pool and return its future, for callers that wait
+# without blocking a thread (the API's event loop)
+def submit(fn, *args):
+    return _executor.submit(fn, *args)
+
+
+# Blocking wrappers that run the KDF on the shared pool
+def hash_password(password):
+    return _executor.submit(compute_hash, password).result(timeout=KDF_TIMEOUT)
+
+
+def verify_password(password, stored):
+    return _executor.submit(check_hash, password, stored).result(timeout=KDF_TIMEOUT)
+
+
+_dummy_hash = None
+
+
+# Verified against unknown usernames so they take as long as real ones;
+# computed on first use to keep the KDF out of app startup
+def dummy_hash():
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = compute_hash(secrets.token_hex(8))
+    return _dummy_hash
+
+
+# Logins per second at the current parameters, using `threads` concurrent verifiers
+def benchmark(seconds=3.0, threads=None):
+    threads = threads or os.cpu_count() or 1
+    stored = compute_hash("correct horse battery staple")
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        count = 0
+        while time.perf_counter() < deadline:
+            check_hash("correct horse battery staple", stored)
+            count += 1
+        return count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        total = sum(pool.map(lambda _: worker(), range(threads)))
+    elapsed = time.perf_counter() - start
+    cores = min(threads, os.cpu_count() or 1)
+    return {
+        "params": f"n={SCRYPT_N} r={SCRYPT_R} p={SCRYPT_P}",
+        "threads": threads,
+        "logins": total,
+        "seconds": elapsed,
+        "logins_per_second": total / elapsed,
+        "logins_per_second_per_core": total / elapsed / cores,
+    }
@@ -0,0 +1,432 @@
+import argparse
+import fnmatch
+import http.client
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from datetime import date, timedelta
+
+import analytics
+import data
+import planner
+from db import migrate
+from seed import FLAVOURS, MAIN_INGREDIENTS, SEED_PASSWORD
+from shards import ShardedDatabase
+
+# Headless benchmarks for the data functions in data.py and for the full set
+# of queries each page issues per rerun. Nothing is rendered and Streamlit is
+# not needed. Write benchmarks insert rows, so run against a seeded copy (see
+# seed.py), not a real database.
+
+PREFERENCES = ("None", "Vegetarian", "Vegan", "Gluten-Free", "Keto", "Paleo")
+MEAL_TYPES = ("Breakfast", "Lunch", "Dinner", "Snack")
+
+
+class Context:
+    def __init__(self, db):
+        self.db = db
+        self.today = date.today()
+        with db.read() as conn:
+            self.max_user_id = conn.execute("SELECT COALESCE(MAX(user_id), 0) FROM Users").fetchone()[0]
+            self.max_meal_id = conn.execute("SELECT COALESCE(MAX(meal_id), 0) FROM Meals").fetchone()[0]
+            self.exercises = [row[0] for row in conn.execute("SELECT exercise_id FROM Exercises")]
+        days = []
+        for shard in db.all_shards():
+            with shard.read() as conn:
+                days.append(conn.execute('''
+                    SELECT MAX(date) FROM (
+                        SELECT MAX(date) AS date FROM UserMealPlans
+                        UNION ALL SELECT MAX(date) FROM Progress
+                        UNION ALL SELECT MAX(date) FROM UserExercises
+                    )
+                ''').fetchone()[0])
+        latest = max((day for day in days if day), default=None)
+        if not (self.max_user_id and self.max_meal_id and self.exercises):
+            raise ValueError("database has no users, meals or exercises; run seed.py first")
+        self._last_day = max(self.today, date.fromisoformat(latest)) if latest else self.today
+        self._lock = threading.Lock()
+
+    def user(self, rng):
+        return rng.randint(1, self.max_user_id)
+
+    def day(self, rng, within=90):
+        return (self.today - timedelta(days=rng.randrange(within))).isoformat()
+
+    # Dates after everything already stored, so write benchmarks (including
+    # repeated runs) never hit UNIQUE constraints
+    def future_day(self):
+        with self._lock:
+            self._last_day += timedelta(days=1)
+            return self._last_day.isoformat()
+
+
+def _search_text(rng):
+    word = rng.choice(FLAVOURS + MAIN_INGREDIENTS)
+    return word[:rng.randint(2, len(word))]
+
+
+# Single data functions
+def bench_get_user_info(ctx, rng):
+    data.get_user_info(ctx.db, ctx.user(rng))
+
+def bench_get_user_meal_plan(ctx, rng):
+    data.get_user_meal_plan(ctx.db, ctx.user(rng), ctx.day(rng))
+
+def bench_get_user_meal_plans_week(ctx, rng):
+    start = ctx.today - timedelta(days=rng.randrange(90))
+    data.get_user_meal_plans(ctx.db, ctx.user(rng), start.isoformat(), (start + timedelta(days=6)).isoformat())
+
+def bench_get_daily_nutrition(ctx, rng):
+    data.get_daily_nutrition(ctx.db, ctx.user(rng), ctx.day(rng))
+
+def bench_get_user_progress_month(ctx, rng):
+    data.get_user_progress(ctx.db, ctx.user(rng), ctx.day(rng, 30), ctx.today.isoformat())
+
+def bench_get_user_progress_all(ctx, rng):
+    data.get_user_progress(ctx.db, ctx.user(rng))
+
+def bench_search_meals_browse(ctx, rng):
+    data.search_meals(ctx.db, "", rng.choice(PREFERENCES), rng.choice(MEAL_TYPES),
+                      limit=data.MEAL_SEARCH_PAGE_SIZE, offset=data.MEAL_SEARCH_PAGE_SIZE * rng.randrange(5))
+
+def bench_search_meals_text(ctx, rng):
+    data.search_meals(ctx.db, _search_text(rng), rng.choice(PREFERENCES), rng.choice(MEAL_TYPES),
+                      limit=data.MEAL_SEARCH_PAGE_SIZE)
+
+def bench_recommend_meals(ctx, rng):
+    calorie_goal = rng.randint(1500, 3000)
+    planned = (calorie_goal * rng.random() * 0.6, 40.0, 90.0, 25.0)
+    planner.recommend(ctx.db, calorie_goal, rng.choice(MEAL_TYPES), planned, ("Breakfast",),
+                      "Maintenance", rng.choice(PREFERENCES), k=data.MEAL_SUGGESTIONS)
+
+def bench_get_exercises(ctx, rng):
+    data.get_exercises(ctx.db)
+
+def bench_get_exercise_history(ctx, rng):
+    data.get_exercise_history(ctx.db, ctx.user(rng), limit=data.EXERCISE_PAGE_SIZE + 1)
+
+def bench_get_exercise_totals(ctx, rng):
+    data.get_exercise_totals(ctx.db, ctx.user(rng))
+
+def bench_plan_meal(ctx, rng):
+    data.plan_meal(ctx.db, ctx.user(rng), rng.randint(1, ctx.max_meal_id), ctx.future_day(),
+                   rng.choice((0.5, 1.0, 1.5)), rng.choice(MEAL_TYPES))
+
+def bench_track_progress(ctx, rng):
+    data.track_progress(ctx.db, ctx.user(rng), ctx.future_day(), round(rng.uniform(50, 110), 1),
+                        rng.randint(1200, 3500), 100.0, 250.0, 70.0)
+
+def bench_log_exercise(ctx, rng):
+    data.log_exercise(ctx.db, ctx.user(rng), rng.choice(ctx.exercises), ctx.future_day(), 30, 250)
+
+
+# The queries one rerun of each page issues with its default inputs
+def page_dashboard(ctx, rng):
+    data.get_user_info(ctx.db, ctx.user(rng))
+
+def page_meal_planner(ctx, rng):
+    user_id, day = ctx.user(rng), ctx.day(rng)
+    preference = rng.choice(PREFERENCES)
+    profile = data.get_user_info(ctx.db, user_id)
+    planned = data.get_user_meal_plan(ctx.db, user_id, day)
+    slot_totals = {row[1]: row[3:7] for row in data.get_nutrition_totals(ctx.db, user_id, day, by_meal_type=True)}
+    totals = [sum(values[i] for values in slot_totals.values()) for i in range(4)]
+    for meal_type in MEAL_TYPES:
+        planner.recommend(ctx.db, profile.daily_calorie_goal, meal_type, totals, slot_totals.keys(),
+                          profile.fitness_goal, preference, data.MEAL_SUGGESTIONS, [meal[0] for meal in planned])
+        data.search_meals(ctx.db, "", preference, meal_type, limit=data.MEAL_SEARCH_PAGE_SIZE)
+    data.get_daily_nutrition(ctx.db, user_id, day)
+    end = (date.fromisoformat(day) + timedelta(days=6)).isoformat()
+    data.get_user_meal_plans(ctx.db, user_id, day, end)
+
+def page_track_progress(ctx, rng):
+    user_id = ctx.user(rng)
+    data.get_user_info(ctx.db, user_id)
+    data.get_daily_nutrition(ctx.db, user_id, ctx.today.isoformat())
+
+def page_view_progress(ctx, rng):
+    user_id = ctx.user(rng)
+    with ctx.db.shard(user_id).read() as conn:
+        analytics.daily_report(conn, [user_id], ctx.today - timedelta(days=30), ctx.today, ctx.db)
+
+# Multi-year chart: mostly archived days once the archive_history job has run
+def page_view_progress_years(ctx, rng):
+    user_id = ctx.user(rng)
+    with ctx.db.shard(user_id).read() as conn:
+        analytics.daily_report(conn, [user_id], ctx.today - timedelta(days=3 * 365), ctx.today, ctx.db)
+
+def page_exercise_log(ctx, rng):
+    user_id = ctx.user(rng)
+    data.get_exercises(ctx.db)
+    data.get_exercise_history(ctx.db, user_id, limit=data.EXERCISE_PAGE_SIZE + 1)
+    data.get_exercise_totals(ctx.db, user_id)
+
+def page_profile_settings(ctx, rng):
+    data.get_user_info(ctx.db, ctx.user(rng))
+
+
+BENCHMARKS = {
+    "get_user_info": bench_get_user_info,
+    "get_user_meal_plan": bench_get_user_meal_plan,
+    "get_user_meal_plans_week": bench_get_user_meal_plans_week,
+    "get_daily_nutrition": bench_get_daily_nutrition,
+    "get_user_progress_month": bench_get_user_progress_month,
+    "get_user_progress_all": bench_get_user_progress_all,
+    "search_meals_browse": bench_search_meals_browse,
+    "search_meals_text": bench_search_meals_text,
+    "recommend_meals": bench_recommend_meals,
+    "get_exercises": bench_get_exercises,
+    "get_exercise_history": bench_get_exercise_history,
+    "get_exercise_totals": bench_get_exercise_totals,
+    "plan_meal": bench_plan_meal,
+    "track_progress": bench_track_progress,
+    "log_exercise": bench_log_exercise,
+    "page:dashboard": page_dashboard,
+    "page:meal_planner": page_meal_planner,
+    "page:track_progress": page_track_progress,
+    "page:view_progress": page_view_progress,
+    "page:view_progress_years": page_view_progress_years,
+    "page:exercise_log": page_exercise_log,
+    "page:profile_settings": page_profile_settings,
+}
+
+
+# Client of a running API server (api.py) for load tests over HTTP. Each
+# thread keeps its own keep-alive connection; requests are made as one of
+# `users` seeded accounts, logged in once up front.
+class ApiContext:
+    def __init__(self, url, users=20):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.today = date.today()
+        self._local = threading.local()
+        self.tokens = [
+            self.request("POST", "/login", body={"username": f"user{i}", "password": SEED_PASSWORD})["token"]
+            for i in range(1, users + 1)
+        ]
+        self.exercises = [row["exercise_id"] for row in self.request("GET", "/exercises")]
+        self._etags = {}
+
+    def request(self, method, path, token=None, body=None, params=None, etag=False):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        if params:
+            path += "?" + urllib.parse.urlencode(params)
+        if etag and path in self._etags:
+            headers["If-None-Match"] = self._etags[path]
+        try:
+            connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path}: {response.status} {data[:200]!r}")
+        if etag and response.getheader("ETag"):
+            self._etags[path] = response.getheader("ETag")
+        return json.loads(data) if data else None
+
+    def token(self, rng):
+        return rng.choice(self.tokens)
+
+    def day(self, rng, within=90):
+        return (self.today - timedelta(days=rng.randrange(within))).isoformat()
+
+
+def api_me(ctx, rng):
+    ctx.request("GET", "/me", ctx.token(rng))
+
+def api_search_meals(ctx, rng):
+    ctx.request("GET", "/meals", params={
+        "q": _search_text(rng), "meal_type": rng.choice(MEAL_TYPES), "limit": data.MEAL_SEARCH_PAGE_SIZE,
+    })
+
+def api_exercises_revalidate(ctx, rng):
+    ctx.request("GET", "/exercises", etag=True)
+
+def api_plans_week(ctx, rng):
+    start = ctx.today - timedelta(days=rng.randrange(90))
+    ctx.request("GET", "/plans", ctx.token(rng), params={
+        "start_date": start.isoformat(), "end_date": (start + timedelta(days=6)).isoformat(),
+    })
+
+def api_nutrition(ctx, rng):
+    ctx.request("GET", "/nutrition", ctx.token(rng), params={"start_date": ctx.day(rng)})
+
+def api_progress_month(ctx, rng):
+    ctx.request("GET", "/progress", ctx.token(rng), params={
+        "start_date": ctx.day(rng, 30), "end_date": ctx.today.isoformat(),
+    })
+
+def api_exercise_log(ctx, rng):
+    ctx.request("GET", "/exercise-log", ctx.token(rng))
+
+def api_track_progress(ctx, rng):
+    ctx.request("POST", "/progress", ctx.token(rng), body={
+        "date": ctx.day(rng), "weight": round(rng.uniform(50, 110), 1),
+    })
+
+def api_log_exercise(ctx, rng):
+    ctx.request("POST", "/exercise-log", ctx.token(rng), body={
+        "exercise_id": rng.choice(ctx.exercises), "date": ctx.day(rng), "duration_minutes": 30,
+    })
+
+
+API_BENCHMARKS = {
+    "api:me": api_me,
+    "api:search_meals": api_search_meals,
+    "api:exercises_revalidate": api_exercises_revalidate,
+    "api:plans_week": api_plans_week,
+    "api:nutrition": api_nutrition,
+    "api:progress_month": api_progress_month,
+    "api:exercise_log": api_exercise_log,
+    "api:track_progress": api_track_progress,
+    "api:log_exercise": api_log_exercise,
+}
+
+
+# Run `fn` `iterations` times split across `threads` workers (each with its
+# own seeded RNG). Returns latency percentiles and overall throughput.
+def run(ctx, fn, iterations, threads=1, warmup=20, seed=0, cold_cache=False):
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        fn(ctx, rng)
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(index, count):
+        rng = random.Random(seed * 1000 + index)
+        local = []
+        for _ in range(count):
+            if cold_cache and hasattr(ctx, "db"):
+                ctx.db.catalog.invalidate()
+                ctx.db.results.clear()
+            started = time.perf_counter()
+            fn(ctx, rng)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    shares = [iterations // threads + (1 if i < iterations % threads else 0) for i in range(threads)]
+    workers = [threading.Thread(target=worker, args=(i, count)) for i, count in enumerate(shares)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "iterations": len(latencies),
+        "p50_ms": cuts[49] * 1000,
+        "p99_ms": cuts[98] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "ops_per_sec": len(latencies) / elapsed,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<28}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>12}")
+    for name, result in results.items():
+        line = f"{name:<28}{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['ops_per_sec']:>12.1f}"
+        previous = (baseline or {}).get(name)
+        if previous:
+            line += (f"   p50 {result['p50_ms'] / previous['p50_ms']:.2f}x"
+                     f"  p99 {result['p99_ms'] / previous['p99_ms']:.2f}x")
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the meal planner data-access layer")
+    parser.add_argument("--db", default="meal_planner.db", help="seeded SQLite database (see seed.py)")
+    parser.add_argument("--only", action="append", help="glob of benchmark names, e.g. 'page:*' (repeatable)")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=1, help="concurrent callers sharing one Database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--group-commit", action="store_true", help="batch concurrent writes (see Database)")
+    parser.add_argument("--cold-cache", action="store_true", help="clear the catalog and result caches before every call")
+    parser.add_argument("--json", help="write results (with the git commit) to this file")
+    parser.add_argument("--compare", help="results file from an earlier run to compare against")
+    parser.add_argument("--api", metavar="URL", help="load test a running API server instead, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--api-users", type=int, default=20, help="seeded accounts the API load test logs in as")
+    parser.add_argument("--list", action="store_true", help="list benchmark names and exit")
+    args = parser.parse_args(argv)
+
+    benchmarks = API_BENCHMARKS if args.api else BENCHMARKS
+    if args.list:
+        print("\n".join(benchmarks))
+        return 0
+    names = [
+        name for name in benchmarks
+        if not args.only or any(fnmatch.fnmatch(name, pattern) for pattern in args.only)
+    ]
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    if args.api:
+        try:
+            ctx = ApiContext(args.api, args.api_users)
+            results = {
+                name: run(ctx, API_BENCHMARKS[name], args.iterations, args.threads, seed=args.seed)
+                for name in names
+            }
+        except (OSError, RuntimeError) as e:
+            print(e, file=sys.stderr)
+            return 1
+    else:
+        db = ShardedDatabase(args.db, group_commit=args.group_commit)
+        try:
+            migrate(db)
+            ctx = Context(db)
+            results = {
+                name: run(ctx, BENCHMARKS[name], args.iterations, args.threads,
+                          seed=args.seed, cold_cache=args.cold_cache)
+                for name in names
+            }
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        finally:
+            db.close()
+
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "db": args.api or args.db,
+                "iterations": args.iterations,
+                "threads": args.threads,
+                "cold_cache": args.cold_cache,
+                "group_commit": args.group_commit,
+                "results": results,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,431 @@
+import csv
+import json
+import sqlite3
+from datetime import date as Date
+from pathlib import Path
+
+from db import add_exercise_totals, refresh_daily_nutrition
+
+DIETARY_PREFERENCES = ("None", "Vegetarian", "Vegan", "Gluten-Free", "Keto", "Paleo")
+MEAL_TYPES = ("Breakfast", "Lunch", "Dinner", "Snack")
+
+
+# Column validators mirroring the CHECK / NOT NULL constraints in schema.sql.
+# Each takes the raw CSV/JSON value and returns the value to insert or raises ValueError.
+def _empty(value):
+    return value is None or (isinstance(value, str) and value.strip() == "")
+
+def text(required=False, choices=None):
+    def check(value):
+        if _empty(value):
+            if required:
+                raise ValueError("is required")
+            return None
+        value = str(value).strip()
+        if choices and value not in choices:
+            raise ValueError(f"must be one of {', '.join(choices)}")
+        return value
+    return check
+
+def number(cast, required=False, minimum=None, exclusive_minimum=None, maximum=None, default=None):
+    def check(value):
+        if _empty(value):
+            if required:
+                raise ValueError("is required")
+            return default
+        number = float(value)
+        if cast is int:
+            if not number.is_integer():
+                raise ValueError("must be a whole number")
+            number = int(number)
+        if minimum is not None and number < minimum:
+            raise ValueError(f"must be >= {minimum}")
+        if exclusive_minimum is not None and number <= exclusive_minimum:
+            raise ValueError(f"must be > {exclusive_minimum}")
+        if maximum is not None and number > maximum:
+            raise ValueError(f"must be <= {maximum}")
+        return number
+    return check
+
+def iso_date(value):
+    if _empty(value):
+        raise ValueError("is required")
+    return Date.fromisoformat(str(value).strip()).isoformat()
+
+
+# Importable/exportable tables: target table, primary key, and validated columns
+KINDS = {
+    "meals": {
+        "table": "Meals",
+        "key": "meal_id",
+        "insert": "INSERT",
+        "columns": {
+            "meal_name": text(required=True),
+            "description": text(),
+            "calories": number(int, required=True, minimum=0),
+            "protein": number(float, minimum=0),
+            "carbs": number(float, minimum=0),
+            "fats": number(float, minimum=0),
+            "fiber": number(float, minimum=0),
+            "sugar": number(float, minimum=0),
+            "sodium": number(float, minimum=0),
+            "dietary_preference": text(choices=DIETARY_PREFERENCES),
+            "meal_type": text(choices=MEAL_TYPES),
+            "created_by": number(int),
+        },
+    },
+    "plans": {
+        "table": "UserMealPlans",
+        "key": "plan_id",
+        "insert": "INSERT",
+        "references": {"meal_id": "Meals"},
+        "columns": {
+            "user_id": number(int, required=True),
+            "meal_id": number(int, required=True),
+            "date": iso_date,
+            "portion_size": number(float, exclusive_minimum=0, default=1.0),
+            "meal_type": text(choices=MEAL_TYPES),
+        },
+    },
+    "progress": {
+        "table": "Progress",
+        "key": "progress_id",
+        "insert": "INSERT OR REPLACE",  # one entry per user per day, like track_progress
+        "columns": {
+            "user_id": number(int, required=True),
+            "date": iso_date,
+            "weight": number(float, exclusive_minimum=0),
+            "total_calories": number(int, minimum=0),
+            "total_protein": number(float, minimum=0),
+            "total_carbs": number(float, minimum=0),
+            "total_fats": number(float, minimum=0),
+            "notes": text(),
+        },
+    },
+    "exercise_logs": {
+        "table": "UserExercises",
+        "key": "log_id",
+        "insert": "INSERT",
+        "references": {"exercise_id": "Exercises"},
+        "columns": {
+            "user_id": number(int, required=True),
+            "exercise_id": number(int, required=True),
+            "date": iso_date,
+            "duration_minutes": number(float, exclusive_minimum=0),
+            "calories_burned": number(int, minimum=0),
+        },
+    },
+}
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return "csv" if Path(path).suffix.lower() == ".csv" else "jsonl"
+
+
+# Yield (position, record, error) without loading the whole file. A JSONL
+# line that does not parse to an object comes back as its text with the
+# error, to be rejected like a record failing validation.
+def read_records(path, fmt):
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for position, record in enumerate(csv.DictReader(f), start=1):
+                yield position, record, None
+        else:
+            position = 0
+            for line in f:
+                if line.strip():
+                    position += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        yield position, line.rstrip("\r\n"), f"invalid JSON: {e}"
+                        continue
+                    if isinstance(record, dict):
+                        yield position, record, None
+                    else:
+                        yield position, record, "record is not a JSON object"
+
+
+def validate(spec, record):
+    values = []
+    for column, check in spec["columns"].items():
+        try:
+            values.append(check(record.get(column)))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{column} {e}") from None
+    return tuple(values)
+
+
+class ImportResult:
+    __slots__ = ("loaded", "rejected", "position", "resumed_from")
+
+    def __init__(self, loaded=0, rejected=0, position=0, resumed_from=0):
+        self.loaded = loaded
+        self.rejected = rejected
+        self.position = position
+        self.resumed_from = resumed_from
+
+
+def _checkpoint(conn, source, kind):
+    row = conn.execute('''
+        SELECT position, loaded, rejected, completed
+        FROM ImportCheckpoints WHERE source = ? AND kind = ?
+    ''', (source, kind)).fetchone()
+    return row or (0, 0, 0, 0)
+
+
+def _save_checkpoint(conn, source, kind, result, completed=False):
+    conn.execute('''
+        INSERT OR REPLACE INTO ImportCheckpoints
+            (source, kind, position, loaded, rejected, completed, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (source, kind, result.position, result.loaded, result.rejected, int(completed)))
+
+
+# Insert one batch with executemany; if a constraint fails (duplicate,
+# missing foreign key) fall back to row-by-row savepoints so only the
+# offending rows are rejected. Returns the failed (position, record, error).
+def _insert_batch(conn, sql, batch):
+    try:
+        conn.execute("SAVEPOINT bulk_batch")
+        conn.executemany(sql, [values for _, _, values in batch])
+        conn.execute("RELEASE bulk_batch")
+        return []
+    except sqlite3.IntegrityError:
+        conn.execute("ROLLBACK TO bulk_batch")
+        conn.execute("RELEASE bulk_batch")
+    failed = []
+    for position, record, values in batch:
+        conn.execute("SAVEPOINT bulk_row")
+        try:
+            conn.execute(sql, values)
+            conn.execute("RELEASE bulk_row")
+        except sqlite3.IntegrityError as e:
+            conn.execute("ROLLBACK TO bulk_row")
+            conn.execute("RELEASE bulk_row")
+            failed.append((position, record, str(e)))
+    return failed
+
+
+# Group per-user rows by the database holding their user (see
+# Database.shard). Rows of unknown users are returned as rejected.
+def _partition(db, batch):
+    parts, rejected, targets = {}, [], {}
+    for position, record, values in batch:
+        user_id = values[0]
+        if user_id not in targets:
+            try:
+                targets[user_id] = db.shard(user_id)
+            except sqlite3.IntegrityError:
+                targets[user_id] = None
+        if targets[user_id] is None:
+            rejected.append((position, record, "FOREIGN KEY constraint failed"))
+        else:
+            parts.setdefault(targets[user_id], []).append((position, record, values))
+    return list(parts.items()), rejected
+
+
+# Shard tables have no foreign keys into the global catalog, so check the
+# referenced ids there first. Returns (rows to insert, rejected rows).
+def _check_references(conn, spec, columns, batch):
+    missing = set()
+    for column, table in spec.get("references", {}).items():
+        index = columns.index(column)
+        ids = json.dumps(sorted({values[index] for _, _, values in batch}))
+        missing.update((index, row[0]) for row in conn.execute(f'''
+            SELECT value FROM json_each(?)
+            WHERE value NOT IN (SELECT {column} FROM {table})
+        ''', (ids,)))
+    if not missing:
+        return batch, []
+    indexes = {index for index, _ in missing}
+    valid, rejected = [], []
+    for item in batch:
+        if any((index, item[2][index]) in missing for index in indexes):
+            rejected.append((item[0], item[1], "FOREIGN KEY constraint failed"))
+        else:
+            valid.append(item)
+    return valid, rejected
+
+
+# Fold the inserted exercise logs of a batch into ExerciseTotals
+def _add_exercise_totals(conn, batch, failed):
+    failed_positions = {position for position, _, _ in failed}
+    totals = {}
+    for position, _, (user_id, _, _, minutes, calories) in batch:
+        if position not in failed_positions:
+            sessions, burned, duration = totals.get(user_id, (0, 0, 0.0))
+            totals[user_id] = (sessions + 1, burned + (calories or 0), duration + (minutes or 0))
+    for user_id, (sessions, burned, duration) in totals.items():
+        add_exercise_totals(conn, user_id, burned, duration, sessions)
+
+
+# Stream a CSV/JSONL file into one of KINDS in batched transactions.
+# Progress is checkpointed with every batch, so rerunning the same command
+# after a failure resumes where the last committed batch ended. When
+# sharded, each shard keeps its own checkpoint with its rows, and the
+# global one counts the rows kept in the global database.
+def import_file(db, kind, path, fmt=None, batch_size=1000, rejects_path=None, restart=False):
+    spec = KINDS[kind]
+    fmt = detect_format(path, fmt)
+    source = str(Path(path).resolve())
+    columns = list(spec["columns"])
+    sql = (
+        f"{spec['insert']} INTO {spec['table']} ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' for _ in columns)})"
+    )
+    date_index = columns.index("date") if kind == "plans" else None
+
+    shards = [shard for shard in db.all_shards() if shard is not db]
+    for target in [db] + shards:
+        with target.write() as conn:
+            if restart:
+                conn.execute("DELETE FROM ImportCheckpoints WHERE source = ? AND kind = ?", (source, kind))
+            if target is db:
+                position, loaded, rejected, completed = _checkpoint(conn, source, kind)
+                own = ImportResult(loaded, rejected, position)
+                result = ImportResult(loaded, rejected, position, resumed_from=position)
+            else:
+                _, loaded, rejected, _ = _checkpoint(conn, source, kind)
+                result.loaded += loaded
+                result.rejected += rejected
+    if completed:
+        return result
+
+    rejects = open(rejects_path, "a", encoding="utf-8") if rejects_path else None
+
+    def load(conn, part):
+        failed = _insert_batch(conn, sql, part) if part else []
+        if date_index is not None:
+            keys = {(values[0], values[date_index]) for _, _, values in part}
+            for user_id, day in keys:
+                refresh_daily_nutrition(conn, user_id, day)
+        if kind == "exercise_logs":
+            _add_exercise_totals(conn, part, failed)
+        return failed
+
+    def write_rejects(failed):
+        if rejects:
+            for position, record, error in failed:
+                rejects.write(json.dumps({"position": position, "error": error, "record": record}) + "\n")
+            rejects.flush()
+
+    # A shard's part of the batch commits with the shard's checkpoint, in
+    # the shard's transaction; rows the shard committed before an
+    # interruption are skipped. The global checkpoint commits with the rows
+    # kept in the global database (all of them unless it is sharded).
+    def flush(batch, last_position, pending_rejects):
+        failed = []
+        parts = [(db, batch)]
+        if "user_id" in spec["columns"]:
+            parts, failed = _partition(db, batch)
+        for target, part in parts:
+            if target is db:
+                continue
+            with target.write() as conn:
+                done, loaded, rejected, _ = _checkpoint(conn, source, kind)
+                part = [item for item in part if item[0] > done]
+                valid, unreferenced = _check_references(conn, spec, columns, part)
+                shard_failed = unreferenced + load(conn, valid)
+                _save_checkpoint(conn, source, kind, ImportResult(
+                    loaded + len(part) - len(shard_failed), rejected + len(shard_failed), last_position
+                ))
+            result.loaded += len(part) - len(shard_failed)
+            result.rejected += len(shard_failed)
+            write_rejects(shard_failed)
+        with db.write() as conn:
+            kept = [item for target, part in parts if target is db for item in part]
+            kept_failed = load(conn, kept)
+            failed += kept_failed
+            loaded = len(kept) - len(kept_failed)
+            own.loaded += loaded
+            own.rejected += len(pending_rejects) + len(failed)
+            own.position = last_position
+            _save_checkpoint(conn, source, kind, own)
+        result.loaded += loaded
+        result.rejected += len(pending_rejects) + len(failed)
+        result.position = last_position
+        write_rejects(pending_rejects + failed)
+
+    try:
+        batch, pending_rejects = [], []
+        last_position = result.position
+        for position, record, error in read_records(path, fmt):
+            if position <= result.resumed_from:
+                continue
+            last_position = position
+            try:
+                if error:
+                    raise ValueError(error)
+                batch.append((position, record, validate(spec, record)))
+            except ValueError as e:
+                pending_rejects.append((position, record, str(e)))
+            if len(batch) + len(pending_rejects) >= batch_size:
+                flush(batch, last_position, pending_rejects)
+                batch, pending_rejects = [], []
+        if batch or pending_rejects:
+            flush(batch, last_position, pending_rejects)
+        with db.write() as conn:
+            _save_checkpoint(conn, source, kind, own, completed=True)
+    finally:
+        if rejects:
+            rejects.close()
+        if kind == "meals":
+            db.catalog.invalidate()
+    return result
+
+
+# Stream a table out page by page (keyset on the primary key), taking a
+# fresh read connection per page instead of one long fetchall(). Per-user
+# kinds are read from every shard in turn (keys are unique per shard).
+def export_rows(db, kind, user_id=None, page_size=5000):
+    spec = KINDS[kind]
+    sources = [db]
+    if "user_id" in spec["columns"]:
+        sources = db.all_shards() if user_id is None else [db.shard(user_id)]
+    for source in sources:
+        yield from _export_source(source, spec, user_id, page_size)
+
+
+def _export_source(db, spec, user_id, page_size):
+    key = spec["key"]
+    columns = [key] + list(spec["columns"])
+    where = f"{key} > ?"
+    if user_id is not None and "user_id" in spec["columns"]:
+        where += " AND user_id = ?"
+    last_key = 0
+    while True:
+        params = (last_key, user_id) if "user_id = ?" in where else (last_key,)
+        with db.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {', '.join(columns)} FROM {spec['table']}
+                WHERE {where}
+                ORDER BY {key}
+                LIMIT {int(page_size)}
+            ''', params)
+            page = cursor.fetchall()
+        if not page:
+            return
+        for row in page:
+            yield dict(zip(columns, row))
+        last_key = page[-1][0]
+
+
+def export_file(db, kind, path, fmt=None, user_id=None, page_size=5000):
+    fmt = detect_format(path, fmt)
+    columns = [KINDS[kind]["key"]] + list(KINDS[kind]["columns"])
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=columns) if fmt == "csv" else None
+        if writer:
+            writer.writeheader()
+        for row in export_rows(db, kind, user_id, page_size):
+            if writer:
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(row) + "\n")
+            count += 1
+    return count
@@ -0,0 +1,291 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a cached per-user result is served. Writes made through this
+# process invalidate results at once; this bounds how long a write by
+# another process (API server, job worker, import) can go unnoticed.
+RESULT_CACHE_TTL = float(os.environ.get("MEAL_PLANNER_RESULT_CACHE_TTL", "30"))
+RESULT_CACHE_BYTES = int(float(os.environ.get("MEAL_PLANNER_RESULT_CACHE_MB", "64")) * 1024 * 1024)
+# Seconds between reads of the catalog generation stored in the database,
+# i.e. how long a catalog write by another process can go unnoticed
+CATALOG_CHECK_SECONDS = float(os.environ.get("MEAL_PLANNER_CATALOG_CHECK_SECONDS", "1"))
+
+
+# Read-through cache for the nearly static Meals/Exercises catalogs.
+# Entries are stamped with a generation; invalidate() bumps it so every
+# entry loaded before a catalog write is discarded. Writes by other
+# processes are picked up through stored_generation(), a counter the
+# database bumps on every catalog change (migration 0011), read at most
+# every check_interval seconds. Memory is bounded by the total number of
+# cached rows, evicting least recently used keys.
+class CatalogCache:
+    def __init__(self, max_rows=100000, stored_generation=None, check_interval=CATALOG_CHECK_SECONDS):
+        self.max_rows = max_rows
+        self.check_interval = check_interval
+        self._stored_generation = stored_generation
+        self._seen = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._rows = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Generation to stamp entries with, after invalidating the cache if the
+    # stored generation moved since it was last read
+    def current(self):
+        if self._stored_generation is None or time.monotonic() < self._next_check:
+            return self.generation
+        self._next_check = time.monotonic() + self.check_interval
+        stored = self._stored_generation()
+        with self._lock:
+            if stored is not None and stored != self._seen:
+                self._seen = stored
+                self._clear()
+            return self.generation
+
+    def get(self, key, loader):
+        self.current()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == self.generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+        rows = tuple(tuple(row) for row in loader())
+        with self._lock:
+            # Don't store rows read before a concurrent invalidation
+            if generation == self.generation and len(rows) <= self.max_rows:
+                self._discard(key)
+                self._entries[key] = (generation, rows)
+                self._rows += len(rows)
+                while self._rows > self.max_rows:
+                    self._discard(next(iter(self._entries)))
+                    self.evictions += 1
+        return rows
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._rows -= len(entry[1])
+
+    def _clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self._rows = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "generation": self.generation,
+                "stored_generation": self._seen,
+                "entries": len(self._entries),
+                "rows": self._rows,
+                "max_rows": self.max_rows,
+            }
+
+
+# LRU cache bounded by the total size of its values (e.g. rendered chart
+# images), for results keyed by everything that determines them
+class BoundedCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Rows of a sequence measured by estimate_size; longer ones are scaled from
+# an evenly spaced sample, since query rows are alike in size
+SIZE_SAMPLE = 8
+_SCALARS = {int, float, str, bytes, bool, type(None)}
+
+
+# Approximate memory held by a query result: rows, nested containers,
+# slotted objects and DataFrames
+def estimate_size(value):
+    kind = type(value)
+    size = sys.getsizeof(value)
+    if kind in _SCALARS:
+        return size
+    if kind is tuple or kind is list:
+        if len(value) <= SIZE_SAMPLE:
+            return size + sum(map(estimate_size, value))
+        sample = value[::len(value) // SIZE_SAMPLE]
+        return size + sum(map(estimate_size, sample)) * len(value) // len(sample)
+    if kind is dict:
+        return size + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    for name in getattr(kind, "__slots__", ()):
+        size += sys.getsizeof(getattr(value, name, None))
+    return size
+
+
+# Cross-session cache of per-user query results, keyed by (function name,
+# user_id, args). Each entry is stamped with the user's data version when
+# its load started; bump(user_id), called by every write path after it
+# commits, makes all of the user's entries stale, and results loaded
+# concurrently with the write are not stored. Entries also expire after
+# `ttl` seconds, and the least recently used go first once the estimated
+# size passes max_bytes. Cached values are shared: callers must not mutate
+# them. A ttl of 0 disables the cache.
+class ResultCache:
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, ttl=RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, expires, value, size)
+        self._versions = {}  # user_id -> data version
+        self._bytes = 0
+        self._counts = {}    # function name -> [hits, misses]
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, name, user_id, args, loader):
+        key = (name, user_id, args)
+        with self._lock:
+            version = self._versions.get(user_id, 0)
+            counts = self._counts.setdefault(name, [0, 0])
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == version and entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    counts[0] += 1
+                    return entry[2]
+                if entry[0] == version:
+                    self.expired += 1
+                else:
+                    self.stale += 1
+                self._discard(key)
+            counts[1] += 1
+        value = loader()
+        if self.ttl <= 0:
+            return value
+        size = estimate_size(value)
+        with self._lock:
+            if self._versions.get(user_id, 0) == version and size <= self.max_bytes:
+                self._discard(key)
+                self._entries[key] = (version, time.monotonic() + self.ttl, value, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+                    self.evictions += 1
+        return value
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[3]
+
+    # The user's data changed; their stale entries are dropped as they are
+    # looked up or evicted
+    def bump(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def bump_users(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            hits = sum(counts[0] for counts in self._counts.values())
+            misses = sum(counts[1] for counts in self._counts.values())
+            return {
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+                "stale": self.stale,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "functions": {
+                    name: {"hits": h, "misses": m, "hit_ratio": h / (h + m) if h + m else 0.0}
+                    for name, (h, m) in sorted(self._counts.items())
+                },
+            }
+
+    # Hit and miss counters per function in Prometheus text format
+    def prometheus(self):
+        with self._lock:
+            items = sorted((name, list(counts)) for name, counts in self._counts.items())
+            size = self._bytes
+        lines = []
+        for metric, help_text, index in (
+            ("meal_planner_result_cache_hits_total", "Per-user results served from the cache", 0),
+            ("meal_planner_result_cache_misses_total", "Per-user results loaded from the database", 1),
+        ):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f'{metric}{{function="{name}"}} {counts[index]}' for name, counts in items)
+        lines.append("# HELP meal_planner_result_cache_bytes Estimated size of the cached results")
+        lines.append("# TYPE meal_planner_result_cache_bytes gauge")
+        lines.append(f"meal_planner_result_cache_bytes {size}")
+        return "\n".join(lines) + "\n"
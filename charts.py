@@ -0,0 +1,98 @@
+import io
+import os
+
+import matplotlib
+
+matplotlib.use("Agg")  # server-side rendering only, no GUI backend
+
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.figure import Figure
+
+from cache import BoundedCache
+
+# "native" renders with Streamlit's built-in (Vega-Lite) charts in the browser,
+# anything else rasterizes with matplotlib/seaborn on the server
+CHART_BACKEND = os.environ.get("MEAL_PLANNER_CHARTS", "matplotlib")
+# Ranges with more points than this are averaged into buckets before plotting
+MAX_POINTS = 300
+
+# Rendered PNGs shared by all sessions of the process
+png_cache = BoundedCache(max_bytes=32 * 1024 * 1024)
+
+
+# Average consecutive rows into at most max_points buckets (first date of each bucket)
+def downsample(df, max_points=MAX_POINTS):
+    if len(df) <= max_points:
+        return df
+    buckets = np.arange(len(df)) // int(np.ceil(len(df) / max_points))
+    numeric = df.drop(columns=["date"]).select_dtypes("number")
+    sampled = numeric.groupby(buckets).mean()
+    sampled.insert(0, "date", df["date"].groupby(buckets).first())
+    return sampled.reset_index(drop=True)
+
+
+# Content fingerprint of the plotted data, so edits to any point change the key
+def data_version(df):
+    return int(pd.util.hash_pandas_object(df, index=False).sum())
+
+
+def _weight(df, ax):
+    sns.lineplot(data=df, x="date", y="weight", marker="o", ax=ax)
+    ax.set_title("Weight Trend")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Weight (kg)")
+
+
+def _macros(df, ax):
+    melted = df.melt(id_vars=["date"], value_vars=["protein", "carbs", "fats"],
+                     var_name="macro", value_name="grams")
+    sns.lineplot(data=melted, x="date", y="grams", hue="macro", ax=ax)
+    ax.set_title("Macronutrient Intake")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Grams")
+
+
+def _calories(df, ax):
+    sns.barplot(data=df, x="date", y="calories", ax=ax)
+    ax.set_title("Daily Calorie Intake")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Calories")
+    ax.tick_params(axis="x", rotation=45)
+
+
+CHARTS = {"weight": _weight, "macros": _macros, "calories": _calories}
+
+
+# Figure objects are created without pyplot, so they are never registered in
+# its global figure list and are released as soon as the PNG is written
+def render_png(chart, df):
+    fig = Figure()
+    try:
+        CHARTS[chart](df, fig.subplots())
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+# PNG for (user, range, chart, data version), rendered at most once per distinct input
+def chart_png(user_id, start_date, end_date, chart, df):
+    key = (user_id, str(start_date), str(end_date), chart, data_version(df))
+    png = png_cache.get(key)
+    if png is None:
+        png = render_png(chart, df)
+        png_cache.put(key, png, len(png))
+    return png
+
+
+# Client-side equivalents of the matplotlib charts
+def render_native(st, chart, df):
+    if chart == "weight":
+        st.line_chart(df, x="date", y="weight")
+    elif chart == "macros":
+        st.line_chart(df, x="date", y=["protein", "carbs", "fats"])
+    else:
+        st.bar_chart(df, x="date", y="calories")
@@ -0,0 +1,609 @@
+import json
+import os
+import re
+
+import auth
+from db import NUTRIENTS, NUTRIENT_TOTALS, add_exercise_totals, archived_through, refresh_daily_nutrition
+
+# Data layer shared by the Streamlit UI (n.py), the JSON API (api.py) and
+# the background job worker (jobs.py). Nothing here imports Streamlit:
+# database errors (sqlite3.Error) propagate, and each caller reports them
+# its own way (n.py on the page, api.py as an HTTP status).
+
+# Batch concurrent plan/progress/exercise writes into shared transactions
+GROUP_COMMIT = os.environ.get("MEAL_PLANNER_GROUP_COMMIT") == "1"
+
+# Meals shown per page in the planner's search results
+MEAL_SEARCH_PAGE_SIZE = 20
+# Meals offered per slot for the remaining daily budget
+MEAL_SUGGESTIONS = 5
+# Rows per page of the exercise history
+EXERCISE_PAGE_SIZE = 25
+
+
+# User management
+# Insert a user whose password is already hashed (auth.hash_password); a
+# taken username or email raises sqlite3.IntegrityError
+def create_user(db, username, password_hash, email, age, gender, height, weight, fitness_goal,
+                activity_level, daily_calorie_goal):
+    with db.write() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Users (username, password, email, age, gender, height, weight,
+                             fitness_goal, activity_level, daily_calorie_goal, weight_updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, date('now', 'localtime'))
+        ''', (username, password_hash, email, age, gender, height, weight,
+              fitness_goal, activity_level, daily_calorie_goal))
+        return cursor.lastrowid
+
+
+def add_user(db, username, password, email, age, gender, height, weight, fitness_goal,
+             activity_level, daily_calorie_goal):
+    return create_user(db, username, auth.hash_password(password), email, age, gender, height,
+                       weight, fitness_goal, activity_level, daily_calorie_goal)
+
+
+# Replace a user's profile; the password changes only when a new hash is
+# given. weight_updated moves to today when the weight changes.
+def update_profile(db, user_id, username, email, age, gender, height, weight, fitness_goal,
+                   activity_level, daily_calorie_goal, password_hash=None):
+    with db.write() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE Users
+            SET username = ?, email = ?, age = ?, gender = ?,
+                height = ?, weight = ?, fitness_goal = ?,
+                activity_level = ?, daily_calorie_goal = ?, password = COALESCE(?, password),
+                weight_updated = CASE WHEN weight = ? THEN weight_updated
+                                      ELSE date('now', 'localtime') END
+            WHERE user_id = ?
+        ''', (username, email, age, gender, height, weight, fitness_goal, activity_level,
+              daily_calorie_goal, password_hash, weight, user_id))
+    db.results.bump(user_id)
+    return True
+
+
+def get_user_info(db, user_id):
+    def load():
+        with db.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, username, email, age, gender, height, weight,
+                       fitness_goal, activity_level, daily_calorie_goal
+                FROM Users WHERE user_id = ?
+            ''', (user_id,))
+            row = cursor.fetchone()
+        return UserProfile(*row) if row else None
+    return db.results.get("user_info", user_id, (), load)
+
+
+# Meal management
+def add_meal(db, meal_data):
+    with db.write() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Meals (
+                meal_name, description, calories, protein, carbs, fats,
+                fiber, sugar, sodium, dietary_preference, meal_type, created_by
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', meal_data)
+        meal_id = cursor.lastrowid
+    db.catalog.invalidate()
+    return meal_id
+
+
+# Prefix match every word of the user's input, e.g. "chick sal" -> "chick"* "sal"*
+def meal_search_query(text):
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text.lower()))
+
+
+# One page of catalog rows (meal_id, meal_name, calories, meal_type).
+# An empty query browses by name through the (preference, type) index, otherwise
+# results come from the MealsSearch full-text index ranked by relevance.
+# A preference of "None" means no dietary filter, as in the planner.
+def search_meals(db, query="", dietary_preference=None, meal_type=None, limit=20, offset=0):
+    match = meal_search_query(query or "")
+    filters, params = [], []
+    if match:
+        filters.append("MealsSearch MATCH ?")
+        params.append(match)
+    if dietary_preference not in (None, "None"):
+        filters.append("m.dietary_preference = ?")
+        params.append(dietary_preference)
+    if meal_type:
+        filters.append("m.meal_type = ?")
+        params.append(meal_type)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    if match:
+        sql = f'''
+            SELECT m.meal_id, m.meal_name, m.calories, m.meal_type
+            FROM MealsSearch
+            JOIN Meals m ON m.meal_id = MealsSearch.rowid
+            {where}
+            ORDER BY MealsSearch.rank
+            LIMIT ? OFFSET ?
+        '''
+    else:
+        sql = f'''
+            SELECT m.meal_id, m.meal_name, m.calories, m.meal_type
+            FROM Meals m
+            {where}
+            ORDER BY m.meal_name
+            LIMIT ? OFFSET ?
+        '''
+    params += [limit, offset]
+
+    def load():
+        with db.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+    key = ("search", match, dietary_preference, meal_type, limit, offset)
+    return db.catalog.get(key, load)
+
+
+def get_meal_by_id(db, meal_id):
+    with db.read() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM Meals WHERE meal_id = ?', (meal_id,))
+        return cursor.fetchone()
+
+
+# Meal planning
+# Per-user reads and writes go to db.shard(user_id) (the database itself
+# unless sharded). plan_meal, track_progress and log_exercise go through
+# run_write, so with group commit enabled concurrent sessions share one
+# transaction
+def plan_meal(db, user_id, meal_id, date, portion_size=1.0, meal_type=None):
+    def write(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO UserMealPlans (user_id, meal_id, date, portion_size, meal_type)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, meal_id, date, portion_size, meal_type))
+        refresh_daily_nutrition(conn, user_id, date)
+        return True
+    saved = db.shard(user_id).run_write(write)
+    db.results.bump(user_id)
+    return saved
+
+
+# Bulk plan_meal for generated plans: (date, meal_type, meal_id, portion_size)
+# rows in one transaction. A meal already planned in the same slot gets the
+# new portion; with replace, the days' existing plans are cleared first.
+def plan_meals(db, user_id, meals, replace=False):
+    def write(conn):
+        cursor = conn.cursor()
+        dates = sorted({str(day) for day, _, _, _ in meals})
+        if replace:
+            cursor.executemany(
+                "DELETE FROM UserMealPlans WHERE user_id = ? AND date = ?",
+                [(user_id, day) for day in dates]
+            )
+        cursor.executemany('''
+            INSERT INTO UserMealPlans (user_id, meal_id, date, portion_size, meal_type)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, meal_id, date, meal_type)
+            DO UPDATE SET portion_size = excluded.portion_size
+        ''', [(user_id, meal_id, str(day), portion, meal_type) for day, meal_type, meal_id, portion in meals])
+        for day in dates:
+            refresh_daily_nutrition(conn, user_id, day)
+        return True
+    saved = db.shard(user_id).run_write(write)
+    db.results.bump(user_id)
+    return saved
+
+
+def remove_planned_meal(db, user_id, meal_id, date, meal_type):
+    with db.shard(user_id).write() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM UserMealPlans
+            WHERE user_id = ? AND meal_id = ? AND date = ? AND meal_type = ?
+        ''', (user_id, meal_id, date, meal_type))
+        refresh_daily_nutrition(conn, user_id, date)
+    db.results.bump(user_id)
+    return True
+
+
+# UserMealPlans together with a user's plans moved to the archive (see
+# archive.py), for ranges reaching back to archived dates
+ARCHIVED_PLANS_SOURCE = '''(
+    SELECT user_id, meal_id, date, portion_size, meal_type FROM UserMealPlans
+    UNION ALL
+    SELECT ?, json_extract(value, '$[0]'), json_extract(value, '$[1]'),
+           json_extract(value, '$[2]'), json_extract(value, '$[3]')
+    FROM json_each(?)
+)'''
+
+
+# Row source for a user's plans between two dates: (FROM clause, parameters)
+def plan_source(db, conn, user_id, start_date, end_date):
+    through = archived_through(conn, "UserMealPlans")
+    if str(start_date) > through:
+        return "UserMealPlans", ()
+    import archive
+
+    rows = archive.read_rows(db, "UserMealPlans", user_id, start_date, min(str(end_date), through))
+    return ARCHIVED_PLANS_SOURCE, (user_id, json.dumps([row[1:] for row in rows]))
+
+
+# Nutrient columns are already scaled by portion_size
+def get_user_meal_plan(db, user_id, date):
+    def load():
+        with db.shard(user_id).read() as conn:
+            source, params = plan_source(db, conn, user_id, date, date)
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT m.meal_id, m.meal_name, m.calories * up.portion_size,
+                       m.protein * up.portion_size, m.carbs * up.portion_size,
+                       m.fats * up.portion_size, up.portion_size, up.meal_type, m.dietary_preference
+                FROM {source} up
+                JOIN Meals m ON up.meal_id = m.meal_id
+                WHERE up.user_id = ? AND up.date = ?
+                ORDER BY up.meal_type
+            ''', params + (user_id, date))
+            return cursor.fetchall()
+    return db.results.get("meal_plan", user_id, (str(date),), load)
+
+
+# Plans for a date range from one indexed range scan (idx_user_meal_plans),
+# grouped as {"YYYY-MM-DD": [rows shaped like get_user_meal_plan]}
+def get_user_meal_plans(db, user_id, start_date, end_date):
+    def load():
+        with db.shard(user_id).read() as conn:
+            source, params = plan_source(db, conn, user_id, start_date, end_date)
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT up.date, m.meal_id, m.meal_name, m.calories * up.portion_size,
+                       m.protein * up.portion_size, m.carbs * up.portion_size,
+                       m.fats * up.portion_size, up.portion_size, up.meal_type, m.dietary_preference
+                FROM {source} up
+                JOIN Meals m ON up.meal_id = m.meal_id
+                WHERE up.user_id = ? AND up.date BETWEEN ? AND ?
+                ORDER BY up.date, up.meal_type
+            ''', params + (user_id, start_date, end_date))
+            plans = {}
+            for row in cursor:
+                plans.setdefault(row[0], []).append(row[1:])
+            return plans
+    return db.results.get("meal_plans", user_id, (str(start_date), str(end_date)), load)
+
+
+# Portion-scaled totals of all seven nutrients, one row per group:
+# (date, meal_type, meal_count, calories, protein, carbs, fats, fiber, sugar, sodium).
+# by_meal_type sums UserMealPlans in SQLite grouped by date and meal_type;
+# otherwise rows are per day from the DailyNutrition rollup, with meal_type None.
+def get_nutrition_totals(db, user_id, start_date, end_date=None, by_meal_type=False):
+    end_date = end_date or start_date
+
+    def load():
+        with db.shard(user_id).read() as conn:
+            cursor = conn.cursor()
+            if by_meal_type:
+                source, params = plan_source(db, conn, user_id, start_date, end_date)
+                cursor.execute(f'''
+                    SELECT up.date, up.meal_type, COUNT(*), {NUTRIENT_TOTALS}
+                    FROM {source} up
+                    JOIN Meals m ON up.meal_id = m.meal_id
+                    WHERE up.user_id = ? AND up.date BETWEEN ? AND ?
+                    GROUP BY up.date, up.meal_type
+                    ORDER BY up.date, up.meal_type
+                ''', params + (user_id, start_date, end_date))
+            else:
+                cursor.execute(f'''
+                    SELECT date, NULL, meal_count, {", ".join(NUTRIENTS)}
+                    FROM DailyNutrition
+                    WHERE user_id = ? AND date BETWEEN ? AND ?
+                    ORDER BY date
+                ''', (user_id, start_date, end_date))
+            return cursor.fetchall()
+    key = (str(start_date), str(end_date), by_meal_type)
+    return db.results.get("nutrition_totals", user_id, key, load)
+
+
+# Planned totals for one day:
+# (calories, protein, carbs, fats, fiber, sugar, sodium), or None if nothing is planned
+def get_daily_nutrition(db, user_id, date):
+    rows = get_nutrition_totals(db, user_id, date)
+    return rows[0][3:] if rows else None
+
+
+# Progress tracking
+def track_progress(db, user_id, date, weight=None, total_calories=None,
+                   total_protein=None, total_carbs=None, total_fats=None, notes=None):
+    def write(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO Progress (
+                user_id, date, weight, total_calories,
+                total_protein, total_carbs, total_fats, notes
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, date, weight, total_calories,
+              total_protein, total_carbs, total_fats, notes))
+        return True
+    saved = db.shard(user_id).run_write(write)
+    db.results.bump(user_id)
+    return saved
+
+
+# Rows dated up to the archive watermark come from the Arrow archive
+def get_user_progress(db, user_id, start_date=None, end_date=None):
+    def load():
+        with db.shard(user_id).read() as conn:
+            cursor = conn.cursor()
+            if start_date and end_date:
+                cursor.execute('''
+                    SELECT date, weight, total_calories, total_protein,
+                           total_carbs, total_fats, notes
+                    FROM Progress
+                    WHERE user_id = ? AND date BETWEEN ? AND ?
+                    ORDER BY date
+                ''', (user_id, start_date, end_date))
+            else:
+                cursor.execute('''
+                    SELECT date, weight, total_calories, total_protein,
+                           total_carbs, total_fats, notes
+                    FROM Progress
+                    WHERE user_id = ?
+                    ORDER BY date
+                ''', (user_id,))
+            rows = cursor.fetchall()
+            through = archived_through(conn, "Progress")
+        start, end = (str(start_date), str(end_date)) if start_date and end_date else ("", through)
+        if not through or start > through:
+            return rows
+        import archive
+
+        archived = archive.read_rows(db, "Progress", user_id, start, min(end, through))
+        return [row[1:] for row in archived] + rows
+    range_key = (str(start_date), str(end_date)) if start_date and end_date else ()
+    return db.results.get("progress", user_id, range_key, load)
+
+
+# Weekly or monthly rollups built by the summaries job, newest first
+def get_user_summaries(db, user_id, period="week", limit=12):
+    def load():
+        with db.shard(user_id).read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT period_start, days_logged, avg_weight, avg_calories, avg_planned_calories,
+                       workouts, exercise_minutes, calories_burned
+                FROM UserSummaries
+                WHERE user_id = ? AND period = ?
+                ORDER BY period_start DESC
+                LIMIT ?
+            ''', (user_id, period, limit))
+            return cursor.fetchall()
+    return db.results.get("summaries", user_id, (period, limit), load)
+
+
+# Exercise
+def add_exercise(db, exercise_name, calories_burned_per_hour, description, intensity):
+    with db.write() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Exercises (exercise_name, calories_burned_per_hour, description, intensity)
+            VALUES (?, ?, ?, ?)
+        ''', (exercise_name, calories_burned_per_hour, description, intensity))
+        exercise_id = cursor.lastrowid
+    db.catalog.invalidate()
+    return exercise_id
+
+
+# Catalog rows (exercise_id, exercise_name, calories_burned_per_hour), served from the catalog cache
+def get_exercises(db):
+    def load():
+        with db.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT exercise_id, exercise_name, calories_burned_per_hour
+                FROM Exercises
+                ORDER BY exercise_name
+            ''')
+            return cursor.fetchall()
+    return db.catalog.get(("exercises",), load)
+
+
+def log_exercise(db, user_id, exercise_id, date, duration_minutes, calories_burned):
+    def write(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO UserExercises (user_id, exercise_id, date, duration_minutes, calories_burned)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, exercise_id, date, duration_minutes, calories_burned))
+        add_exercise_totals(conn, user_id, calories_burned, duration_minutes)
+        return True
+    saved = db.shard(user_id).run_write(write)
+    db.results.bump(user_id)
+    return saved
+
+
+# One page of history, newest first. Pass the (date, log_id) of the last row
+# of the previous page as `before` to continue (keyset pagination, so every
+# page is a bounded index range scan on idx_user_exercises). Pages reaching
+# past the archive watermark continue into the Arrow archive.
+def get_exercise_history(db, user_id, before=None, limit=20):
+    def load():
+        with db.shard(user_id).read() as conn:
+            cursor = conn.cursor()
+            if before:
+                cursor.execute('''
+                    SELECT ue.log_id, e.exercise_name, ue.date, ue.duration_minutes, ue.calories_burned
+                    FROM UserExercises ue
+                    JOIN Exercises e ON ue.exercise_id = e.exercise_id
+                    WHERE ue.user_id = ? AND (ue.date, ue.log_id) < (?, ?)
+                    ORDER BY ue.date DESC, ue.log_id DESC
+                    LIMIT ?
+                ''', (user_id, before[0], before[1], limit))
+            else:
+                cursor.execute('''
+                    SELECT ue.log_id, e.exercise_name, ue.date, ue.duration_minutes, ue.calories_burned
+                    FROM UserExercises ue
+                    JOIN Exercises e ON ue.exercise_id = e.exercise_id
+                    WHERE ue.user_id = ?
+                    ORDER BY ue.date DESC, ue.log_id DESC
+                    LIMIT ?
+                ''', (user_id, limit))
+            rows = cursor.fetchall()
+            through = archived_through(conn, "UserExercises")
+        if len(rows) < limit and through:
+            rows += archived_exercise_history(db, user_id, before, limit - len(rows), through)
+        return rows
+    cursor_key = (str(before[0]), before[1]) if before else None
+    return db.results.get("exercise_history", user_id, (cursor_key, limit), load)
+
+
+# The archived part of a history page, in get_exercise_history's row shape
+def archived_exercise_history(db, user_id, before, limit, through):
+    import archive
+    import pyarrow.compute as pc
+
+    end_date = min(str(before[0]), through) if before else through
+    data = archive.read_table(db, "UserExercises", [user_id], "", end_date)
+    if before:
+        dates, log_ids = data.column("date"), data.column("log_id")
+        data = data.filter(pc.or_(
+            pc.less(dates, str(before[0])),
+            pc.and_(pc.equal(dates, str(before[0])), pc.less(log_ids, int(before[1]))),
+        ))
+    # Ascending (date, log_id): the page is the tail, newest first
+    data = data.slice(max(data.num_rows - limit, 0))
+    names = {exercise_id: name for exercise_id, name, _ in get_exercises(db)}
+    return [
+        (log_id, names.get(exercise_id), day, minutes, burned)
+        for log_id, exercise_id, day, minutes, burned in reversed(list(zip(*(
+            archive.column_values("UserExercises", data, name)
+            for name in ("log_id", "exercise_id", "date", "duration_minutes", "calories_burned")
+        ))))
+    ]
+
+
+# (sessions, calories_burned, duration_minutes) from the ExerciseTotals running aggregate
+def get_exercise_totals(db, user_id):
+    def load():
+        with db.shard(user_id).read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT sessions, calories_burned, duration_minutes
+                FROM ExerciseTotals WHERE user_id = ?
+            ''', (user_id,))
+            return cursor.fetchone() or (0, 0, 0.0)
+    return db.results.get("exercise_totals", user_id, (), load)
+
+
+# Authentication
+# (user_id, username, stored password hash) of an account, or None
+def get_credentials(db, username):
+    with db.read() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id, username, password FROM Users WHERE username = ?
+        ''', (username,))
+        return cursor.fetchone()
+
+
+# Store a rehashed password after a successful login, unless the password
+# changed since `stored` was read
+def upgrade_password(db, user_id, stored, upgraded):
+    with db.write() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE Users SET password = ? WHERE user_id = ? AND password = ?
+        ''', (upgraded, user_id, stored))
+
+
+# (user_id, username), or None for a wrong username or password. Verifies
+# outside any connection; legacy SHA-256 or outdated scrypt hashes are
+# upgraded to the current parameters after a successful login
+def authenticate_user(db, username, password):
+    row = get_credentials(db, username)
+    if row is None:
+        auth.verify_password(password, auth.dummy_hash())
+        return None
+    user_id, username, stored = row
+    if not auth.verify_password(password, stored):
+        return None
+    if auth.needs_rehash(stored):
+        upgrade_password(db, user_id, stored, auth.hash_password(password))
+    return user_id, username
+
+
+# Users row with named fields; derived values are memoized on first use
+class UserProfile:
+    __slots__ = (
+        "user_id", "username", "email", "age", "gender", "height", "weight",
+        "fitness_goal", "activity_level", "daily_calorie_goal",
+        "_bmi", "_suggested_calorie_goal"
+    )
+
+    def __init__(self, user_id, username, email, age, gender, height, weight,
+                 fitness_goal, activity_level, daily_calorie_goal):
+        self.user_id = user_id
+        self.username = username
+        self.email = email
+        self.age = age
+        self.gender = gender
+        self.height = height
+        self.weight = weight
+        self.fitness_goal = fitness_goal
+        self.activity_level = activity_level
+        self.daily_calorie_goal = daily_calorie_goal
+        self._bmi = None
+        self._suggested_calorie_goal = None
+
+    @property
+    def bmi(self):
+        if self._bmi is None:
+            self._bmi = calculate_bmi(self.height, self.weight)
+        return self._bmi
+
+    # Inputs of calculate_daily_calorie_goal, in argument order
+    @property
+    def goal_inputs(self):
+        return (self.age, self.gender, self.height, self.weight,
+                self.activity_level, self.fitness_goal)
+
+    @property
+    def suggested_calorie_goal(self):
+        if self._suggested_calorie_goal is None:
+            self._suggested_calorie_goal = calculate_daily_calorie_goal(*self.goal_inputs)
+        return self._suggested_calorie_goal
+
+
+# BMI from height in cm and weight in kg, None without both
+def calculate_bmi(height, weight):
+    if height > 0 and weight > 0:
+        return weight / ((height / 100) ** 2)
+    return None
+
+
+# Daily calories for the fitness goal: Harris-Benedict BMR times the
+# activity multiplier, -20% for weight loss, +10% for muscle gain
+def calculate_daily_calorie_goal(age, gender, height, weight, activity_level, fitness_goal):
+    # Basic Harris-Benedict equation for BMR
+    if gender.lower() == 'male':
+        bmr = 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
+    else:
+        bmr = 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
+
+    # Activity level multipliers
+    activity_multipliers = {
+        'sedentary': 1.2,
+        'lightly active': 1.375,
+        'moderately active': 1.55,
+        'very active': 1.725,
+        'extra active': 1.9
+    }
+
+    tdee = bmr * activity_multipliers.get(activity_level.lower(), 1.2)
+
+    # Adjust based on fitness goal
+    if fitness_goal.lower() == 'weight loss':
+        return tdee * 0.8  # 20% deficit
+    elif fitness_goal.lower() == 'muscle gain':
+        return tdee * 1.1  # 10% surplus
+    else:  # maintenance
+        return tdee
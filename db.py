@@ -0,0 +1,557 @@
+import contextvars
+import importlib.util
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Empty, LifoQueue, Queue
+
+from cache import CatalogCache, ResultCache
+from querystats import InstrumentedCursor, QueryStats
+
+SCHEMA_FILE = Path(__file__).with_name("schema.sql")
+MIGRATIONS_DIR = Path(__file__).with_name("migrations")
+SHARD_SCHEMA_FILE = Path(__file__).with_name("shard_schema.sql")
+SHARD_MIGRATIONS_DIR = MIGRATIONS_DIR / "shard"
+
+# Pragmas applied to every pooled connection
+PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",   # durable in WAL mode, fsync only on checkpoint
+    "PRAGMA cache_size = -16000",    # ~16 MB page cache per connection
+    "PRAGMA mmap_size = 134217728",  # 128 MB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    pass
+
+
+# Connection that remembers its cursors so they can be closed on checkin,
+# otherwise an unfinished SELECT keeps a read transaction (and old snapshot) open.
+# Every statement, including conn.execute(), runs on an instrumented cursor.
+class PooledConnection(sqlite3.Connection):
+    query_stats = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cursors = weakref.WeakSet()
+
+    def cursor(self, factory=InstrumentedCursor):
+        cursor = super().cursor(factory)
+        self._cursors.add(cursor)
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close_cursors(self):
+        for cursor in list(self._cursors):
+            cursor.close()
+
+
+# Process-wide connection manager: one writer guarded by a lock and a
+# bounded pool of read-only connections, all in WAL mode
+class Database:
+    def __init__(self, path, readers=4, busy_timeout=5.0, group_commit=False):
+        self.path = str(path)
+        self.busy_timeout = busy_timeout
+        self.max_readers = readers
+        self._write_lock = threading.Lock()
+        self._readers = LifoQueue(maxsize=readers)
+        self._opened_readers = 0
+        self._open_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "read_checkouts": 0,
+            "write_checkouts": 0,
+            "read_wait_seconds": 0.0,
+            "write_wait_seconds": 0.0,
+            "max_read_wait_seconds": 0.0,
+            "max_write_wait_seconds": 0.0,
+            "read_contention": 0,
+            "write_contention": 0,
+            "timeouts": 0,
+        }
+        self.catalog = CatalogCache(stored_generation=self.catalog_generation)
+        self.results = ResultCache()
+        self.queries = QueryStats()
+        self._writer = self._connect(Path(self.path).absolute().as_uri() + "?mode=rwc")
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._writer.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        self.write_queue = WriteQueue(self) if group_commit else None
+
+    def _connect(self, uri):
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            timeout=self.busy_timeout,
+            isolation_level=None,  # transactions are managed explicitly
+            check_same_thread=False,
+            factory=PooledConnection,
+        )
+        conn.query_stats = self.queries
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _record(self, kind, waited, contended):
+        with self._stats_lock:
+            self._stats[f"{kind}_checkouts"] += 1
+            self._stats[f"{kind}_wait_seconds"] += waited
+            if waited > self._stats[f"max_{kind}_wait_seconds"]:
+                self._stats[f"max_{kind}_wait_seconds"] = waited
+            if contended:
+                self._stats[f"{kind}_contention"] += 1
+
+    def _timeout(self, message):
+        with self._stats_lock:
+            self._stats["timeouts"] += 1
+        return PoolTimeout(message)
+
+    def _checkout_reader(self):
+        try:
+            return self._readers.get_nowait(), False
+        except Empty:
+            pass
+        with self._open_lock:
+            if self._opened_readers < self.max_readers:
+                self._opened_readers += 1
+                uri = Path(self.path).absolute().as_uri() + "?mode=ro"
+                try:
+                    return self._connect(uri), False
+                except sqlite3.Error:
+                    self._opened_readers -= 1
+                    raise
+        try:
+            return self._readers.get(timeout=self.busy_timeout), True
+        except Empty:
+            raise self._timeout("Timed out waiting for a read connection") from None
+
+    # Borrow a read-only connection for the duration of the block
+    @contextmanager
+    def read(self):
+        start = time.perf_counter()
+        conn, contended = self._checkout_reader()
+        self._record("read", time.perf_counter() - start, contended)
+        try:
+            yield conn
+        finally:
+            conn.close_cursors()
+            self._readers.put(conn)
+
+    # Hold the writer for one IMMEDIATE transaction, committed on success
+    @contextmanager
+    def write(self):
+        start = time.perf_counter()
+        contended = not self._write_lock.acquire(blocking=False)
+        if contended and not self._write_lock.acquire(timeout=self.busy_timeout):
+            raise self._timeout("Timed out waiting for the write connection")
+        self._record("write", time.perf_counter() - start, contended)
+        conn = self._writer
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.close_cursors()
+                if conn.in_transaction:
+                    conn.execute("COMMIT")
+            except BaseException:
+                conn.close_cursors()
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        finally:
+            self._write_lock.release()
+
+    # Run fn(conn) inside a write transaction and return a Future of its
+    # result. With group commit on, it is queued and committed together with
+    # other pending writes; otherwise it runs (and completes) right away.
+    def submit_write(self, fn):
+        if self.write_queue is not None:
+            return self.write_queue.submit(fn)
+        future = Future()
+        try:
+            with self.write() as conn:
+                future.set_result(fn(conn))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    # submit_write() and wait for the outcome; fn's exception is re-raised
+    def run_write(self, fn):
+        try:
+            return self.submit_write(fn).result(timeout=self.busy_timeout * 4)
+        except FutureTimeout:
+            raise self._timeout("Timed out waiting for a queued write to commit") from None
+
+    # Apply pending (version, path) steps in one transaction, tracked in
+    # PRAGMA user_version so each step runs exactly once per database.
+    # Foreign keys are off meanwhile, so a step can rebuild a table without
+    # DROP TABLE cascading into the tables that reference it.
+    def apply_migrations(self, steps):
+        applied = []
+        with self._write_lock:
+            conn = self._writer
+            conn.execute("PRAGMA foreign_keys = OFF")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+                for version, path in steps:
+                    if version <= current:
+                        continue
+                    if path.suffix == ".py":
+                        run_python_migration(conn, path)
+                    else:
+                        for statement in split_statements(path.read_text()):
+                            conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {version}")
+                    applied.append(version)
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.execute("PRAGMA foreign_keys = ON")
+        return applied
+
+    # Counter bumped by every Meals/Exercises change (migration 0011), or
+    # None while it can't be read (before migrating, pool exhausted)
+    def catalog_generation(self):
+        try:
+            with self.read() as conn:
+                row = conn.execute("SELECT generation FROM CatalogGeneration").fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return row[0] if row else None
+
+    # Rebuild the file with incremental auto-vacuum, after which the
+    # maintenance job (see jobs.py) can hand free pages back to the file
+    # system a batch at a time. Holds the write lock throughout; run it
+    # with the app stopped.
+    def vacuum(self):
+        with self._write_lock:
+            self._writer.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+            self._writer.execute("VACUUM main")
+            return self._writer.execute("PRAGMA main.page_count").fetchone()[0]
+
+    # Database holding a user's per-user rows (plans, progress, exercise
+    # logs and their rollups). A single file holds everything; see
+    # shards.ShardedDatabase for routing users to shard files.
+    def shard(self, user_id):
+        return self
+
+    # Every database holding per-user rows, for maintenance and admin queries
+    def all_shards(self):
+        return [self]
+
+    # [(database, user_ids)] with the given users grouped by their shard
+    def group_users(self, user_ids):
+        return [(self, list(user_ids))]
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["readers_open"] = self._opened_readers
+        stats["readers_idle"] = self._readers.qsize()
+        stats["max_readers"] = self.max_readers
+        if self.write_queue is not None:
+            stats.update(self.write_queue.stats())
+        return stats
+
+    def close(self):
+        if self.write_queue is not None:
+            self.write_queue.close()
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except Empty:
+                break
+
+
+# Group commit: a background thread drains queued write callables and runs
+# up to max_batch of them per transaction. Writes that queue up while a
+# batch commits form the next batch; max_delay > 0 additionally waits for a
+# batch to fill, which only pays off when commits are expensive (fsync).
+# Each write runs in its own savepoint, so one failing request is rolled
+# back and reported alone while the rest of the batch commits.
+class WriteQueue:
+    def __init__(self, db, max_batch=64, max_delay=0.0):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = Queue()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._stats = {"queued_writes": 0, "queued_failures": 0, "write_batches": 0, "max_write_batch": 0}
+        self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        if self._closed:
+            raise sqlite3.ProgrammingError("write queue is closed")
+        future = Future()
+        # Keep the caller's context (page, profiler) for query instrumentation
+        self._queue.put((contextvars.copy_context(), fn, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        try:
+            with self.db.write() as conn:
+                for context, fn, future in batch:
+                    conn.execute("SAVEPOINT queued_write")
+                    try:
+                        outcomes.append((future, None, context.run(fn, conn)))
+                        conn.execute("RELEASE queued_write")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO queued_write")
+                        conn.execute("RELEASE queued_write")
+                        outcomes.append((future, e, None))
+        except Exception as e:
+            # The transaction itself failed; nothing in the batch was committed
+            outcomes = [(future, e, None) for _, _, future in batch]
+        with self._stats_lock:
+            self._stats["queued_writes"] += len(batch)
+            self._stats["queued_failures"] += sum(1 for _, error, _ in outcomes if error is not None)
+            self._stats["write_batches"] += 1
+            self._stats["max_write_batch"] = max(self._stats["max_write_batch"], len(batch))
+        for future, error, result in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    # Commit everything already queued, then stop the thread
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+
+# DailyNutrition rollup: totals of portion-scaled nutrients per user and day
+NUTRIENTS = ("calories", "protein", "carbs", "fats", "fiber", "sugar", "sodium")
+
+DAILY_NUTRITION_COLUMNS = "user_id, date, meal_count, " + ", ".join(NUTRIENTS)
+
+# Portion-scaled sums of every nutrient over UserMealPlans up JOIN Meals m
+NUTRIENT_TOTALS = ", ".join(f"TOTAL(m.{n} * up.portion_size)" for n in NUTRIENTS)
+
+DAILY_NUTRITION_SELECT = (
+    f"SELECT up.user_id, up.date, COUNT(*), {NUTRIENT_TOTALS}"
+    " FROM UserMealPlans up JOIN Meals m ON up.meal_id = m.meal_id"
+)
+
+
+# Last date of `table` moved to the columnar archive (see archive.py), or ""
+def archived_through(conn, table):
+    row = conn.execute(
+        "SELECT through_date FROM main.ArchiveWatermarks WHERE table_name = ?", (table,)
+    ).fetchone()
+    return row[0] if row else ""
+
+
+# Recompute one (user, day) row; call inside the transaction that changed its plans
+def refresh_daily_nutrition(conn, user_id, date):
+    conn.execute("DELETE FROM DailyNutrition WHERE user_id = ? AND date = ?", (user_id, date))
+    conn.execute(f'''
+        INSERT INTO DailyNutrition ({DAILY_NUTRITION_COLUMNS})
+        {DAILY_NUTRITION_SELECT}
+        WHERE up.user_id = ? AND up.date = ?
+        GROUP BY up.user_id, up.date
+    ''', (user_id, date))
+
+
+# Days whose plans were archived keep their rows, which can no longer be
+# recomputed from UserMealPlans
+def rebuild_daily_nutrition(conn):
+    through = archived_through(conn, "UserMealPlans")
+    conn.execute("DELETE FROM DailyNutrition WHERE date > ?", (through,))
+    conn.execute(f'''
+        INSERT INTO DailyNutrition ({DAILY_NUTRITION_COLUMNS})
+        {DAILY_NUTRITION_SELECT}
+        WHERE up.date > ?
+        GROUP BY up.user_id, up.date
+    ''', (through,))
+    return conn.execute("SELECT COUNT(*) FROM DailyNutrition WHERE date > ?", (through,)).fetchone()[0]
+
+
+# (user_id, date) keys whose stored totals differ from a fresh recomputation
+def verify_daily_nutrition(conn, tolerance=1e-6):
+    mismatch = " OR ".join(
+        ["e.meal_count IS NOT d.meal_count"]
+        + [f"ABS(e.{n} - d.{n}) > {tolerance}" for n in NUTRIENTS]
+    )
+    through = archived_through(conn, "UserMealPlans")
+    return conn.execute(f'''
+        WITH e ({DAILY_NUTRITION_COLUMNS}) AS (
+            {DAILY_NUTRITION_SELECT}
+            WHERE up.date > :through
+            GROUP BY up.user_id, up.date
+        )
+        SELECT e.user_id, e.date FROM e
+        LEFT JOIN DailyNutrition d ON d.user_id = e.user_id AND d.date = e.date
+        WHERE d.user_id IS NULL OR {mismatch}
+        UNION
+        SELECT d.user_id, d.date FROM DailyNutrition d
+        LEFT JOIN e ON e.user_id = d.user_id AND e.date = d.date
+        WHERE e.user_id IS NULL AND d.date > :through
+        ORDER BY 1, 2
+    ''', {"through": through}).fetchall()
+
+
+# ExerciseTotals: per-user running aggregate of UserExercises
+def add_exercise_totals(conn, user_id, calories_burned, duration_minutes, sessions=1):
+    conn.execute('''
+        INSERT INTO ExerciseTotals (user_id, sessions, calories_burned, duration_minutes)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            sessions = sessions + excluded.sessions,
+            calories_burned = calories_burned + excluded.calories_burned,
+            duration_minutes = duration_minutes + excluded.duration_minutes
+    ''', (user_id, sessions, calories_burned or 0, duration_minutes or 0))
+
+
+# Recompute totals for the given users, or for everyone when user_ids is None
+def rebuild_exercise_totals(conn, user_ids=None):
+    # Rows moved to the archive count through ArchivedExerciseTotals
+    select = '''
+        SELECT user_id, SUM(sessions), TOTAL(calories_burned), TOTAL(duration_minutes) FROM (
+            SELECT user_id, COUNT(*) AS sessions, TOTAL(calories_burned) AS calories_burned,
+                   TOTAL(duration_minutes) AS duration_minutes
+            FROM UserExercises GROUP BY user_id
+            UNION ALL
+            SELECT user_id, sessions, calories_burned, duration_minutes FROM ArchivedExerciseTotals
+        )
+    '''
+    if user_ids is None:
+        conn.execute("DELETE FROM ExerciseTotals")
+        conn.execute(f"INSERT INTO ExerciseTotals {select} GROUP BY user_id")
+        return
+    for user_id in user_ids:
+        conn.execute("DELETE FROM ExerciseTotals WHERE user_id = ?", (user_id,))
+        conn.execute(f"INSERT INTO ExerciseTotals {select} WHERE user_id = ? GROUP BY user_id", (user_id,))
+
+
+# Split a SQL script into complete statements (trigger bodies stay intact)
+def split_statements(script):
+    statements = []
+    buffer = ""
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ""
+    if any(line.strip() and not line.strip().startswith("--") for line in buffer.splitlines()):
+        statements.append(buffer.strip())
+    return statements
+
+
+# Column names of a table, in order
+def table_columns(conn, table, schema="main"):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+# Table definition without comments, IF NOT EXISTS, identifier quotes,
+# the final semicolon, whitespace or case, to compare a CREATE TABLE
+# statement with the one sqlite_master holds
+def normalize_definition(sql):
+    sql = re.sub(r"--[^\n]*", "", sql)
+    sql = re.sub(r"(?i)\bIF\s+NOT\s+EXISTS\b", "", sql)
+    return re.sub(r'[\s";]+', "", sql).casefold()
+
+
+# Recreate `table` from a CREATE TABLE statement (SQLite's documented
+# rebuild: copy into a new table, drop the old one, rename), keeping the
+# columns both definitions share, the table's indexes and triggers and its
+# AUTOINCREMENT counter. Run inside a migration, with foreign keys off.
+def rebuild_table(conn, table, create_sql):
+    columns = table_columns(conn, table)
+    dependents = [row[0] for row in conn.execute('''
+        SELECT sql FROM main.sqlite_master
+        WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    ''', (table,))]
+    sequence = conn.execute("SELECT seq FROM main.sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    rebuilt = f"{table}_rebuild"
+    conn.execute(re.sub(
+        r"(?i)CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?\w+", f"CREATE TABLE {rebuilt}",
+        re.sub(r"--[^\n]*", "", create_sql), count=1
+    ))
+    shared = ", ".join(column for column in table_columns(conn, rebuilt) if column in columns)
+    conn.execute(f"INSERT INTO main.{rebuilt} ({shared}) SELECT {shared} FROM main.{table}")
+    conn.execute(f"DROP TABLE main.{table}")
+    conn.execute(f"ALTER TABLE main.{rebuilt} RENAME TO {table}")
+    for sql in dependents:
+        conn.execute(sql)
+    if sequence is not None:
+        conn.execute(
+            "UPDATE main.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table)
+        )
+
+
+# A migrations/NNNN_description.py step: its upgrade(conn) runs inside the
+# migration transaction, for changes that depend on what the database holds
+def run_python_migration(conn, path):
+    spec = importlib.util.spec_from_file_location(f"migration_{path.stem}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.upgrade(conn)
+
+
+# schema.sql is version 1, followed by migrations/NNNN_description.sql (or
+# .py, see run_python_migration)
+# (shard files: shard_schema.sql, then migrations/shard/NNNN_description.sql)
+def load_migrations(schema=SCHEMA_FILE, directory=MIGRATIONS_DIR):
+    steps = [(1, schema)]
+    for path in [*directory.glob("*.sql"), *directory.glob("*.py")]:
+        steps.append((int(path.name.split("_", 1)[0]), path))
+    steps.sort()
+    versions = [version for version, _ in steps]
+    if versions != list(range(1, len(steps) + 1)):
+        raise ValueError(f"Migration versions must be contiguous, found {versions}")
+    return steps
+
+
+def migrate(db):
+    return db.apply_migrations(load_migrations())
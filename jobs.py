@@ -0,0 +1,397 @@
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import date, timedelta
+
+import archive
+from data import calculate_daily_calorie_goal
+from db import archived_through
+
+# Start the job runner inside the app and API processes. Without it, run
+# `python manage.py jobs-worker` next to them (any number of runners may
+# share a database; each job runs in one of them at a time).
+RUN_JOBS = os.environ.get("MEAL_PLANNER_JOBS") == "1"
+# Seconds between checks for due jobs
+POLL_SECONDS = 60.0
+# A runner that stops checkpointing for this long loses its claim on a job
+LEASE_SECONDS = 300
+# First retry delay after a failure, doubled per consecutive failure
+RETRY_SECONDS = 300
+# Users handled per step (and per transaction) of the per-user jobs
+USER_BATCH = 200
+# UserMealPlans older than this many days move to the columnar archive
+ARCHIVE_PLANS_AFTER_DAYS = int(os.environ.get("MEAL_PLANNER_ARCHIVE_PLANS_DAYS", "365"))
+# Progress and UserExercises older than this many whole months move to the
+# memory-mapped Arrow archive
+ARCHIVE_HISTORY_MONTHS = int(os.environ.get("MEAL_PLANNER_ARCHIVE_HISTORY_MONTHS", "12"))
+# Free pages returned to the file system per database per maintenance run
+VACUUM_PAGES = 20000
+# Rows sampled per index by ANALYZE
+ANALYSIS_LIMIT = 1000
+
+logger = logging.getLogger("meal_planner.jobs")
+
+
+# A job runs as a sequence of steps. step(db, checkpoint) does one bounded
+# piece of work in its own transaction(s) and returns the checkpoint to
+# resume from, or None when the run is complete. Steps must be idempotent:
+# after a crash, the step that was running is repeated.
+class Job:
+    __slots__ = ("name", "interval", "step", "description")
+
+    def __init__(self, name, interval, step, description):
+        self.name = name
+        self.interval = interval
+        self.step = step
+        self.description = description
+
+
+def _shard_key(shard):
+    return getattr(shard, "shard_id", 0)
+
+
+# Next batch of user ids held by a shard (every user when not sharded)
+def _shard_users(shard, after):
+    with shard.read() as conn:
+        if _shard_key(shard):
+            rows = conn.execute('''
+                SELECT user_id FROM UserShards WHERE shard_id = ? AND user_id > ?
+                ORDER BY user_id LIMIT ?
+            ''', (shard.shard_id, after, USER_BATCH)).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT user_id FROM Users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, USER_BATCH)
+            ).fetchall()
+    return [row[0] for row in rows]
+
+
+# One step over the users of every shard in turn: handle(shard, user_ids)
+# gets the next batch. Checkpoint: {"shard": shard_id, "after": user_id}.
+def _user_step(db, checkpoint, handle):
+    checkpoint = checkpoint or {"shard": 0, "after": 0}
+    for shard in sorted(db.all_shards(), key=_shard_key):
+        if _shard_key(shard) < checkpoint["shard"]:
+            continue
+        after = checkpoint["after"] if _shard_key(shard) == checkpoint["shard"] else 0
+        user_ids = _shard_users(shard, after)
+        if user_ids:
+            handle(shard, user_ids)
+            return {"shard": _shard_key(shard), "after": user_ids[-1]}
+    return None
+
+
+SUMMARY_COLUMNS = (
+    "user_id, period, period_start, days_logged, avg_weight, min_weight, max_weight, avg_calories, "
+    "planned_days, avg_planned_calories, workouts, exercise_minutes, calories_burned, updated_at"
+)
+
+
+# Rebuild the users' weekly and monthly rows from their logged progress,
+# planned nutrition and exercise log. Periods starting on or before the
+# history archive's watermark keep the rows built before their days moved.
+def _refresh_summaries(shard, user_ids):
+    users = json.dumps(user_ids)
+    with shard.write() as conn:
+        frozen = max(archived_through(conn, "Progress"), archived_through(conn, "UserExercises"))
+        conn.execute('''
+            DELETE FROM main.UserSummaries
+            WHERE user_id IN (SELECT value FROM json_each(?)) AND period_start > ?
+        ''', (users, frozen))
+        conn.execute(f'''
+            INSERT INTO main.UserSummaries ({SUMMARY_COLUMNS})
+            WITH batch (user_id) AS (SELECT value FROM json_each(:users)),
+            days AS (
+                SELECT p.user_id, p.date, 1 AS logged, p.weight, p.total_calories AS calories,
+                       NULL AS planned, 0 AS workouts, 0 AS minutes, 0 AS burned
+                FROM batch JOIN main.Progress p ON p.user_id = batch.user_id
+                UNION ALL
+                SELECT d.user_id, d.date, 0, NULL, NULL, d.calories, 0, 0, 0
+                FROM batch JOIN main.DailyNutrition d ON d.user_id = batch.user_id
+                UNION ALL
+                SELECT e.user_id, e.date, 0, NULL, NULL, NULL, 1, e.duration_minutes, e.calories_burned
+                FROM batch JOIN main.UserExercises e ON e.user_id = batch.user_id
+            ),
+            periods AS (
+                SELECT 'week' AS period, date(date, '-6 days', 'weekday 1') AS period_start, * FROM days
+                UNION ALL
+                SELECT 'month', date(date, 'start of month'), * FROM days
+            )
+            SELECT user_id, period, period_start, SUM(logged), AVG(weight), MIN(weight), MAX(weight),
+                   AVG(calories), COUNT(planned), AVG(planned), SUM(workouts), TOTAL(minutes),
+                   TOTAL(burned), CURRENT_TIMESTAMP
+            FROM periods
+            WHERE period_start > :frozen
+            GROUP BY user_id, period, period_start
+        ''', {"users": users, "frozen": frozen})
+
+
+def summaries_step(db, checkpoint):
+    def handle(shard, user_ids):
+        _refresh_summaries(shard, user_ids)
+        db.results.bump_users(user_ids)
+    return _user_step(db, checkpoint, handle)
+
+
+# Apply each user's latest logged weight to their profile when it is newer
+# than the profile's weight. A calorie goal still at the suggestion for the
+# old weight follows the new suggestion; a goal the user chose is kept.
+def _refresh_goals(db, shard, user_ids):
+    with shard.read() as conn:
+        # SQLite takes the bare `weight` from the row holding MAX(date)
+        latest = conn.execute('''
+            SELECT user_id, MAX(date), weight FROM main.Progress
+            WHERE user_id IN (SELECT value FROM json_each(?)) AND weight IS NOT NULL
+            GROUP BY user_id
+        ''', (json.dumps(user_ids),)).fetchall()
+    if not latest:
+        return
+    updated = []
+    with db.write() as conn:
+        for user_id, logged_on, weight in latest:
+            row = conn.execute('''
+                SELECT age, gender, height, weight, activity_level, fitness_goal, daily_calorie_goal,
+                       weight_updated
+                FROM Users WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+            if row is None or row[3] == weight or (row[7] and logged_on < row[7]):
+                continue
+            age, gender, height, old_weight, activity_level, fitness_goal, goal, _ = row
+            suggested = int(calculate_daily_calorie_goal(age, gender, height, old_weight, activity_level, fitness_goal))
+            if goal is None or abs(goal - suggested) <= 1:
+                goal = int(calculate_daily_calorie_goal(age, gender, height, weight, activity_level, fitness_goal))
+            conn.execute('''
+                UPDATE Users SET weight = ?, daily_calorie_goal = ?, weight_updated = ?
+                WHERE user_id = ?
+            ''', (weight, goal, logged_on, user_id))
+            updated.append(user_id)
+    db.results.bump_users(updated)
+
+
+def goals_step(db, checkpoint):
+    return _user_step(db, checkpoint, lambda shard, user_ids: _refresh_goals(db, shard, user_ids))
+
+
+# The global database followed by the shard files
+def _databases(db):
+    return [db] + [shard for shard in db.all_shards() if shard is not db]
+
+
+# Refresh planner statistics and, in files switched to incremental
+# auto-vacuum (`manage.py vacuum`), return a batch of free pages. One
+# database per step. Checkpoint: {"next": index into _databases}.
+def maintenance_step(db, checkpoint):
+    databases = _databases(db)
+    index = (checkpoint or {"next": 0})["next"]
+    if index >= len(databases):
+        return None
+    with databases[index].write() as conn:
+        conn.execute(f"PRAGMA main.analysis_limit = {ANALYSIS_LIMIT}")
+        conn.execute("ANALYZE main")
+        if conn.execute("PRAGMA main.auto_vacuum").fetchone()[0] == 2:
+            conn.execute(f"PRAGMA main.incremental_vacuum({VACUUM_PAGES})").fetchall()
+    return {"next": index + 1} if index + 1 < len(databases) else None
+
+
+# Last day of the month before `day`. Archive cutoffs fall on month ends,
+# so each run adds one part per month instead of one per day.
+def _month_end_before(day):
+    return (day.replace(day=1) - timedelta(days=1)).isoformat()
+
+
+def _months_ago(months):
+    today = date.today()
+    index = today.year * 12 + today.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+# Move the rows of `tables` dated up to the cutoff fixed when the run started
+# to the archive, one database per step.
+# Checkpoint: {"through": date, "next": index into _databases}.
+def _archive_step(db, checkpoint, tables, cutoff):
+    if checkpoint is None:
+        checkpoint = {"through": cutoff(), "next": 0}
+    databases = _databases(db)
+    index = checkpoint["next"]
+    if index < len(databases):
+        source = databases[index]
+        part = f"shard{source.shard_id}" if _shard_key(source) else "main"
+        for table in tables:
+            moved = archive.archive_rows(source, table, checkpoint["through"], archive.archive_dir(db), part)
+            if moved:
+                logger.info("archived %d %s rows up to %s from %s", moved, table, checkpoint["through"], part)
+    if index + 1 >= len(databases):
+        return None
+    return {"through": checkpoint["through"], "next": index + 1}
+
+
+# Plans older than ARCHIVE_PLANS_AFTER_DAYS, to Parquet
+def archive_plans_step(db, checkpoint):
+    return _archive_step(
+        db, checkpoint, ("UserMealPlans",),
+        lambda: _month_end_before(date.today() - timedelta(days=ARCHIVE_PLANS_AFTER_DAYS)),
+    )
+
+
+# Progress and exercise logs older than ARCHIVE_HISTORY_MONTHS, to Arrow
+def archive_history_step(db, checkpoint):
+    return _archive_step(
+        db, checkpoint, ("Progress", "UserExercises"),
+        lambda: _month_end_before(_months_ago(ARCHIVE_HISTORY_MONTHS)),
+    )
+
+
+JOBS = {
+    job.name: job
+    for job in (
+        Job("summaries", 24 * 3600, summaries_step, "weekly and monthly summaries per user"),
+        Job("goals", 6 * 3600, goals_step, "profile weight and calorie goal from the latest logged weight"),
+        Job("archive_plans", 24 * 3600, archive_plans_step, "move old meal plans to the Parquet archive"),
+        Job("archive_history", 24 * 3600, archive_history_step,
+            "move old progress and exercise logs to the Arrow archive"),
+        # After archiving, so the pages it frees are returned the same night
+        Job("maintenance", 24 * 3600, maintenance_step, "ANALYZE and incremental VACUUM of every database file"),
+    )
+}
+
+
+# Runs due jobs from JOBS on a background thread. Job state lives in the
+# Jobs table of the global database: a runner claims a job by taking its
+# lease, saves the checkpoint after every step (renewing the lease) and
+# schedules the next run when it completes. A run whose runner died is
+# picked up from its checkpoint once the lease expires.
+class JobRunner:
+    def __init__(self, db, jobs=None, poll_seconds=POLL_SECONDS):
+        self.db = db
+        self.jobs = jobs or JOBS
+        self.poll_seconds = poll_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _claim(self, job, force):
+        with self.db.write() as conn:
+            conn.execute("INSERT OR IGNORE INTO Jobs (name, next_run_at) VALUES (?, CURRENT_TIMESTAMP)", (job.name,))
+            claimed = conn.execute('''
+                UPDATE Jobs SET status = 'running', lease_owner = ?,
+                       lease_expires = datetime('now', ?),
+                       started_at = CASE WHEN checkpoint IS NULL THEN CURRENT_TIMESTAMP ELSE started_at END,
+                       next_run_at = CURRENT_TIMESTAMP
+                WHERE name = ?
+                  AND (lease_owner IS NULL OR lease_expires <= CURRENT_TIMESTAMP OR lease_owner = ?)
+                  AND (? OR next_run_at <= CURRENT_TIMESTAMP)
+            ''', (self.owner, f"+{LEASE_SECONDS} seconds", job.name, self.owner, force)).rowcount
+            if not claimed:
+                return False, None
+            checkpoint = conn.execute("SELECT checkpoint FROM Jobs WHERE name = ?", (job.name,)).fetchone()[0]
+        return True, json.loads(checkpoint) if checkpoint else None
+
+    # Save progress; False if another runner has taken the job over
+    def _checkpoint(self, job, checkpoint):
+        with self.db.write() as conn:
+            return conn.execute('''
+                UPDATE Jobs SET checkpoint = ?, lease_expires = datetime('now', ?)
+                WHERE name = ? AND lease_owner = ?
+            ''', (json.dumps(checkpoint), f"+{LEASE_SECONDS} seconds", job.name, self.owner)).rowcount == 1
+
+    def _finish(self, job):
+        with self.db.write() as conn:
+            conn.execute('''
+                UPDATE Jobs SET status = 'done', checkpoint = NULL, lease_owner = NULL, lease_expires = NULL,
+                       finished_at = CURRENT_TIMESTAMP, runs = runs + 1, failures = 0, last_error = NULL,
+                       next_run_at = datetime('now', ?)
+                WHERE name = ? AND lease_owner = ?
+            ''', (f"+{job.interval} seconds", job.name, self.owner))
+
+    # Stopped between steps: hand the job back for any runner to resume
+    def _release(self, job):
+        with self.db.write() as conn:
+            conn.execute(
+                "UPDATE Jobs SET lease_owner = NULL, lease_expires = NULL WHERE name = ? AND lease_owner = ?",
+                (job.name, self.owner)
+            )
+
+    # The checkpoint is kept, so the retry resumes the failed step
+    def _fail(self, job, error):
+        with self.db.write() as conn:
+            conn.execute('''
+                UPDATE Jobs SET status = 'failed', lease_owner = NULL, lease_expires = NULL,
+                       failures = failures + 1, last_error = ?,
+                       next_run_at = datetime('now', '+' || MIN(? << failures, ?) || ' seconds')
+                WHERE name = ? AND lease_owner = ?
+            ''', (f"{type(error).__name__}: {error}", RETRY_SECONDS, job.interval, job.name, self.owner))
+
+    # Run one job to completion if it is due (or `force`). Returns True if
+    # it completed. Stopping the runner ends the run after the current step.
+    def run(self, name, force=False):
+        job = self.jobs[name]
+        claimed, checkpoint = self._claim(job, force)
+        if not claimed:
+            return False
+        logger.info("job %s %s", name, "resumed" if checkpoint else "started")
+        try:
+            while not self._stop.is_set():
+                checkpoint = job.step(self.db, checkpoint)
+                if checkpoint is None:
+                    self._finish(job)
+                    logger.info("job %s finished", name)
+                    return True
+                if not self._checkpoint(job, checkpoint):
+                    logger.warning("job %s was taken over by another runner", name)
+                    return False
+        except Exception as e:
+            logger.exception("job %s failed", name)
+            self._fail(job, e)
+            return False
+        self._release(job)
+        return False
+
+    def run_pending(self):
+        for name in self.jobs:
+            if self._stop.is_set():
+                break
+            self.run(name)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("job runner error")
+            self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+# [{name, description, status, ...}] for every known job
+def job_status(db):
+    with db.read() as conn:
+        rows = {
+            row[0]: row
+            for row in conn.execute('''
+                SELECT name, status, next_run_at, started_at, finished_at, runs, failures, last_error,
+                       checkpoint, lease_owner
+                FROM Jobs
+            ''')
+        }
+    return [
+        {
+            "name": name, "description": job.description,
+            **dict(zip(
+                ("status", "next_run_at", "started_at", "finished_at", "runs", "failures", "last_error",
+                 "checkpoint", "lease_owner"),
+                rows.get(name, (name, "idle", None, None, None, 0, 0, None, None, None))[1:]
+            )),
+        }
+        for name, job in JOBS.items()
+    ]
@@ -0,0 +1,380 @@
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import bulk
+import jobs
+from db import migrate, rebuild_daily_nutrition, rebuild_exercise_totals, verify_daily_nutrition
+from shards import ShardedDatabase
+
+APP_DIR = Path(__file__).resolve().parent
+# Cold import of the app module must stay under this budget
+STARTUP_BUDGET_MS = 2500
+# Modules only the pages that need them may import
+LAZY_MODULES = ("pandas", "numpy", "matplotlib", "seaborn", "PIL", "analytics", "charts")
+
+
+def cmd_migrate(db, args):
+    applied = migrate(db)
+    print(f"Applied migrations: {applied}" if applied else "Database is up to date")
+
+
+def cmd_rebuild_nutrition(db, args):
+    rows = 0
+    for shard in db.all_shards():
+        with shard.write() as conn:
+            rows += rebuild_daily_nutrition(conn)
+    print(f"Rebuilt DailyNutrition: {rows} rows")
+
+
+def cmd_rebuild_exercise_totals(db, args):
+    for shard in db.all_shards():
+        with shard.write() as conn:
+            rebuild_exercise_totals(conn)
+    print("Rebuilt ExerciseTotals")
+
+
+def cmd_verify_nutrition(db, args):
+    mismatched = []
+    for shard in db.all_shards():
+        with shard.read() as conn:
+            mismatched += verify_daily_nutrition(conn)
+    for user_id, date in mismatched[:args.limit]:
+        print(f"mismatch: user_id={user_id} date={date}")
+    print(f"{len(mismatched)} mismatched rows")
+    return 1 if mismatched else 0
+
+
+def cmd_import(db, args):
+    result = bulk.import_file(
+        db, args.kind, args.path, fmt=args.format, batch_size=args.batch_size,
+        rejects_path=args.rejects, restart=args.restart
+    )
+    if result.resumed_from and result.position == result.resumed_from:
+        print("Already imported; use --restart to load it again")
+    elif result.resumed_from:
+        print(f"Resumed after record {result.resumed_from}")
+    print(f"Loaded {result.loaded} rows, rejected {result.rejected} (read {result.position} records)")
+
+
+def cmd_export(db, args):
+    count = bulk.export_file(
+        db, args.kind, args.path, fmt=args.format, user_id=args.user_id, page_size=args.page_size
+    )
+    print(f"Exported {count} rows")
+
+
+def cmd_cohort_report(db, args):
+    import analytics
+
+    import pandas as pd
+
+    if args.users:
+        user_ids = [int(u) for u in args.users.split(",")]
+    else:
+        user_ids = analytics.progress_users(db, args.start, args.end)
+    parts = []
+    for shard, shard_users in db.group_users(user_ids):
+        with shard.read() as conn:
+            parts.append(analytics.cohort_report(conn, args.start, args.end, shard_users, db=db))
+    report = pd.concat(parts).sort_index() if parts else pd.DataFrame()
+    if args.out:
+        report.to_csv(args.out)
+        print(f"Wrote {len(report)} users to {args.out}")
+    else:
+        print(report.to_string())
+
+
+def cmd_shard_init(db, args):
+    paths = [f"{args.prefix}{i}.db" for i in range(1, args.shards + 1)]
+    counts = db.create_shards(paths)
+    for path, (shard_id, rows) in zip(paths, counts.items()):
+        print(f"shard {shard_id}: {path}, {rows} rows")
+
+
+def cmd_shard_add(db, args):
+    shard_id = db.add_shard(args.path)
+    print(f"Added shard {shard_id} at {db.shard_path(args.path)}; new users are assigned to it first")
+    if args.rebalance:
+        moves = db.rebalance()
+        print(f"Moved {len(moves)} users")
+
+
+def cmd_shard_rebalance(db, args):
+    if len(db.all_shards()) < 2:
+        print("Nothing to rebalance: fewer than two shards")
+        return 0
+    moves = db.rebalance(args.max_moves, args.dry_run)
+    print(f"{'Would move' if args.dry_run else 'Moved'} {len(moves)} users, "
+          f"{sum(move[3] for move in moves)} rows")
+
+
+def cmd_shard_status(db, args):
+    status = db.shard_status()
+    if not status:
+        print("Not sharded")
+        return 0
+    print(f"{'shard':>5}  {'users':>8}  {'plans':>10}  {'progress':>10}  {'exercises':>10}  {'MB':>8}  path")
+    for shard in status:
+        print(f"{shard['shard_id']:>5}  {shard['users']:>8}  {shard['UserMealPlans']:>10}  "
+              f"{shard['Progress']:>10}  {shard['UserExercises']:>10}  "
+              f"{shard['bytes'] / 1e6:>8.1f}  {shard['path']}")
+    orphans = db.orphans()
+    if orphans:
+        print(f"{len(orphans)} users have rows left on a shard they were moved off "
+              "(removed by shard-rebalance)")
+
+
+# Read-only SQL on every shard, e.g. "SELECT COUNT(*) FROM Progress".
+# The shard column says where each row came from.
+def cmd_shard_query(db, args):
+    results = db.query_all(args.sql, args.params)
+    for shard_id, rows in results:
+        for row in rows:
+            print("\t".join(str(value) for value in (shard_id if shard_id is not None else "-",) + tuple(row)))
+    if args.sum:
+        totals = [sum(values) for values in zip(*(row for _, rows in results for row in rows))]
+        print("\t".join(str(value) for value in ("total", *totals)))
+
+
+def cmd_jobs_status(db, args):
+    for job in jobs.job_status(db):
+        print(f"{job['name']:<14} {job['status']:<8} runs={job['runs']:<5} next={job['next_run_at'] or 'now'}  "
+              f"{job['description']}")
+        if job["checkpoint"]:
+            print(f"{'':<14} resumes from {job['checkpoint']} (held by {job['lease_owner'] or 'nobody'})")
+        if job["last_error"]:
+            print(f"{'':<14} last error ({job['failures']} in a row): {job['last_error']}")
+
+
+# Run jobs now, in this process: the named ones regardless of schedule,
+# otherwise whichever are due
+def cmd_jobs_run(db, args):
+    unknown = sorted(set(args.names) - set(jobs.JOBS))
+    if unknown:
+        print(f"Unknown jobs: {', '.join(unknown)} (known: {', '.join(jobs.JOBS)})")
+        return 2
+    runner = jobs.JobRunner(db)
+    completed = failed = 0
+    for name in args.names or jobs.JOBS:
+        started = time.perf_counter()
+        if runner.run(name, force=bool(args.names)):
+            completed += 1
+            print(f"{name}: done in {time.perf_counter() - started:.1f}s")
+        elif args.names:
+            failed += 1
+            print(f"{name}: not completed (failed or running elsewhere; see jobs-status)")
+    if not completed and not failed:
+        print("No jobs due")
+    return 1 if failed else 0
+
+
+def cmd_jobs_worker(db, args):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    runner = jobs.JobRunner(db, poll_seconds=args.poll).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        runner.stop()
+
+
+def cmd_vacuum(db, args):
+    for database in [db] + [shard for shard in db.all_shards() if shard is not db]:
+        started = time.perf_counter()
+        pages = database.vacuum()
+        print(f"{database.path}: {pages} pages, {time.perf_counter() - started:.1f}s")
+
+
+def cmd_bench_kdf(db, args):
+    import auth
+
+    result = auth.benchmark(args.seconds, args.threads)
+    print(f"scrypt {result['params']}, {result['threads']} threads, {result['seconds']:.1f}s")
+    print(f"{result['logins_per_second']:.1f} logins/sec, "
+          f"{result['logins_per_second_per_core']:.1f} logins/sec/core")
+
+
+# Tree of (module, cumulative_us, children) from `python -X importtime` output,
+# which lists each module after the modules it imported
+def parse_importtime(output):
+    levels = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        node = (name.strip(), int(cumulative), levels.pop(depth + 1, []))
+        levels.setdefault(depth, []).append(node)
+    return levels.get(0, [])
+
+
+def _modules(node):
+    yield node[0]
+    for child in node[2]:
+        yield from _modules(child)
+
+
+def measure_startup(module, runs):
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=APP_DIR, capture_output=True, text=True, check=True
+        )
+        root = next(node for node in parse_importtime(result.stderr) if node[0] == module)
+        samples.append(root)
+    return sorted(samples, key=lambda node: node[1])[len(samples) // 2]
+
+
+# Median cold import of `module`: (total ms, import tree, lazy modules that
+# our own imports pulled in, not third-party packages like streamlit).
+# Shared by startup-budget and test_startup.py.
+def check_startup(module="n", runs=3):
+    root = measure_startup(module, runs)
+    eager = sorted({
+        name.split(".")[0]
+        for child in root[2]
+        if child[0] in LAZY_MODULES or (APP_DIR / f"{child[0]}.py").exists()
+        for name in _modules(child)
+        if name.split(".")[0] in LAZY_MODULES
+    })
+    return root[1] / 1000, root, eager
+
+
+def cmd_startup_budget(db, args):
+    total_ms, root, eager = check_startup(args.module, args.runs)
+    children = sorted(root[2], key=lambda node: node[1], reverse=True)
+    for name, cumulative, _ in children[:args.top]:
+        print(f"{cumulative / 1000:9.1f} ms  {name}")
+    print(f"import {args.module}: {total_ms:.1f} ms (budget {args.budget_ms} ms, median of {args.runs})")
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "module": args.module,
+                "total_ms": round(total_ms, 1),
+                "imports": {name: round(cumulative / 1000, 1) for name, cumulative, _ in children},
+                "eager_lazy_modules": eager,
+            }) + "\n")
+    if eager:
+        print(f"imported at startup but should be lazy: {', '.join(eager)}")
+    if eager or total_ms > args.budget_ms:
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Meal planner database maintenance")
+    parser.add_argument("--db", default="meal_planner.db", help="SQLite database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("migrate", help="apply pending schema migrations").set_defaults(func=cmd_migrate)
+    commands.add_parser(
+        "rebuild-nutrition", help="recompute the DailyNutrition rollup from UserMealPlans"
+    ).set_defaults(func=cmd_rebuild_nutrition)
+    commands.add_parser(
+        "rebuild-exercise-totals", help="recompute ExerciseTotals from UserExercises"
+    ).set_defaults(func=cmd_rebuild_exercise_totals)
+    verify = commands.add_parser(
+        "verify-nutrition", help="compare DailyNutrition against a fresh recomputation"
+    )
+    verify.add_argument("--limit", type=int, default=20, help="mismatches to print")
+    verify.set_defaults(func=cmd_verify_nutrition)
+
+    load = commands.add_parser("import", help="bulk load a CSV/JSONL file (resumable)")
+    load.add_argument("kind", choices=sorted(bulk.KINDS))
+    load.add_argument("path")
+    load.add_argument("--format", choices=["csv", "jsonl"], help="default: from file extension")
+    load.add_argument("--batch-size", type=int, default=1000)
+    load.add_argument("--rejects", help="append rejected records to this JSONL file")
+    load.add_argument("--restart", action="store_true", help="ignore a previous checkpoint")
+    load.set_defaults(func=cmd_import)
+
+    dump = commands.add_parser("export", help="stream a table to a CSV/JSONL file")
+    dump.add_argument("kind", choices=sorted(bulk.KINDS))
+    dump.add_argument("path")
+    dump.add_argument("--format", choices=["csv", "jsonl"], help="default: from file extension")
+    dump.add_argument("--user-id", type=int)
+    dump.add_argument("--page-size", type=int, default=5000)
+    dump.set_defaults(func=cmd_export)
+
+    cohort = commands.add_parser("cohort-report", help="per-user progress analytics for a date range")
+    cohort.add_argument("start", help="YYYY-MM-DD")
+    cohort.add_argument("end", help="YYYY-MM-DD")
+    cohort.add_argument("--users", help="comma-separated user ids (default: all with progress)")
+    cohort.add_argument("--out", help="write CSV here instead of printing")
+    cohort.set_defaults(func=cmd_cohort_report)
+
+    shard_init = commands.add_parser(
+        "shard-init", help="split the per-user tables into shard files (run with the app stopped)"
+    )
+    shard_init.add_argument("--shards", type=int, required=True)
+    shard_init.add_argument("--prefix", default="shards/shard-", help="shard paths, relative to --db")
+    shard_init.set_defaults(func=cmd_shard_init)
+
+    shard_add = commands.add_parser("shard-add", help="register a new, empty shard file")
+    shard_add.add_argument("path", help="relative to the directory of --db")
+    shard_add.add_argument("--rebalance", action="store_true", help="move users onto it right away")
+    shard_add.set_defaults(func=cmd_shard_add)
+
+    rebalance = commands.add_parser("shard-rebalance", help="move users so shards hold similar row counts")
+    rebalance.add_argument("--max-moves", type=int)
+    rebalance.add_argument("--dry-run", action="store_true")
+    rebalance.set_defaults(func=cmd_shard_rebalance)
+
+    commands.add_parser("shard-status", help="users, rows and size per shard").set_defaults(func=cmd_shard_status)
+
+    shard_query = commands.add_parser("shard-query", help="run a read-only query on every shard")
+    shard_query.add_argument("sql")
+    shard_query.add_argument("params", nargs="*")
+    shard_query.add_argument("--sum", action="store_true", help="also print column totals")
+    shard_query.set_defaults(func=cmd_shard_query)
+
+    commands.add_parser("jobs-status", help="state of the background jobs").set_defaults(func=cmd_jobs_status)
+
+    run_jobs = commands.add_parser("jobs-run", help="run background jobs now (default: the due ones)")
+    run_jobs.add_argument("names", nargs="*", help="jobs to run even if not due")
+    run_jobs.set_defaults(func=cmd_jobs_run)
+
+    worker = commands.add_parser("jobs-worker", help="run the background job scheduler in the foreground")
+    worker.add_argument("--poll", type=float, default=jobs.POLL_SECONDS, help="seconds between checks for due jobs")
+    worker.set_defaults(func=cmd_jobs_worker)
+
+    commands.add_parser(
+        "vacuum", help="rebuild every database file with incremental auto-vacuum (run with the app stopped)"
+    ).set_defaults(func=cmd_vacuum)
+
+    bench = commands.add_parser("bench-kdf", help="measure password verifications per second")
+    bench.add_argument("--seconds", type=float, default=3.0)
+    bench.add_argument("--threads", type=int, help="concurrent verifiers (default: CPU count)")
+    bench.set_defaults(func=cmd_bench_kdf, needs_db=False)
+
+    startup = commands.add_parser(
+        "startup-budget", help="check the app's cold import time with python -X importtime"
+    )
+    startup.add_argument("--module", default="n")
+    startup.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    startup.add_argument("--runs", type=int, default=3, help="report the median of this many cold imports")
+    startup.add_argument("--top", type=int, default=10, help="slowest direct imports to list")
+    startup.add_argument("--out", help="append the measurement as a JSON line to this file")
+    startup.set_defaults(func=cmd_startup_budget, needs_db=False)
+
+    args = parser.parse_args(argv)
+    if not getattr(args, "needs_db", True):
+        return args.func(None, args) or 0
+    db = ShardedDatabase(args.db)
+    try:
+        if args.command != "migrate":
+            migrate(db)
+        return args.func(db, args) or 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+-- Registration used to store only the first word of the activity level
+-- ('lightly', 'moderately', ...), which the Users CHECK constraint rejects
+UPDATE Users
+SET activity_level = activity_level || ' active'
+WHERE activity_level IN ('lightly', 'moderately', 'very', 'extra');
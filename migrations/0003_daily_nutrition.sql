@@ -0,0 +1,28 @@
+-- Per-user, per-day nutrition totals of planned meals (portion-scaled).
+-- Maintained in the same transaction as UserMealPlans writes; see
+-- db.refresh_daily_nutrition and `python manage.py verify-nutrition`.
+CREATE TABLE IF NOT EXISTS DailyNutrition (
+    user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    meal_count INTEGER NOT NULL DEFAULT 0,
+    calories REAL NOT NULL DEFAULT 0,
+    protein REAL NOT NULL DEFAULT 0,    -- in grams
+    carbs REAL NOT NULL DEFAULT 0,      -- in grams
+    fats REAL NOT NULL DEFAULT 0,       -- in grams
+    fiber REAL NOT NULL DEFAULT 0,      -- in grams
+    sugar REAL NOT NULL DEFAULT 0,      -- in grams
+    sodium REAL NOT NULL DEFAULT 0,     -- in mg
+    PRIMARY KEY (user_id, date)
+) WITHOUT ROWID;
+
+INSERT OR REPLACE INTO DailyNutrition (
+    user_id, date, meal_count, calories, protein, carbs, fats, fiber, sugar, sodium
+)
+SELECT up.user_id, up.date, COUNT(*),
+       TOTAL(m.calories * up.portion_size), TOTAL(m.protein * up.portion_size),
+       TOTAL(m.carbs * up.portion_size), TOTAL(m.fats * up.portion_size),
+       TOTAL(m.fiber * up.portion_size), TOTAL(m.sugar * up.portion_size),
+       TOTAL(m.sodium * up.portion_size)
+FROM UserMealPlans up
+JOIN Meals m ON up.meal_id = m.meal_id
+GROUP BY up.user_id, up.date;
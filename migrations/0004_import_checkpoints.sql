@@ -0,0 +1,12 @@
+-- Resume points for bulk imports (see bulk.py); updated in the same
+-- transaction as each loaded batch
+CREATE TABLE IF NOT EXISTS ImportCheckpoints (
+    source TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0,   -- records consumed from the source
+    loaded INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, kind)
+);
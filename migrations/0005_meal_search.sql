@@ -0,0 +1,34 @@
+-- Composite indexes for browsing the catalog by preference and meal type
+-- in name order (the planner pages through these instead of loading all meals)
+CREATE INDEX IF NOT EXISTS idx_meals_preference_type ON Meals(dietary_preference, meal_type, meal_name);
+CREATE INDEX IF NOT EXISTS idx_meals_type ON Meals(meal_type, meal_name);
+
+-- Full-text index over meal names and descriptions (external content,
+-- kept in sync with Meals by the triggers below)
+CREATE VIRTUAL TABLE IF NOT EXISTS MealsSearch USING fts5(
+    meal_name,
+    description,
+    content='Meals',
+    content_rowid='meal_id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS meals_search_insert AFTER INSERT ON Meals BEGIN
+    INSERT INTO MealsSearch (rowid, meal_name, description)
+    VALUES (new.meal_id, new.meal_name, new.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS meals_search_delete AFTER DELETE ON Meals BEGIN
+    INSERT INTO MealsSearch (MealsSearch, rowid, meal_name, description)
+    VALUES ('delete', old.meal_id, old.meal_name, old.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS meals_search_update AFTER UPDATE OF meal_name, description ON Meals BEGIN
+    INSERT INTO MealsSearch (MealsSearch, rowid, meal_name, description)
+    VALUES ('delete', old.meal_id, old.meal_name, old.description);
+    INSERT INTO MealsSearch (rowid, meal_name, description)
+    VALUES (new.meal_id, new.meal_name, new.description);
+END;
+
+INSERT INTO MealsSearch (MealsSearch) VALUES ('rebuild');
@@ -0,0 +1,13 @@
+-- Per-user running totals of logged exercise, updated by each UserExercises
+-- insert so the history summary does not scan a user's whole log
+CREATE TABLE IF NOT EXISTS ExerciseTotals (
+    user_id INTEGER PRIMARY KEY REFERENCES Users(user_id) ON DELETE CASCADE,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    calories_burned INTEGER NOT NULL DEFAULT 0,
+    duration_minutes REAL NOT NULL DEFAULT 0
+);
+
+INSERT OR REPLACE INTO ExerciseTotals (user_id, sessions, calories_burned, duration_minutes)
+SELECT user_id, COUNT(*), TOTAL(calories_burned), TOTAL(duration_minutes)
+FROM UserExercises
+GROUP BY user_id;
@@ -0,0 +1,30 @@
+-- Shard directory (see shards.py). While Shards is empty the per-user
+-- tables live in this database as before; once shards are registered,
+-- UserMealPlans, Progress, UserExercises and their rollups live in the
+-- shard files and UserShards records which shard holds each user.
+CREATE TABLE IF NOT EXISTS Shards (
+    shard_id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    user_count INTEGER NOT NULL DEFAULT 0,  -- maintained by the triggers below
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS UserShards (
+    user_id INTEGER PRIMARY KEY REFERENCES Users(user_id) ON DELETE CASCADE,
+    shard_id INTEGER NOT NULL REFERENCES Shards(shard_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_shards ON UserShards(shard_id);
+
+CREATE TRIGGER IF NOT EXISTS user_shards_insert AFTER INSERT ON UserShards BEGIN
+    UPDATE Shards SET user_count = user_count + 1 WHERE shard_id = new.shard_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_shards_delete AFTER DELETE ON UserShards BEGIN
+    UPDATE Shards SET user_count = user_count - 1 WHERE shard_id = old.shard_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_shards_update AFTER UPDATE OF shard_id ON UserShards BEGIN
+    UPDATE Shards SET user_count = user_count - 1 WHERE shard_id = old.shard_id;
+    UPDATE Shards SET user_count = user_count + 1 WHERE shard_id = new.shard_id;
+END;
@@ -0,0 +1,65 @@
+-- Background jobs (see jobs.py): one row per job with its schedule, the
+-- lease of the process running it and the checkpoint of an unfinished run,
+-- so a run interrupted by a restart resumes where it stopped.
+CREATE TABLE IF NOT EXISTS Jobs (
+    name TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'idle' CHECK (status IN ('idle', 'running', 'done', 'failed')),
+    checkpoint TEXT,                -- JSON; NULL when no run is in progress
+    lease_owner TEXT,
+    lease_expires TEXT,
+    next_run_at TEXT,
+    started_at TEXT,
+    finished_at TEXT,
+    runs INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,  -- consecutive; reset by a successful run
+    last_error TEXT
+);
+
+-- Date of the last logged weight applied to the profile (by the goals job
+-- or a profile update), so older Progress entries never overwrite it
+ALTER TABLE Users ADD COLUMN weight_updated TEXT;
+
+-- Weekly and monthly per-user rollups of Progress, DailyNutrition and
+-- UserExercises, rebuilt by the summaries job. period_start is the Monday
+-- of the week or the first of the month.
+CREATE TABLE IF NOT EXISTS UserSummaries (
+    user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
+    period TEXT NOT NULL CHECK (period IN ('week', 'month')),
+    period_start TEXT NOT NULL,
+    days_logged INTEGER NOT NULL DEFAULT 0,
+    avg_weight REAL,
+    min_weight REAL,
+    max_weight REAL,
+    avg_calories REAL,              -- logged in Progress
+    planned_days INTEGER NOT NULL DEFAULT 0,
+    avg_planned_calories REAL,
+    workouts INTEGER NOT NULL DEFAULT 0,
+    exercise_minutes REAL NOT NULL DEFAULT 0,
+    calories_burned REAL NOT NULL DEFAULT 0,
+    updated_at TEXT,
+    PRIMARY KEY (user_id, period, period_start)
+) WITHOUT ROWID;
+
+-- Rows of a table dated up to through_date were moved to the columnar
+-- archive (see archive.py). They can no longer be added, changed or
+-- removed here, which keeps the DailyNutrition rollup of those days valid.
+CREATE TABLE IF NOT EXISTS ArchiveWatermarks (
+    table_name TEXT PRIMARY KEY,
+    through_date TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS archived_plans_insert BEFORE INSERT ON UserMealPlans
+WHEN new.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserMealPlans') BEGIN
+    SELECT RAISE(ABORT, 'meal plans of this date are archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS archived_plans_update BEFORE UPDATE ON UserMealPlans
+WHEN old.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserMealPlans')
+  OR new.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserMealPlans') BEGIN
+    SELECT RAISE(ABORT, 'meal plans of this date are archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS archived_plans_delete BEFORE DELETE ON UserMealPlans
+WHEN old.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserMealPlans') BEGIN
+    SELECT RAISE(ABORT, 'meal plans of this date are archived');
+END;
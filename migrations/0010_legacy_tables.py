@@ -0,0 +1,53 @@
+# Databases created by the app's original init_db kept their tables when
+# schema.sql (version 1, CREATE TABLE IF NOT EXISTS) was applied to them:
+# UserExercises without notes/created_at, Exercises without created_at and
+# a UNIQUE name, and fewer CHECK constraints. Rebuild every table whose
+# definition differs from schema.sql, keeping ids and data.
+import re
+import sqlite3
+
+from db import SCHEMA_FILE, normalize_definition, rebuild_table, split_statements, table_columns
+
+
+# The schema.sql definition plus the columns later migrations added with
+# ALTER TABLE (e.g. Users.weight_updated from 0008), which SQLite appends to
+# the stored definition the same way
+def target_definition(conn, table, statement):
+    statement = re.sub(r"--[^\n]*", "", statement)
+    scratch = sqlite3.connect(":memory:")
+    try:
+        scratch.execute(statement)
+        defined = set(table_columns(scratch, table))
+    finally:
+        scratch.close()
+    added = [
+        f"{name} {kind}" + (" NOT NULL" if notnull else "") + (f" DEFAULT {default}" if default is not None else "")
+        for _, name, kind, notnull, default, _ in conn.execute(f"PRAGMA main.table_info({table})")
+        if name not in defined
+    ]
+    if not added:
+        return statement
+    end = statement.rindex(")")
+    return f"{statement[:end]}, {', '.join(added)}{statement[end:]}"
+
+
+def upgrade(conn):
+    # Duplicate exercise names would fail UNIQUE(exercise_name); renaming
+    # keeps their ids, so logs on any shard still point at them
+    conn.execute('''
+        UPDATE Exercises SET exercise_name = exercise_name || ' (' || exercise_id || ')'
+        WHERE exercise_id NOT IN (SELECT MIN(exercise_id) FROM Exercises GROUP BY exercise_name)
+    ''')
+    for statement in split_statements(SCHEMA_FILE.read_text()):
+        match = re.search(r"(?i)CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)", statement)
+        if match is None:
+            continue
+        table = match.group(1)
+        row = conn.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        if row is None:
+            continue
+        target = target_definition(conn, table, statement)
+        if normalize_definition(row[0]) != normalize_definition(target):
+            rebuild_table(conn, table, target)
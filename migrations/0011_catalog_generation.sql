@@ -0,0 +1,34 @@
+-- Catalog generation, bumped by every change to Meals or Exercises. Each
+-- process's CatalogCache (see cache.py) compares it with the value it last
+-- saw, so meals added by the API or `manage.py import` reach the catalog
+-- and planner indexes of the Streamlit process without a restart.
+CREATE TABLE IF NOT EXISTS CatalogGeneration (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO CatalogGeneration (id, generation) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS meals_generation_insert AFTER INSERT ON Meals BEGIN
+    UPDATE CatalogGeneration SET generation = generation + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS meals_generation_update AFTER UPDATE ON Meals BEGIN
+    UPDATE CatalogGeneration SET generation = generation + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS meals_generation_delete AFTER DELETE ON Meals BEGIN
+    UPDATE CatalogGeneration SET generation = generation + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS exercises_generation_insert AFTER INSERT ON Exercises BEGIN
+    UPDATE CatalogGeneration SET generation = generation + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS exercises_generation_update AFTER UPDATE ON Exercises BEGIN
+    UPDATE CatalogGeneration SET generation = generation + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS exercises_generation_delete AFTER DELETE ON Exercises BEGIN
+    UPDATE CatalogGeneration SET generation = generation + 1;
+END;
@@ -0,0 +1,39 @@
+-- Per-user tables of migration 0008 (see migrations/0008_jobs.sql)
+CREATE TABLE IF NOT EXISTS UserSummaries (
+    user_id INTEGER NOT NULL,
+    period TEXT NOT NULL CHECK (period IN ('week', 'month')),
+    period_start TEXT NOT NULL,
+    days_logged INTEGER NOT NULL DEFAULT 0,
+    avg_weight REAL,
+    min_weight REAL,
+    max_weight REAL,
+    avg_calories REAL,
+    planned_days INTEGER NOT NULL DEFAULT 0,
+    avg_planned_calories REAL,
+    workouts INTEGER NOT NULL DEFAULT 0,
+    exercise_minutes REAL NOT NULL DEFAULT 0,
+    calories_burned REAL NOT NULL DEFAULT 0,
+    updated_at TEXT,
+    PRIMARY KEY (user_id, period, period_start)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ArchiveWatermarks (
+    table_name TEXT PRIMARY KEY,
+    through_date TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS archived_plans_insert BEFORE INSERT ON UserMealPlans
+WHEN new.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserMealPlans') BEGIN
+    SELECT RAISE(ABORT, 'meal plans of this date are archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS archived_plans_update BEFORE UPDATE ON UserMealPlans
+WHEN old.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserMealPlans')
+  OR new.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserMealPlans') BEGIN
+    SELECT RAISE(ABORT, 'meal plans of this date are archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS archived_plans_delete BEFORE DELETE ON UserMealPlans
+WHEN old.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserMealPlans') BEGIN
+    SELECT RAISE(ABORT, 'meal plans of this date are archived');
+END;
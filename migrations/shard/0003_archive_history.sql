@@ -0,0 +1,39 @@
+-- Per-user tables and triggers of migration 0009 (see migrations/0009_archive_history.sql)
+CREATE TABLE IF NOT EXISTS ArchivedExerciseTotals (
+    user_id INTEGER PRIMARY KEY,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    calories_burned INTEGER NOT NULL DEFAULT 0,
+    duration_minutes REAL NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS archived_progress_insert BEFORE INSERT ON Progress
+WHEN new.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'Progress') BEGIN
+    SELECT RAISE(ABORT, 'progress entries of this date are archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS archived_progress_update BEFORE UPDATE ON Progress
+WHEN old.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'Progress')
+  OR new.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'Progress') BEGIN
+    SELECT RAISE(ABORT, 'progress entries of this date are archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS archived_progress_delete BEFORE DELETE ON Progress
+WHEN old.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'Progress') BEGIN
+    SELECT RAISE(ABORT, 'progress entries of this date are archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS archived_exercises_insert BEFORE INSERT ON UserExercises
+WHEN new.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserExercises') BEGIN
+    SELECT RAISE(ABORT, 'exercise logs of this date are archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS archived_exercises_update BEFORE UPDATE ON UserExercises
+WHEN old.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserExercises')
+  OR new.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserExercises') BEGIN
+    SELECT RAISE(ABORT, 'exercise logs of this date are archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS archived_exercises_delete BEFORE DELETE ON UserExercises
+WHEN old.date <= (SELECT through_date FROM ArchiveWatermarks WHERE table_name = 'UserExercises') BEGIN
+    SELECT RAISE(ABORT, 'exercise logs of this date are archived');
+END;
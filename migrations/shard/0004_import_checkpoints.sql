@@ -0,0 +1,14 @@
+-- Per-shard resume points for bulk imports (see bulk.py): the last source
+-- record whose batch committed on this shard, and this shard's share of
+-- the loaded and rejected rows. Updated in the same transaction as the
+-- rows, so a resumed import skips what the shard already holds.
+CREATE TABLE IF NOT EXISTS ImportCheckpoints (
+    source TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0,
+    loaded INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, kind)
+);
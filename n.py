@@ -1,329 +1,163 @@
+import os
+
+# Headless server: never let matplotlib probe for a GUI backend
+os.environ.setdefault("MPLBACKEND", "Agg")
+
 import streamlit as st
 import sqlite3
-from datetime import datetime
-import hashlib
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from PIL import Image
-
-# Database connection with error handling
+import sys
+from concurrent.futures import TimeoutError as KDFTimeoutError
+from datetime import datetime, timedelta
+import auth
+import jobs
+import profiler
+import querystats
+import data
+from data import (
+    EXERCISE_PAGE_SIZE, GROUP_COMMIT, MEAL_SEARCH_PAGE_SIZE, MEAL_SUGGESTIONS, calculate_daily_calorie_goal
+)
+from db import migrate
+from shards import ShardedDatabase
+
+# Show connection pool and cache statistics in the sidebar
+SHOW_DB_STATS = os.environ.get("MEAL_PLANNER_DEBUG") == "1"
+# Process-wide pooled database, shared by every session and rerun.
+# Schema migrations run here, once per process, never on reruns, and so
+# does the background job runner when MEAL_PLANNER_JOBS=1.
+@st.cache_resource
+def get_database(db_name):
+    db = ShardedDatabase(db_name, group_commit=GROUP_COMMIT)
+    try:
+        migrate(db)
+    except Exception:
+        db.close()
+        raise
+    if jobs.RUN_JOBS:
+        jobs.JobRunner(db).start()
+    return db
+
 def create_connection(db_name):
     try:
-        conn = sqlite3.connect(db_name)
-        conn.execute("PRAGMA foreign_keys = ON")  # Enable foreign key constraints
-        return conn
+        return get_database(db_name)
     except sqlite3.Error as e:
         st.error(f"Database connection error: {e}")
         return None
 
-# Password hashing for security
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-# Initialize database with improved schema
-def init_db(conn):
+# The data functions live in data.py; these wrappers report database errors
+# (and a password hash timing out on the busy KDF pool) on the page and
+# return `default` instead
+def ui_call(message, default, fn, *args, **kwargs):
     try:
-        cursor = conn.cursor()
-        
-        # Users table with more fields
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Users (
-                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                password TEXT NOT NULL,
-                email TEXT UNIQUE,
-                age INTEGER CHECK (age >= 1 AND age <= 120),
-                gender TEXT,
-                height REAL CHECK (height > 0),
-                weight REAL CHECK (weight > 0),
-                fitness_goal TEXT,
-                activity_level TEXT,
-                daily_calorie_goal INTEGER CHECK (daily_calorie_goal > 0),
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Meals table with more nutritional info
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Meals (
-                meal_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                meal_name TEXT NOT NULL,
-                description TEXT,
-                calories INTEGER NOT NULL CHECK (calories >= 0),
-                protein REAL CHECK (protein >= 0),
-                carbs REAL CHECK (carbs >= 0),
-                fats REAL CHECK (fats >= 0),
-                fiber REAL CHECK (fiber >= 0),
-                sugar REAL CHECK (sugar >= 0),
-                sodium REAL CHECK (sodium >= 0),
-                dietary_preference TEXT,
-                meal_type TEXT CHECK (meal_type IN ('Breakfast', 'Lunch', 'Dinner', 'Snack')),
-                created_by INTEGER REFERENCES Users(user_id),
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Meal plans with portion size
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS UserMealPlans (
-                plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
-                meal_id INTEGER NOT NULL REFERENCES Meals(meal_id) ON DELETE CASCADE,
-                date TEXT NOT NULL,
-                portion_size REAL DEFAULT 1.0 CHECK (portion_size > 0),
-                meal_type TEXT,
-                UNIQUE(user_id, meal_id, date, meal_type)
-            )
-        ''')
-        
-        # Progress tracking with weight tracking
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Progress (
-                progress_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
-                date TEXT NOT NULL,
-                weight REAL CHECK (weight > 0),
-                total_calories INTEGER CHECK (total_calories >= 0),
-                total_protein REAL CHECK (total_protein >= 0),
-                total_carbs REAL CHECK (total_carbs >= 0),
-                total_fats REAL CHECK (total_fats >= 0),
-                notes TEXT,
-                UNIQUE(user_id, date)
-            )
-        ''')
-        
-        # Exercise tracking table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Exercises (
-                exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                exercise_name TEXT NOT NULL,
-                calories_burned_per_hour INTEGER CHECK (calories_burned_per_hour >= 0),
-                description TEXT,
-                intensity TEXT CHECK (intensity IN ('Low', 'Medium', 'High'))
-            )
-        ''')
-        
-        # User exercises
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS UserExercises (
-                log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
-                exercise_id INTEGER NOT NULL REFERENCES Exercises(exercise_id) ON DELETE CASCADE,
-                date TEXT NOT NULL,
-                duration_minutes REAL CHECK (duration_minutes > 0),
-                calories_burned INTEGER CHECK (calories_burned >= 0)
-            )
-        ''')
-        
-        conn.commit()
+        return fn(*args, **kwargs)
     except sqlite3.Error as e:
-        st.error(f"Database initialization error: {e}")
+        st.error(f"{message}: {e}")
+        return default
+    except KDFTimeoutError:
+        st.error(auth.KDF_BUSY)
+        return default
+
+# Password hashing for security (salted scrypt, computed on the shared KDF pool)
+def hash_password(password):
+    return auth.hash_password(password)
 
 # User management functions
-def add_user(conn, username, password, email, age, gender, height, weight, fitness_goal, activity_level, daily_calorie_goal):
-    try:
-        cursor = conn.cursor()
-        hashed_pw = hash_password(password)
-        cursor.execute('''
-            INSERT INTO Users (username, password, email, age, gender, height, weight, 
-                             fitness_goal, activity_level, daily_calorie_goal)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (username, hashed_pw, email, age, gender, height, weight, 
-              fitness_goal, activity_level, daily_calorie_goal))
-        conn.commit()
-        return cursor.lastrowid
-    except sqlite3.Error as e:
-        st.error(f"Error adding user: {e}")
-        return None
+def add_user(db, username, password, email, age, gender, height, weight, fitness_goal, activity_level, daily_calorie_goal):
+    return ui_call("Error adding user", None, data.add_user, db, username, password, email, age, gender,
+                   height, weight, fitness_goal, activity_level, daily_calorie_goal)
 
-def get_user_info(conn, user_id):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM Users WHERE user_id = ?', (user_id,))
-        return cursor.fetchone()
-    except sqlite3.Error as e:
-        st.error(f"Error fetching user info: {e}")
-        return None
+def get_user_info(db, user_id):
+    return ui_call("Error fetching user info", None, data.get_user_info, db, user_id)
+
+# A new password is hashed first; None keeps the current one
+def update_profile(db, user_id, username, email, age, gender, height, weight, fitness_goal, activity_level, daily_calorie_goal, password=None):
+    def update():
+        password_hash = hash_password(password) if password else None
+        return data.update_profile(db, user_id, username, email, age, gender, height, weight,
+                                   fitness_goal, activity_level, daily_calorie_goal, password_hash)
+    return ui_call("Error updating profile", False, update)
+
+# Profile is loaded once per session and only reloaded after it is updated
+def get_user_profile(db, user_id, refresh=False):
+    profile = st.session_state.get("user_profile")
+    if refresh or profile is None or profile.user_id != user_id:
+        profile = get_user_info(db, user_id)
+        st.session_state.user_profile = profile
+    return profile
 
 # Meal management functions
-def add_meal(conn, meal_data):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO Meals (
-                meal_name, description, calories, protein, carbs, fats, 
-                fiber, sugar, sodium, dietary_preference, meal_type, created_by
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', meal_data)
-        conn.commit()
-        return cursor.lastrowid
-    except sqlite3.Error as e:
-        st.error(f"Error adding meal: {e}")
-        return None
+def add_meal(db, meal_data):
+    return ui_call("Error adding meal", None, data.add_meal, db, meal_data)
 
-def get_meal_by_id(conn, meal_id):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM Meals WHERE meal_id = ?', (meal_id,))
-        return cursor.fetchone()
-    except sqlite3.Error as e:
-        st.error(f"Error fetching meal: {e}")
-        return None
+def search_meals(db, query="", dietary_preference=None, meal_type=None, limit=20, offset=0):
+    return ui_call("Error searching meals", (), data.search_meals, db, query, dietary_preference,
+                   meal_type, limit, offset)
+
+def get_meal_by_id(db, meal_id):
+    return ui_call("Error fetching meal", None, data.get_meal_by_id, db, meal_id)
 
 # Meal planning functions
-def plan_meal(conn, user_id, meal_id, date, portion_size=1.0, meal_type=None):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO UserMealPlans (user_id, meal_id, date, portion_size, meal_type)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, meal_id, date, portion_size, meal_type))
-        conn.commit()
-        return True
-    except sqlite3.Error as e:
-        st.error(f"Error planning meal: {e}")
-        return False
+def plan_meal(db, user_id, meal_id, date, portion_size=1.0, meal_type=None):
+    return ui_call("Error planning meal", False, data.plan_meal, db, user_id, meal_id, date,
+                   portion_size, meal_type)
 
-def get_user_meal_plan(conn, user_id, date):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT m.meal_id, m.meal_name, m.calories, m.protein, m.carbs, m.fats, 
-                   up.portion_size, up.meal_type, m.dietary_preference
-            FROM UserMealPlans up
-            JOIN Meals m ON up.meal_id = m.meal_id
-            WHERE up.user_id = ? AND up.date = ?
-            ORDER BY up.meal_type
-        ''', (user_id, date))
-        return cursor.fetchall()
-    except sqlite3.Error as e:
-        st.error(f"Error fetching meal plan: {e}")
-        return []
+def plan_meals(db, user_id, meals, replace=False):
+    return ui_call("Error saving meal plan", False, data.plan_meals, db, user_id, meals, replace)
+
+def get_user_meal_plan(db, user_id, date):
+    return ui_call("Error fetching meal plan", [], data.get_user_meal_plan, db, user_id, date)
+
+def get_user_meal_plans(db, user_id, start_date, end_date):
+    return ui_call("Error fetching meal plans", {}, data.get_user_meal_plans, db, user_id, start_date, end_date)
+
+def get_nutrition_totals(db, user_id, start_date, end_date=None, by_meal_type=False):
+    return ui_call("Error fetching nutrition totals", [], data.get_nutrition_totals, db, user_id,
+                   start_date, end_date, by_meal_type)
+
+def get_daily_nutrition(db, user_id, date):
+    rows = get_nutrition_totals(db, user_id, date)
+    return rows[0][3:] if rows else None
 
 # Progress tracking functions
-def track_progress(conn, user_id, date, weight=None, total_calories=None, 
+def track_progress(db, user_id, date, weight=None, total_calories=None, 
                   total_protein=None, total_carbs=None, total_fats=None, notes=None):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO Progress (
-                user_id, date, weight, total_calories, 
-                total_protein, total_carbs, total_fats, notes
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, date, weight, total_calories, 
-              total_protein, total_carbs, total_fats, notes))
-        conn.commit()
-        return True
-    except sqlite3.Error as e:
-        st.error(f"Error tracking progress: {e}")
-        return False
+    return ui_call("Error tracking progress", False, data.track_progress, db, user_id, date, weight,
+                   total_calories, total_protein, total_carbs, total_fats, notes)
 
-def get_user_progress(conn, user_id, start_date=None, end_date=None):
-    try:
-        cursor = conn.cursor()
-        if start_date and end_date:
-            cursor.execute('''
-                SELECT date, weight, total_calories, total_protein, 
-                       total_carbs, total_fats, notes
-                FROM Progress
-                WHERE user_id = ? AND date BETWEEN ? AND ?
-                ORDER BY date
-            ''', (user_id, start_date, end_date))
-        else:
-            cursor.execute('''
-                SELECT date, weight, total_calories, total_protein, 
-                       total_carbs, total_fats, notes
-                FROM Progress
-                WHERE user_id = ?
-                ORDER BY date
-            ''', (user_id,))
-        return cursor.fetchall()
-    except sqlite3.Error as e:
-        st.error(f"Error fetching progress: {e}")
-        return []
+def get_user_progress(db, user_id, start_date=None, end_date=None):
+    return ui_call("Error fetching progress", [], data.get_user_progress, db, user_id, start_date, end_date)
+
+def get_user_summaries(db, user_id, period="week", limit=12):
+    return ui_call("Error fetching summaries", [], data.get_user_summaries, db, user_id, period, limit)
 
 # Exercise functions
-def add_exercise(conn, exercise_name, calories_burned_per_hour, description, intensity):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO Exercises (exercise_name, calories_burned_per_hour, description, intensity)
-            VALUES (?, ?, ?, ?)
-        ''', (exercise_name, calories_burned_per_hour, description, intensity))
-        conn.commit()
-        return cursor.lastrowid
-    except sqlite3.Error as e:
-        st.error(f"Error adding exercise: {e}")
-        return None
+def add_exercise(db, exercise_name, calories_burned_per_hour, description, intensity):
+    return ui_call("Error adding exercise", None, data.add_exercise, db, exercise_name,
+                   calories_burned_per_hour, description, intensity)
 
-def log_exercise(conn, user_id, exercise_id, date, duration_minutes, calories_burned):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO UserExercises (user_id, exercise_id, date, duration_minutes, calories_burned)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, exercise_id, date, duration_minutes, calories_burned))
-        conn.commit()
-        return True
-    except sqlite3.Error as e:
-        st.error(f"Error logging exercise: {e}")
-        return False
+def get_exercises(db):
+    return ui_call("Error fetching exercises", (), data.get_exercises, db)
 
-# Authentication functions
-def authenticate_user(conn, username, password):
-    try:
-        cursor = conn.cursor()
-        hashed_pw = hash_password(password)
-        cursor.execute('''
-            SELECT user_id, username FROM Users WHERE username = ? AND password = ?
-        ''', (username, hashed_pw))
-        return cursor.fetchone()
-    except sqlite3.Error as e:
-        st.error(f"Authentication error: {e}")
-        return None
+def log_exercise(db, user_id, exercise_id, date, duration_minutes, calories_burned):
+    return ui_call("Error logging exercise", False, data.log_exercise, db, user_id, exercise_id, date,
+                   duration_minutes, calories_burned)
 
-# Helper functions
-def calculate_bmi(height, weight):
-    if height > 0 and weight > 0:
-        return weight / ((height / 100) ** 2)
-    return None
+def get_exercise_history(db, user_id, before=None, limit=20):
+    return ui_call("Error fetching exercise history", [], data.get_exercise_history, db, user_id, before, limit)
 
-def calculate_daily_calorie_goal(age, gender, height, weight, activity_level, fitness_goal):
-    # Basic Harris-Benedict equation for BMR
-    if gender.lower() == 'male':
-        bmr = 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
-    else:
-        bmr = 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
-    
-    # Activity level multipliers
-    activity_multipliers = {
-        'sedentary': 1.2,
-        'lightly active': 1.375,
-        'moderately active': 1.55,
-        'very active': 1.725,
-        'extra active': 1.9
-    }
-    
-    tdee = bmr * activity_multipliers.get(activity_level.lower(), 1.2)
-    
-    # Adjust based on fitness goal
-    if fitness_goal.lower() == 'weight loss':
-        return tdee * 0.8  # 20% deficit
-    elif fitness_goal.lower() == 'muscle gain':
-        return tdee * 1.1  # 10% surplus
-    else:  # maintenance
-        return tdee
+def get_exercise_totals(db, user_id):
+    return ui_call("Error fetching exercise totals", (0, 0, 0.0), data.get_exercise_totals, db, user_id)
+
+# Authentication functions
+def authenticate_user(db, username, password):
+    return ui_call("Authentication error", None, data.authenticate_user, db, username, password)
 
 # Streamlit UI Components
-def login_form(conn):
+def login_form(db):
     with st.form("Login"):
         username = st.text_input("Username")
         password = st.text_input("Password", type="password")
         if st.form_submit_button("Login"):
-            user = authenticate_user(conn, username, password)
+            user = authenticate_user(db, username, password)
             if user:
                 st.session_state.user_id = user[0]
                 st.session_state.username = user[1]
@@ -333,7 +167,7 @@ def login_form(conn):
                 st.error("Invalid username or password")
     return False
 
-def registration_form(conn):
+def registration_form(db):
     with st.form("Registration"):
         st.subheader("Create Your Account")
         username = st.text_input("Username (must be unique)")
@@ -359,7 +193,7 @@ def registration_form(conn):
         ])
         
         # Calculate suggested calorie goal
-        activity_level_key = activity_level.split(" ")[0].lower()
+        activity_level_key = activity_level.split(" (")[0].lower()
         suggested_calories = int(calculate_daily_calorie_goal(
             age, gender, height, weight, activity_level_key, fitness_goal
         ))
@@ -376,12 +210,13 @@ def registration_form(conn):
                 st.error("Passwords do not match!")
                 return False
             
-            if len(password) < 8:
-                st.error("Password must be at least 8 characters long")
+            problem = auth.password_problem(password)
+            if problem:
+                st.error(problem)
                 return False
                 
             user_id = add_user(
-                conn, username, password, email, age, gender, height, weight,
+                db, username, password, email, age, gender, height, weight,
                 fitness_goal, activity_level_key, daily_calorie_goal
             )
             
@@ -394,23 +229,23 @@ def registration_form(conn):
                 st.error("Username or email already exists!")
     return False
 
-def dashboard(conn, user_id):
-    user_info = get_user_info(conn, user_id)
-    if not user_info:
+def dashboard(db, user_id):
+    profile = get_user_profile(db, user_id)
+    if not profile:
         st.error("Could not load user information")
         return
     
-    st.title(f"Welcome, {user_info[1]}!")
+    profiler.mark("load profile", "compute")
+    st.title(f"Welcome, {profile.username}!")
     
     # User stats overview
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Current Weight", f"{user_info[7]} kg")
+        st.metric("Current Weight", f"{profile.weight} kg")
     with col2:
-        bmi = calculate_bmi(user_info[6], user_info[7])
-        st.metric("BMI", f"{bmi:.1f}")
+        st.metric("BMI", f"{profile.bmi:.1f}")
     with col3:
-        st.metric("Daily Calorie Goal", user_info[10])
+        st.metric("Daily Calorie Goal", profile.daily_calorie_goal)
     
     # Navigation
     menu = [
@@ -418,54 +253,66 @@ def dashboard(conn, user_id):
         "View Progress", "Exercise Log", "Profile Settings"
     ]
     choice = st.sidebar.selectbox("Menu", menu)
-    
-    if choice == "Meal Planner":
-        meal_planner(conn, user_id)
-    elif choice == "Add Meal":
-        add_meal_form(conn, user_id)
-    elif choice == "Track Progress":
-        track_progress_form(conn, user_id)
-    elif choice == "View Progress":
-        view_progress(conn, user_id)
-    elif choice == "Exercise Log":
-        exercise_log(conn, user_id)
-    elif choice == "Profile Settings":
-        profile_settings(conn, user_id)
-
-def meal_planner(conn, user_id):
+    if SHOW_DB_STATS:
+        with st.sidebar.expander("Database Pool"):
+            st.json(db.stats())
+            st.json(db.catalog.stats())
+            st.json(db.results.stats())
+            if "charts" in sys.modules:  # only once a progress page has loaded it
+                st.json(sys.modules["charts"].png_cache.stats())
+        with st.sidebar.expander("Query Stats"):
+            st.dataframe(db.queries.summary()[:25])
+            for entry in reversed(db.queries.slow):
+                st.caption(f"{entry['at']} · {entry['page']} · {entry['ms']} ms · {entry['rows']} rows")
+                st.code(f"{entry['query']}\n\n{entry['plan']}", language="sql")
+    profiler.mark("overview and menu", "render")
+    
+    # Queries issued below are attributed to the selected page
+    with querystats.page(choice.lower().replace(" ", "_")):
+        if choice == "Meal Planner":
+            meal_planner(db, user_id)
+        elif choice == "Add Meal":
+            add_meal_form(db, user_id)
+        elif choice == "Track Progress":
+            track_progress_form(db, user_id)
+        elif choice == "View Progress":
+            view_progress(db, user_id)
+        elif choice == "Exercise Log":
+            exercise_log(db, user_id)
+        elif choice == "Profile Settings":
+            profile_settings(db, user_id)
+
+def meal_planner(db, user_id):
     st.header("Meal Planner")
     
     date = st.date_input("Select Date", datetime.today())
     dietary_preference = st.selectbox("Dietary Preference", 
                                     ["None", "Vegetarian", "Vegan", "Gluten-Free", "Keto", "Paleo"])
     
-    # Get meals filtered by preference
-    cursor = conn.cursor()
-    if dietary_preference == "None":
-        cursor.execute('SELECT meal_id, meal_name, calories, meal_type FROM Meals ORDER BY meal_type')
-    else:
-        cursor.execute('''
-            SELECT meal_id, meal_name, calories, meal_type 
-            FROM Meals 
-            WHERE dietary_preference = ? 
-            ORDER BY meal_type
-        ''', (dietary_preference,))
-    meals = cursor.fetchall()
-    
     # Group by meal type
     meal_types = ["Breakfast", "Lunch", "Dinner", "Snack"]
     planned_meals = {mt: [] for mt in meal_types}
     
     # Get already planned meals for the day
-    planned = get_user_meal_plan(conn, user_id, date)
+    planned = get_user_meal_plan(db, user_id, date)
     for meal in planned:
         meal_type = meal[7] if meal[7] else "Uncategorized"
         if meal_type in planned_meals:
             planned_meals[meal_type].append(meal)
+    slot_totals = {
+        row[1]: row[3:] for row in get_nutrition_totals(db, user_id, date, by_meal_type=True)
+    }
+    profiler.mark("planned meals", "compute")
     
     # Display planner
     for meal_type in meal_types:
         st.subheader(meal_type)
+        if meal_type in slot_totals:
+            calories, protein, carbs, fats, fiber, sugar, sodium = slot_totals[meal_type]
+            st.caption(
+                f"{calories:.0f} kcal · {protein:.1f}g protein · {carbs:.1f}g carbs · {fats:.1f}g fats · "
+                f"{fiber:.1f}g fiber · {sugar:.1f}g sugar · {sodium:.0f}mg sodium"
+            )
         
         # Show planned meals
         if planned_meals[meal_type]:
@@ -474,17 +321,27 @@ def meal_planner(conn, user_id):
                 with cols[0]:
                     st.write(f"**{meal[1]}** (Portion: {meal[6]}x)")
                 with cols[1]:
-                    st.write(f"{int(meal[2] * meal[6])} kcal")
+                    st.write(f"{meal[2]:.0f} kcal")
                 with cols[2]:
-                    st.write(f"{meal[3]*meal[6]:.1f}g protein")
+                    st.write(f"{meal[3]:.1f}g protein")
                 with cols[3]:
                     if st.button("Remove", key=f"remove_{meal[0]}_{meal_type}"):
-                        remove_planned_meal(conn, user_id, meal[0], date, meal_type)
+                        remove_planned_meal(db, user_id, meal[0], date, meal_type)
                         st.rerun()
         
         # Add new meal
         with st.expander(f"Add {meal_type}"):
-            filtered_meals = [m for m in meals if m[3] == meal_type]
+            meal_suggestions(db, user_id, date, meal_type, dietary_preference, slot_totals, planned)
+            query = st.text_input(
+                f"Search {meal_type} Meals",
+                placeholder="Type part of a meal name or description",
+                key=f"search_{meal_type}"
+            )
+            page = st.number_input("Page", min_value=1, value=1, key=f"page_{meal_type}")
+            filtered_meals = search_meals(
+                db, query, dietary_preference, meal_type,
+                limit=MEAL_SEARCH_PAGE_SIZE, offset=(page - 1) * MEAL_SEARCH_PAGE_SIZE
+            )
             if filtered_meals:
                 selected_meal = st.selectbox(
                     f"Select {meal_type} Meal", 
@@ -502,33 +359,37 @@ def meal_planner(conn, user_id):
                 )
                 if st.button(f"Add {meal_type}", key=f"add_{meal_type}"):
                     plan_meal(
-                        conn, user_id, selected_meal[0], date, 
+                        db, user_id, selected_meal[0], date, 
                         portion_size, meal_type
                     )
                     st.success(f"{selected_meal[1]} added to {meal_type}!")
                     st.rerun()
+            elif query or page > 1:
+                st.info("No matching meals")
             else:
                 st.warning(f"No {meal_type.lower()} meals available")
+        profiler.mark(f"{meal_type} slot", "render")
     
     # Daily summary
     st.subheader("Daily Summary")
-    planned_meals = get_user_meal_plan(conn, user_id, date)
-    if planned_meals:
-        total_calories = sum(m[2] * m[6] for m in planned_meals)
-        total_protein = sum(m[3] * m[6] for m in planned_meals)
-        total_carbs = sum(m[4] * m[6] for m in planned_meals)
-        total_fats = sum(m[5] * m[6] for m in planned_meals)
+    totals = get_daily_nutrition(db, user_id, date)
+    if totals:
+        total_calories, total_protein, total_carbs, total_fats, fiber, sugar, sodium = totals
         
         cols = st.columns(4)
         cols[0].metric("Total Calories", f"{total_calories:.0f}")
         cols[1].metric("Protein", f"{total_protein:.1f}g")
         cols[2].metric("Carbs", f"{total_carbs:.1f}g")
         cols[3].metric("Fats", f"{total_fats:.1f}g")
+        cols = st.columns(4)
+        cols[0].metric("Fiber", f"{fiber:.1f}g")
+        cols[1].metric("Sugar", f"{sugar:.1f}g")
+        cols[2].metric("Sodium", f"{sodium:.0f}mg")
         
         # Save to progress
         if st.button("Save Daily Plan"):
             track_progress(
-                conn, user_id, date, 
+                db, user_id, date, 
                 total_calories=total_calories,
                 total_protein=total_protein,
                 total_carbs=total_carbs,
@@ -537,21 +398,121 @@ def meal_planner(conn, user_id):
             st.success("Daily plan saved to progress!")
     else:
         st.info("No meals planned for this day")
+    profiler.mark("daily summary", "render")
+    
+    auto_planner(db, user_id, date, dietary_preference)
+    profiler.mark("plan generator", "render")
+    
+    weekly_planner(db, user_id, date)
+    profiler.mark("plan overview", "render")
 
-def remove_planned_meal(conn, user_id, meal_id, date, meal_type):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            DELETE FROM UserMealPlans 
-            WHERE user_id = ? AND meal_id = ? AND date = ? AND meal_type = ?
-        ''', (user_id, meal_id, date, meal_type))
-        conn.commit()
-        return True
-    except sqlite3.Error as e:
-        st.error(f"Error removing meal: {e}")
-        return False
+# Best fits for what is left of the day's calorie and macro targets, ranked
+# over the planner's cached nutrient index of the slot
+def meal_suggestions(db, user_id, date, meal_type, dietary_preference, slot_totals, planned):
+    profile = get_user_profile(db, user_id)
+    if not profile or not profile.daily_calorie_goal:
+        return
+    import planner
 
-def add_meal_form(conn, user_id):
+    planned_totals = [sum(totals[i] for totals in slot_totals.values()) for i in range(4)]
+    suggestions = planner.recommend(
+        db, profile.daily_calorie_goal, meal_type, planned_totals, slot_totals.keys(),
+        profile.fitness_goal, dietary_preference, k=MEAL_SUGGESTIONS,
+        exclude=[meal[0] for meal in planned]
+    )
+    if not suggestions:
+        return
+    cols = st.columns([4, 1])
+    suggestion = cols[0].selectbox(
+        "Suggested for what's left today",
+        suggestions,
+        format_func=lambda x: f"{x[1]} ×{x[2]} ({x[3]:.0f} kcal, {x[4]:.0f}g protein)",
+        key=f"suggest_{meal_type}"
+    )
+    cols[1].write("")
+    if cols[1].button("Add", key=f"add_suggestion_{meal_type}"):
+        plan_meal(db, user_id, suggestion[0], date, suggestion[2], meal_type)
+        st.success(f"{suggestion[1]} added to {meal_type}!")
+        st.rerun()
+
+# Generate a day or week of meals against the user's calorie goal and the
+# macro split of their fitness goal, preview it, then save it in one write
+def auto_planner(db, user_id, start_date, dietary_preference):
+    with st.expander("Generate a Plan"):
+        profile = get_user_profile(db, user_id)
+        col1, col2 = st.columns(2)
+        days = col1.selectbox("Days to plan", [1, 7], key="generate_days")
+        replace = col2.checkbox("Replace meals already planned", key="generate_replace")
+        if st.button("Generate", key="generate_plan") and profile:
+            import planner
+
+            st.session_state.generated_plan = planner.generate_plan(
+                db, profile.daily_calorie_goal, profile.fitness_goal,
+                dietary_preference, start_date, days
+            )
+        
+        plan = st.session_state.get("generated_plan")
+        if not plan:
+            return
+        calories, protein, carbs, fats = plan.targets
+        st.caption(
+            f"Daily target: {calories:.0f} kcal, {protein:.0f}g protein, "
+            f"{carbs:.0f}g carbs, {fats:.0f}g fats"
+        )
+        st.dataframe([
+            {
+                "Date": day, "Meal Type": meal[0], "Meal": meal[2], "Portion": meal[3],
+                "Calories": meal[4], "Protein": meal[5], "Carbs": meal[6], "Fats": meal[7],
+            }
+            for day, meals, _ in plan.days
+            for meal in meals
+        ], use_container_width=True, hide_index=True)
+        st.dataframe([
+            {"Date": day, "Calories": totals[0], "Protein": totals[1], "Carbs": totals[2], "Fats": totals[3]}
+            for day, _, totals in plan.days
+        ], use_container_width=True, hide_index=True)
+        
+        col1, col2 = st.columns(2)
+        if col1.button("Save Plan", key="save_generated_plan"):
+            if plan_meals(db, user_id, plan.rows(), replace):
+                del st.session_state.generated_plan
+                st.success("Plan saved!")
+                st.rerun()
+        if col2.button("Discard", key="discard_generated_plan"):
+            del st.session_state.generated_plan
+            st.rerun()
+
+def weekly_planner(db, user_id, start_date):
+    st.subheader("Plan Overview")
+    days = st.selectbox("Days Ahead", [7, 14, 28], key="overview_days")
+    end_date = start_date + timedelta(days=days - 1)
+    plans = get_user_meal_plans(db, user_id, start_date, end_date)
+    daily = {row[0]: row[3:] for row in get_nutrition_totals(db, user_id, start_date, end_date)}
+    
+    meal_types = ["Breakfast", "Lunch", "Dinner", "Snack"]
+    grid = []
+    for offset in range(days):
+        day = (start_date + timedelta(days=offset)).isoformat()
+        row = {"Date": day}
+        row.update({mt: "" for mt in meal_types})
+        for meal in plans.get(day, []):
+            if meal[7] in row:
+                label = f"{meal[1]} ({meal[6]}x)"
+                row[meal[7]] = f"{row[meal[7]]}, {label}" if row[meal[7]] else label
+        calories, protein, carbs, fats, fiber, sugar, sodium = daily.get(day, (0,) * 7)
+        row.update({
+            "Calories": int(calories), "Protein (g)": round(protein, 1), "Carbs (g)": round(carbs, 1),
+            "Fats (g)": round(fats, 1), "Fiber (g)": round(fiber, 1), "Sugar (g)": round(sugar, 1),
+            "Sodium (mg)": int(sodium),
+        })
+        grid.append(row)
+    
+    st.dataframe(grid, use_container_width=True, hide_index=True)
+
+def remove_planned_meal(db, user_id, meal_id, date, meal_type):
+    return ui_call("Error removing meal", False, data.remove_planned_meal, db, user_id, meal_id, date, meal_type)
+
+def add_meal_form(db, user_id):
     st.header("Add New Meal")
     
     with st.form("Add Meal"):
@@ -563,6 +524,7 @@ def add_meal_form(conn, user_id):
             calories = st.number_input("Calories", min_value=0, value=300)
             protein = st.number_input("Protein (g)", min_value=0.0, value=0.0, step=0.1)
             carbs = st.number_input("Carbs (g)", min_value=0.0, value=0.0, step=0.1)
+            sodium = st.number_input("Sodium (mg)", min_value=0.0, value=0.0, step=1.0)
         with col2:
             fats = st.number_input("Fats (g)", min_value=0.0, value=0.0, step=0.1)
             fiber = st.number_input("Fiber (g)", min_value=0.0, value=0.0, step=0.1)
@@ -575,29 +537,26 @@ def add_meal_form(conn, user_id):
         if st.form_submit_button("Add Meal"):
             meal_data = (
                 meal_name, description, calories, protein, carbs, fats,
-                fiber, sugar, 0, dietary_preference, meal_type, user_id
+                fiber, sugar, sodium, dietary_preference, meal_type, user_id
             )
-            if add_meal(conn, meal_data):
+            if add_meal(db, meal_data):
                 st.success("Meal added successfully!")
             else:
                 st.error("Failed to add meal")
 
-def track_progress_form(conn, user_id):
+def track_progress_form(db, user_id):
     st.header("Track Daily Progress")
     date = st.date_input("Date", datetime.today())
     
-    user_info = get_user_info(conn, user_id)
-    current_weight = float(user_info[7])  # Ensure float type
+    profile = get_user_profile(db, user_id)
+    current_weight = float(profile.weight)  # Ensure float type
     
     with st.form("Progress Tracking"):
         weight = st.number_input("Weight (kg)", min_value=30.0, max_value=300.0, value=current_weight, step=0.1)
         
-        meal_plan = get_user_meal_plan(conn, user_id, date)
-        if meal_plan:
-            total_calories = float(sum(m[2] * m[6] for m in meal_plan))
-            total_protein = float(sum(m[3] * m[6] for m in meal_plan))
-            total_carbs = float(sum(m[4] * m[6] for m in meal_plan))
-            total_fats = float(sum(m[5] * m[6] for m in meal_plan))
+        totals = get_daily_nutrition(db, user_id, date)
+        if totals:
+            total_calories, total_protein, total_carbs, total_fats = map(float, totals[:4])
         else:
             total_calories, total_protein, total_carbs, total_fats = 0.0, 0.0, 0.0, 0.0
         
@@ -614,7 +573,7 @@ def track_progress_form(conn, user_id):
         submitted = st.form_submit_button("Save Progress")
         if submitted:
             if track_progress(
-                conn, user_id, date, weight, calories, protein, carbs, fats, notes
+                db, user_id, date, weight, calories, protein, carbs, fats, notes
             ):
                 st.success("Progress saved successfully!")
                 st.rerun()
@@ -622,25 +581,52 @@ def track_progress_form(conn, user_id):
                 st.error("Failed to save progress")
 
 
-def view_progress(conn, user_id):
+# pandas, analytics and charts (matplotlib/seaborn) are imported by the
+# pages that use them, so the login form and planner start without them
+def view_progress(db, user_id):
+    import pandas as pd
+    import analytics
+    import charts
+
     st.header("Your Progress")
     
+    with st.expander("Weekly and Monthly Summaries"):
+        period = st.radio("Period", ["week", "month"], format_func=str.title, horizontal=True,
+                          key="summary_period")
+        summaries = get_user_summaries(db, user_id, period)
+        if summaries:
+            st.dataframe(pd.DataFrame(summaries, columns=[
+                "Starting", "Days Logged", "Avg Weight", "Avg Calories", "Avg Planned Calories",
+                "Workouts", "Exercise Minutes", "Calories Burned",
+            ]), use_container_width=True, hide_index=True)
+        else:
+            st.caption("Summaries are updated nightly by the background jobs")
+    profiler.mark("summaries", "render")
+    
     col1, col2 = st.columns(2)
     with col1:
-        start_date = st.date_input("Start Date", datetime.today() - pd.Timedelta(days=30))
+        start_date = st.date_input("Start Date", datetime.today() - timedelta(days=30))
     with col2:
         end_date = st.date_input("End Date", datetime.today())
     
-    progress_data = get_user_progress(conn, user_id, start_date, end_date)
+    # Served from the result cache until the user writes, so widget changes
+    # elsewhere on the page don't recompute it
+    def load():
+        with db.shard(user_id).read() as conn:
+            return analytics.daily_report(conn, [user_id], start_date, end_date, db).loc[user_id]
+    try:
+        report = db.results.get("daily_report", user_id, (str(start_date), str(end_date)), load)
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        st.error(f"Error fetching progress: {e}")
+        return
+    profiler.mark("daily report", "compute")
     
-    if not progress_data:
+    logged = report[report["logged"]]
+    if logged.empty:
         st.warning("No progress data available for the selected period")
         return
     
-    df = pd.DataFrame(progress_data, columns=[
-        "date", "weight", "calories", "protein", "carbs", "fats", "notes"
-    ])
-    df['date'] = pd.to_datetime(df['date'])
+    df = logged.reset_index()[["date", "weight", "calories", "protein", "carbs", "fats", "notes"]]
     
     st.subheader("Progress Summary")
     latest = df.iloc[-1]
@@ -658,51 +644,38 @@ def view_progress(conn, user_id):
         compliance = (df['calories'] > 0).mean() * 100
         st.metric("Tracking Compliance", f"{compliance:.0f}%")
     
-    st.subheader("Progress Charts")
+    def fmt(value, spec, suffix=""):
+        return f"{value:{spec}}{suffix}" if pd.notna(value) else "-"
     
-    tab1, tab2, tab3 = st.tabs(["Weight Trend", "Nutrition", "Calories"])
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("7-Day Avg Intake", fmt(report["intake_7d"].iloc[-1], ".0f"))
+    col2.metric("Weight Trend", fmt(report["weight_trend"].iloc[-1], ".1f", " kg"))
+    col3.metric("Avg Net Energy", fmt(report["net_energy"].mean(), ".0f", " kcal"))
+    col4.metric("Goal Adherence", fmt(report["on_target"].mean() * 100, ".0f", "%"))
+    profiler.mark("summary metrics", "render")
     
-    with tab1:
-        if len(df) > 1:
-            fig, ax = plt.subplots()
-            sns.lineplot(data=df, x='date', y='weight', marker='o', ax=ax)
-            ax.set_title("Weight Trend")
-            ax.set_xlabel("Date")
-            ax.set_ylabel("Weight (kg)")
-            st.pyplot(fig)
-        else:
-            st.warning("Need at least 2 data points to show trend")
+    st.subheader("Progress Charts")
+    native = st.checkbox("Interactive charts", value=charts.CHART_BACKEND == "native")
+    chart_df = charts.downsample(df[["date", "weight", "calories", "protein", "carbs", "fats"]])
+    profiler.mark("chart data", "compute")
     
-    with tab2:
-        if len(df) > 1:
-            fig, ax = plt.subplots()
-            df_melted = df.melt(id_vars=['date'], 
-                               value_vars=['protein', 'carbs', 'fats'],
-                               var_name='macro', value_name='grams')
-            sns.lineplot(data=df_melted, x='date', y='grams', hue='macro', ax=ax)
-            ax.set_title("Macronutrient Intake")
-            ax.set_xlabel("Date")
-            ax.set_ylabel("Grams")
-            st.pyplot(fig)
-        else:
-            st.warning("Need at least 2 data points to show trend")
-    
-    with tab3:
-        if len(df) > 1:
-            fig, ax = plt.subplots()
-            sns.barplot(data=df, x='date', y='calories', ax=ax)
-            ax.set_title("Daily Calorie Intake")
-            ax.set_xlabel("Date")
-            ax.set_ylabel("Calories")
-            plt.xticks(rotation=45)
-            st.pyplot(fig)
-        else:
-            st.warning("Need at least 2 data points to show trend")
+    tab1, tab2, tab3 = st.tabs(["Weight Trend", "Nutrition", "Calories"])
+    for tab, chart in ((tab1, "weight"), (tab2, "macros"), (tab3, "calories")):
+        with tab:
+            if len(df) > 1:
+                if native:
+                    charts.render_native(st, chart, chart_df)
+                else:
+                    st.image(charts.chart_png(user_id, start_date, end_date, chart, chart_df))
+            else:
+                st.warning("Need at least 2 data points to show trend")
+        profiler.mark(f"{chart} chart", "render")
     
     st.subheader("Detailed Data")
     st.dataframe(df.sort_values('date', ascending=False))
+    profiler.mark("detailed data", "render")
 
-def exercise_log(conn, user_id):
+def exercise_log(db, user_id):
     st.header("Exercise Log")
     
     tab1, tab2 = st.tabs(["Log Exercise", "Exercise History"])
@@ -710,9 +683,7 @@ def exercise_log(conn, user_id):
     with tab1:
         date = st.date_input("Exercise Date", datetime.today())
         
-        cursor = conn.cursor()
-        cursor.execute('SELECT exercise_id, exercise_name FROM Exercises ORDER BY exercise_name')
-        exercises = cursor.fetchall()
+        exercises = get_exercises(db)
         
         if exercises:
             selected_exercise = st.selectbox(
@@ -723,56 +694,69 @@ def exercise_log(conn, user_id):
             
             duration = st.number_input("Duration (minutes)", min_value=1, max_value=300, value=30)
             
-            cursor.execute('''
-                SELECT calories_burned_per_hour 
-                FROM Exercises 
-                WHERE exercise_id = ?
-            ''', (selected_exercise[0],))
-            calories_per_hour = cursor.fetchone()[0]
+            calories_per_hour = selected_exercise[2] or 0
             calories_burned = int(calories_per_hour * (duration / 60))
             
             st.write(f"Estimated calories burned: {calories_burned}")
             
             if st.button("Log Exercise"):
                 if log_exercise(
-                    conn, user_id, selected_exercise[0], date, duration, calories_burned
+                    db, user_id, selected_exercise[0], date, duration, calories_burned
                 ):
+                    st.session_state.exercise_pages = []
                     st.success("Exercise logged successfully!")
                 else:
                     st.error("Failed to log exercise")
         else:
             st.warning("No exercises available in database")
+    profiler.mark("log form", "render")
     
     with tab2:
-        cursor.execute('''
-            SELECT e.exercise_name, ue.date, ue.duration_minutes, ue.calories_burned
-            FROM UserExercises ue
-            JOIN Exercises e ON ue.exercise_id = e.exercise_id
-            WHERE ue.user_id = ?
-            ORDER BY ue.date DESC
-        ''', (user_id,))
-        history = cursor.fetchall()
+        # Cursors of the pages above the current one; empty means the newest page
+        pages = st.session_state.setdefault("exercise_pages", [])
+        history = get_exercise_history(
+            db, user_id, before=pages[-1] if pages else None, limit=EXERCISE_PAGE_SIZE + 1
+        )
+        has_older = len(history) > EXERCISE_PAGE_SIZE
+        history = history[:EXERCISE_PAGE_SIZE]
+        if not history and pages:
+            pages.clear()
+            st.rerun()
+        profiler.mark("history page", "compute")
         
         if history:
-            df = pd.DataFrame(history, columns=["Exercise", "Date", "Duration (min)", "Calories Burned"])
+            import pandas as pd
+
+            df = pd.DataFrame(
+                [row[1:] for row in history],
+                columns=["Exercise", "Date", "Duration (min)", "Calories Burned"]
+            )
             st.dataframe(df)
+            profiler.mark("history table", "render")
+            
+            col1, col2 = st.columns(2)
+            if col1.button("Newer", disabled=not pages):
+                pages.pop()
+                st.rerun()
+            if col2.button("Older", disabled=not has_older):
+                pages.append((history[-1][2], history[-1][0]))
+                st.rerun()
             
             st.subheader("Exercise Summary")
-            total_calories = df["Calories Burned"].sum()
-            total_minutes = df["Duration (min)"].sum()
-            avg_calories = df["Calories Burned"].mean()
+            sessions, total_calories, total_minutes = get_exercise_totals(db, user_id)
             
             col1, col2, col3 = st.columns(3)
-            col1.metric("Total Exercises", len(df))
+            col1.metric("Total Exercises", sessions)
             col2.metric("Total Calories Burned", total_calories)
-            col3.metric("Total Exercise Time", f"{total_minutes} minutes")
+            col3.metric("Total Exercise Time", f"{total_minutes:g} minutes")
         else:
             st.info("No exercise history available")
+        profiler.mark("exercise summary", "render")
 
-def profile_settings(conn, user_id):
+def profile_settings(db, user_id):
     st.header("Profile Settings")
-    user_info = get_user_info(conn, user_id)
-    if not user_info:
+    profile = get_user_profile(db, user_id)
+    if not profile:
         st.error("Could not load user information")
         return
     
@@ -780,30 +764,32 @@ def profile_settings(conn, user_id):
         st.subheader("Basic Information")
         col1, col2 = st.columns(2)
         with col1:
-            new_username = st.text_input("Username", value=user_info[1])
-            new_age = st.number_input("Age", min_value=1, max_value=120, value=int(user_info[4]))
-            new_height = st.number_input("Height (cm)", min_value=100.0, max_value=250.0, value=float(user_info[6]), step=0.1)
+            new_username = st.text_input("Username", value=profile.username)
+            new_age = st.number_input("Age", min_value=1, max_value=120, value=int(profile.age))
+            new_height = st.number_input("Height (cm)", min_value=100.0, max_value=250.0, value=float(profile.height), step=0.1)
         with col2:
-            new_email = st.text_input("Email", value=user_info[3])
+            new_email = st.text_input("Email", value=profile.email)
             new_gender = st.selectbox("Gender", ["Male", "Female", "Other"], 
-                                    index=["Male", "Female", "Other"].index(user_info[5]))
-            new_weight = st.number_input("Weight (kg)", min_value=30.0, max_value=300.0, value=float(user_info[7]), step=0.1)
+                                    index=["Male", "Female", "Other"].index(profile.gender))
+            new_weight = st.number_input("Weight (kg)", min_value=30.0, max_value=300.0, value=float(profile.weight), step=0.1)
         
         st.subheader("Fitness Goals")
         new_fitness_goal = st.selectbox(
             "Fitness Goal", 
             ["Weight Loss", "Muscle Gain", "Maintenance"],
-            index=["Weight Loss", "Muscle Gain", "Maintenance"].index(user_info[8])
+            index=["Weight Loss", "Muscle Gain", "Maintenance"].index(profile.fitness_goal)
         )
         new_activity_level = st.selectbox(
             "Activity Level", 
             ["sedentary", "lightly active", "moderately active", "very active", "extra active"],
-            index=["sedentary", "lightly active", "moderately active", "very active", "extra active"].index(user_info[9])
+            index=["sedentary", "lightly active", "moderately active", "very active", "extra active"].index(profile.activity_level)
         )
         
-        suggested_calories = int(calculate_daily_calorie_goal(
-            new_age, new_gender, new_height, new_weight, new_activity_level, new_fitness_goal
-        ))
+        goal_inputs = (new_age, new_gender, new_height, new_weight, new_activity_level, new_fitness_goal)
+        if goal_inputs == profile.goal_inputs:
+            suggested_calories = int(profile.suggested_calorie_goal)
+        else:
+            suggested_calories = int(calculate_daily_calorie_goal(*goal_inputs))
         new_calorie_goal = st.number_input(
             "Daily Calorie Goal", 
             min_value=1000, 
@@ -819,7 +805,7 @@ def profile_settings(conn, user_id):
         submitted = st.form_submit_button("Update Profile")
         if submitted:
             if new_password:
-                if not authenticate_user(conn, user_info[1], current_password):
+                if not authenticate_user(db, profile.username, current_password):
                     st.error("Current password is incorrect")
                     return
                 
@@ -827,40 +813,18 @@ def profile_settings(conn, user_id):
                     st.error("New passwords do not match")
                     return
                 
-                if len(new_password) < 8:
-                    st.error("Password must be at least 8 characters")
+                problem = auth.password_problem(new_password)
+                if problem:
+                    st.error(problem)
                     return
             
-            try:
-                cursor = conn.cursor()
-                if new_password:
-                    hashed_pw = hash_password(new_password)
-                    cursor.execute('''
-                        UPDATE Users 
-                        SET username = ?, email = ?, age = ?, gender = ?, 
-                            height = ?, weight = ?, fitness_goal = ?, 
-                            activity_level = ?, daily_calorie_goal = ?, password = ?
-                        WHERE user_id = ?
-                    ''', (new_username, new_email, new_age, new_gender, new_height,
-                         new_weight, new_fitness_goal, new_activity_level, 
-                         new_calorie_goal, hashed_pw, user_id))
-                else:
-                    cursor.execute('''
-                        UPDATE Users 
-                        SET username = ?, email = ?, age = ?, gender = ?, 
-                            height = ?, weight = ?, fitness_goal = ?, 
-                            activity_level = ?, daily_calorie_goal = ?
-                        WHERE user_id = ?
-                    ''', (new_username, new_email, new_age, new_gender, new_height,
-                         new_weight, new_fitness_goal, new_activity_level, 
-                         new_calorie_goal, user_id))
-                
-                conn.commit()
+            if update_profile(db, user_id, new_username, new_email, new_age, new_gender, new_height,
+                              new_weight, new_fitness_goal, new_activity_level, new_calorie_goal,
+                              new_password or None):
                 st.session_state.username = new_username
+                get_user_profile(db, user_id, refresh=True)
                 st.success("Profile updated successfully!")
                 st.rerun()
-            except sqlite3.Error as e:
-                st.error(f"Error updating profile: {e}")
 def main():
     
     st.set_page_config(
@@ -893,13 +857,11 @@ def main():
         """,
         unsafe_allow_html=True
     )
-    conn = create_connection("meal_planner.db")
-    if not conn:
+    db = create_connection("meal_planner.db")
+    if not db:
         st.error("Failed to connect to database")
         return
     
-    init_db(conn)
-    
     if "user_id" not in st.session_state:
         st.session_state.user_id = None
     if "username" not in st.session_state:
@@ -907,18 +869,21 @@ def main():
      
     st.title("Meal Planner & Fitness Tracker")
     
-    if st.session_state.user_id:
-        dashboard(conn, st.session_state.user_id)
-    else:
-        tab1, tab2 = st.tabs(["Login", "Register"])
-        
-        with tab1:
-            if login_form(conn):
-                st.rerun()
-        
-        with tab2:
-            if registration_form(conn):
-                st.rerun()
+    profiling = profiler.ENABLED or st.query_params.get("profile") == "1"
+    with profiler.rerun(profiling):
+        if st.session_state.user_id:
+            with querystats.page("dashboard"):
+                dashboard(db, st.session_state.user_id)
+        else:
+            tab1, tab2 = st.tabs(["Login", "Register"])
+            
+            with tab1, querystats.page("login"):
+                if login_form(db):
+                    st.rerun()
+            
+            with tab2, querystats.page("registration"):
+                if registration_form(db):
+                    st.rerun()
     st.markdown(
         """
         <style>
@@ -0,0 +1,234 @@
+import random
+import threading
+from datetime import date as Date, timedelta
+
+import numpy as np
+
+MEAL_TYPES = ("Breakfast", "Lunch", "Dinner", "Snack")
+# Share of the daily calorie goal aimed at by each slot
+SLOT_SHARES = {"Breakfast": 0.25, "Lunch": 0.35, "Dinner": 0.30, "Snack": 0.10}
+# Fraction of calories from protein, carbs and fats per fitness goal
+MACRO_SPLITS = {
+    "Weight Loss": (0.30, 0.40, 0.30),
+    "Muscle Gain": (0.30, 0.45, 0.25),
+    "Maintenance": (0.25, 0.50, 0.25),
+}
+KETO_SPLIT = (0.20, 0.05, 0.75)
+# Portion sizes the planner may pick (the planner slider's range and step)
+PORTIONS = np.round(np.arange(0.5, 3.0 + 1e-9, 0.1), 1)
+# Weight of the squared relative error of calories, protein, carbs and fats
+WEIGHTS = np.array([2.0, 1.0, 1.0, 1.0])
+# Meals per slot kept after vectorized prescoring for the local search
+CANDIDATES = 40
+MAX_ROUNDS = 10
+# Random spread added to prescores so repeated days don't get identical plans
+VARIETY = 0.25
+
+
+# Nutrient matrix (calories, protein, carbs, fats) of the catalog with the
+# rows of each meal type, built for one catalog generation
+class MealIndex:
+    __slots__ = ("generation", "ids", "names", "nutrients", "slots", "slot_nutrients")
+
+    def __init__(self, generation, rows):
+        self.generation = generation
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.names = [row[1] for row in rows]
+        self.nutrients = np.array([row[3:7] for row in rows], dtype=np.float64).reshape(-1, 4)
+        types = np.array([row[2] or "" for row in rows], dtype=object)
+        self.slots = {meal_type: np.flatnonzero(types == meal_type) for meal_type in MEAL_TYPES}
+        # Contiguous copy of each slot's rows, so ranking a slot needs no gather
+        self.slot_nutrients = {meal_type: self.nutrients[rows] for meal_type, rows in self.slots.items()}
+
+    @classmethod
+    def load(cls, conn, dietary_preference, generation):
+        sql = '''
+            SELECT meal_id, meal_name, meal_type, calories, COALESCE(protein, 0),
+                   COALESCE(carbs, 0), COALESCE(fats, 0)
+            FROM Meals
+            WHERE calories > 0
+        '''
+        params = ()
+        if dietary_preference is not None:
+            sql += " AND dietary_preference = ?"
+            params = (dietary_preference,)
+        return cls(generation, conn.execute(sql, params).fetchall())
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+# Index for a dietary preference ("None" means the whole catalog), reused
+# until the catalog cache's generation moves (a catalog write by this or
+# another process)
+def meal_index(db, dietary_preference=None):
+    preference = None if dietary_preference in (None, "None") else dietary_preference
+    key = (id(db), preference)
+    generation = db.catalog.current()
+    with _indexes_lock:
+        index = _indexes.get(key)
+    if index is not None and index.generation == generation:
+        return index
+    with db.read() as conn:
+        index = MealIndex.load(conn, preference, generation)
+    with _indexes_lock:
+        _indexes[key] = index
+    return index
+
+
+# Daily (calories, protein g, carbs g, fats g) targets
+def daily_targets(calorie_goal, fitness_goal=None, dietary_preference=None):
+    split = KETO_SPLIT if dietary_preference == "Keto" else MACRO_SPLITS.get(fitness_goal, MACRO_SPLITS["Maintenance"])
+    protein, carbs, fats = split
+    return np.array([calorie_goal, calorie_goal * protein / 4, calorie_goal * carbs / 4, calorie_goal * fats / 9])
+
+
+# Weighted squared relative deviation along the last axis
+def score(totals, target):
+    return (((totals - target) / np.maximum(target, 1.0)) ** 2 * WEIGHTS).sum(axis=-1)
+
+
+def _slot_candidates(index, meal_type, target, rng, exclude):
+    rows = index.slots[meal_type]
+    if exclude is not None and len(rows):
+        fresh = rows[~np.isin(index.ids[rows], exclude)]
+        rows = fresh if len(fresh) else rows
+    if not len(rows):
+        return rows, None
+    slot_target = target * SLOT_SHARES[meal_type]
+    nutrients = index.nutrients[rows]
+    # Portion that best matches the slot's calories, snapped to the slider steps
+    portions = np.clip(np.round(slot_target[0] / nutrients[:, 0] * 10) / 10, PORTIONS[0], PORTIONS[-1])
+    prescores = score(nutrients * portions[:, None], slot_target)
+    prescores *= 1 + VARIETY * rng.random(len(rows))
+    count = min(CANDIDATES, len(rows))
+    top = np.argpartition(prescores, count - 1)[:count]
+    best = top[np.argmin(prescores[top])]
+    return rows[top], (rows[best], portions[best])
+
+
+# Pick one meal and portion per slot: prescore every meal of a slot against
+# its share of the targets, then improve the whole day by coordinate
+# descent, re-choosing one slot's meal and portion at a time
+def plan_day(index, target, rng, exclude=None):
+    candidates, choice = {}, {}
+    for meal_type in MEAL_TYPES:
+        rows, picked = _slot_candidates(index, meal_type, target, rng, exclude)
+        if picked is not None:
+            candidates[meal_type] = rows
+            choice[meal_type] = picked
+    if not choice:
+        return {}, np.zeros(4)
+
+    total = sum(index.nutrients[row] * portion for row, portion in choice.values())
+    best = score(total, target)
+    for _ in range(MAX_ROUNDS):
+        improved = False
+        for meal_type, rows in candidates.items():
+            row, portion = choice[meal_type]
+            rest = total - index.nutrients[row] * portion
+            grid = rest + index.nutrients[rows][:, None, :] * PORTIONS[None, :, None]
+            scores = score(grid, target)
+            i, j = np.unravel_index(np.argmin(scores), scores.shape)
+            if scores[i, j] < best - 1e-12:
+                choice[meal_type] = (rows[i], PORTIONS[j])
+                total, best = grid[i, j], scores[i, j]
+                improved = True
+        if not improved:
+            break
+    return choice, total
+
+
+# What one more meal in meal_type should bring: the part of the day's
+# remaining targets that falls to this slot, sharing it with the slots that
+# have nothing planned yet in proportion to SLOT_SHARES
+def slot_budget(target, planned, meal_type, planned_slots=()):
+    remaining = np.maximum(target - np.asarray(planned, dtype=np.float64), 0.0)
+    open_slots = {slot for slot in MEAL_TYPES if slot not in planned_slots} | {meal_type}
+    return remaining * SLOT_SHARES[meal_type] / sum(SLOT_SHARES[slot] for slot in open_slots)
+
+
+# Rank the meals of one slot by how well their best allowed portion fills
+# `budget`. The weighted squared error is a convex quadratic in the portion,
+# so each meal's best portion is its unconstrained optimum clipped and
+# rounded to the slider steps: one vectorized pass over the slot's matrix.
+# Errors are relative to the daily target so an exhausted budget still ranks.
+# Returns [(meal_id, meal_name, portion, calories, protein, carbs, fats, score)].
+def rank_slot(index, meal_type, budget, target, k=10, exclude=None):
+    rows = index.slots[meal_type]
+    nutrients = index.slot_nutrients[meal_type]
+    if exclude is not None and len(rows):
+        keep = ~np.isin(index.ids[rows], exclude)
+        rows, nutrients = rows[keep], nutrients[keep]
+    if not len(rows):
+        return []
+    weights = WEIGHTS / np.maximum(target, 1.0) ** 2
+    fill = nutrients @ (weights * budget)
+    size = (nutrients ** 2) @ weights
+    portions = np.clip(np.round(fill / np.maximum(size, 1e-12) * 10) / 10, PORTIONS[0], PORTIONS[-1])
+    scores = (((nutrients * portions[:, None] - budget) ** 2) * weights).sum(axis=1)
+    count = min(k, len(rows))
+    top = np.argpartition(scores, count - 1)[:count]
+    top = top[np.argsort(scores[top], kind="stable")]
+    return [
+        (
+            int(index.ids[rows[i]]), index.names[rows[i]], float(portions[i]),
+            *(round(float(value), 1) for value in nutrients[i] * portions[i]),
+            float(scores[i]),
+        )
+        for i in top
+    ]
+
+
+# Top-k meals of a slot for what is left of the day. `planned` is the day's
+# planned (calories, protein, carbs, fats) and planned_slots the meal types
+# that already have meals; meals in `exclude` are skipped.
+def recommend(db, calorie_goal, meal_type, planned=(0.0, 0.0, 0.0, 0.0), planned_slots=(),
+              fitness_goal=None, dietary_preference=None, k=10, exclude=()):
+    index = meal_index(db, dietary_preference)
+    target = daily_targets(calorie_goal, fitness_goal, dietary_preference)
+    budget = slot_budget(target, planned, meal_type, planned_slots)
+    return rank_slot(index, meal_type, budget, target, k, np.array(exclude, dtype=np.int64) if exclude else None)
+
+
+class GeneratedPlan:
+    __slots__ = ("targets", "days")
+
+    def __init__(self, targets, days):
+        self.targets = targets
+        self.days = days
+
+    # (date, meal_type, meal_id, portion_size) rows for plan_meals
+    def rows(self):
+        return [
+            (day, meal_type, meal_id, portion)
+            for day, meals, _ in self.days
+            for meal_type, meal_id, _, portion, *_ in meals
+        ]
+
+
+# Plan `days` consecutive days from start_date. Meals already used earlier
+# in the plan are avoided when the catalog has alternatives.
+def generate_plan(db, calorie_goal, fitness_goal=None, dietary_preference=None,
+                  start_date=None, days=1, seed=None):
+    index = meal_index(db, dietary_preference)
+    target = daily_targets(calorie_goal, fitness_goal, dietary_preference)
+    rng = np.random.default_rng(seed if seed is not None else random.SystemRandom().randrange(2 ** 32))
+    start = Date.fromisoformat(str(start_date)) if start_date else Date.today()
+    used, plan_days = [], []
+    for offset in range(days):
+        choice, total = plan_day(index, target, rng, np.array(used, dtype=np.int64) if used else None)
+        meals = []
+        for meal_type in MEAL_TYPES:
+            if meal_type in choice:
+                row, portion = choice[meal_type]
+                nutrients = index.nutrients[row] * portion
+                meals.append((
+                    meal_type, int(index.ids[row]), index.names[row], float(portion),
+                    *(round(float(value), 1) for value in nutrients),
+                ))
+                used.append(int(index.ids[row]))
+        day = (start + timedelta(days=offset)).isoformat()
+        plan_days.append((day, meals, tuple(round(float(value), 1) for value in total)))
+    return GeneratedPlan(tuple(round(float(value), 1) for value in target), plan_days)
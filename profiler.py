@@ -0,0 +1,149 @@
+import cProfile
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+import querystats
+
+# Profile every rerun; a single session can also opt in with ?profile=1
+ENABLED = os.environ.get("MEAL_PLANNER_PROFILE") == "1"
+PROFILE_DIR = os.environ.get("MEAL_PLANNER_PROFILE_DIR", "profiles")
+PROFILE_LOG_BYTES = 5 * 1024 * 1024
+PROFILE_LOG_BACKUPS = 5
+# cProfile dumps are kept for this many of the slowest reruns
+WORST_RERUNS = 10
+
+_current = contextvars.ContextVar("rerun_profile", default=None)
+_lock = threading.Lock()
+_worst = []  # min-heap of (total_ms, path)
+_sequence = itertools.count(1)
+_logger = None
+
+
+def _log():
+    global _logger
+    with _lock:
+        if _logger is None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            handler = RotatingFileHandler(
+                os.path.join(PROFILE_DIR, "reruns.jsonl"),
+                maxBytes=PROFILE_LOG_BYTES, backupCount=PROFILE_LOG_BACKUPS, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("meal_planner.profile")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+    return _logger
+
+
+# Timeline of one rerun, split into sections at each mark(). SQL time
+# reported by querystats is counted as "db"; the rest of a section goes
+# to the phase it was marked with ("compute" or "render").
+class RerunProfile:
+    __slots__ = ("started", "last", "sections", "db_seconds", "queries", "_db_at_mark", "_queries_at_mark")
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.sections = []
+        self.db_seconds = 0.0
+        self.queries = 0
+        self._db_at_mark = 0.0
+        self._queries_at_mark = 0
+
+    def add_query(self, seconds):
+        self.db_seconds += seconds
+        self.queries += 1
+
+    def mark(self, label, phase):
+        now = time.perf_counter()
+        db = self.db_seconds - self._db_at_mark
+        self.sections.append({
+            "page": querystats.current_page.get(),
+            "section": label,
+            "phase": phase,
+            "ms": round((now - self.last) * 1000, 3),
+            "db_ms": round(db * 1000, 3),
+            "queries": self.queries - self._queries_at_mark,
+        })
+        self.last = now
+        self._db_at_mark = self.db_seconds
+        self._queries_at_mark = self.queries
+
+    def summary(self):
+        phases = {"db": 0.0, "compute": 0.0, "render": 0.0}
+        for section in self.sections:
+            phases["db"] += section["db_ms"]
+            phases[section["phase"]] += section["ms"] - section["db_ms"]
+        pages = [section["page"] for section in self.sections if section["page"] != "-"]
+        return {
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "page": pages[-1] if pages else "-",
+            "total_ms": round((self.last - self.started) * 1000, 3),
+            **{f"{phase}_ms": round(ms, 3) for phase, ms in phases.items()},
+            "queries": self.queries,
+            "sections": self.sections,
+        }
+
+
+# Close the current section of the active rerun profile; free when profiling is off
+def mark(label, phase="render"):
+    profile = _current.get()
+    if profile is not None:
+        profile.mark(label, phase)
+
+
+def _keep_worst(summary, profile):
+    with _lock:
+        if len(_worst) >= WORST_RERUNS and summary["total_ms"] <= _worst[0][0]:
+            return None
+        path = os.path.join(
+            PROFILE_DIR,
+            f"rerun-{time.strftime('%Y%m%d-%H%M%S')}-{next(_sequence)}-{int(summary['total_ms'])}ms.prof"
+        )
+        profile.dump_stats(path)
+        heapq.heappush(_worst, (summary["total_ms"], path))
+        evicted = heapq.heappop(_worst)[1] if len(_worst) > WORST_RERUNS else None
+    if evicted:
+        try:
+            os.remove(evicted)
+        except OSError:
+            pass
+    return path
+
+
+# Profile one script rerun: section timings go to a rotating JSONL log, and
+# the cProfile stats of the slowest reruns are kept as .prof files
+@contextmanager
+def rerun(enabled):
+    if not enabled:
+        yield
+        return
+    profile = RerunProfile()
+    token = _current.set(profile)
+    timer_token = querystats.query_timer.set(profile.add_query)
+    cprofile = cProfile.Profile()
+    try:
+        cprofile.enable()
+    except ValueError:  # another profiler is active in this process
+        cprofile = None
+    try:
+        yield profile
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+        querystats.query_timer.reset(timer_token)
+        _current.reset(token)
+        profile.mark("end of rerun", "render")
+        summary = profile.summary()
+        logger = _log()
+        summary["profile"] = _keep_worst(summary, cprofile) if cprofile is not None else None
+        logger.info(json.dumps(summary))
@@ -0,0 +1,248 @@
+import contextvars
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Statements slower than this (execute plus fetching) are logged with their query plan
+SLOW_QUERY_SECONDS = float(os.environ.get("MEAL_PLANNER_SLOW_QUERY_MS", "50")) / 1000
+# Prometheus text-format file refreshed with the counters, if set
+METRICS_FILE = os.environ.get("MEAL_PLANNER_METRICS_FILE")
+METRICS_INTERVAL = 10.0
+SLOW_LOG_SIZE = 50
+
+logger = logging.getLogger("meal_planner.sql")
+
+# Page whose rerun is issuing queries; set around each page render
+current_page = contextvars.ContextVar("current_page", default="-")
+# Optional callback receiving the seconds of each statement run in this context
+query_timer = contextvars.ContextVar("query_timer", default=None)
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+@contextmanager
+def page(name):
+    token = current_page.set(name)
+    try:
+        yield
+    finally:
+        current_page.reset(token)
+
+
+_normalized = {}
+
+
+# Collapse whitespace so one statement has one key; memoized since the
+# same few literal statements run on every rerun
+def normalize(sql):
+    text = _normalized.get(sql)
+    if text is None:
+        if len(_normalized) > 10000:
+            _normalized.clear()
+        text = _normalized[sql] = " ".join(sql.split())
+    return text
+
+
+def explain(conn, sql, params):
+    if params is None or not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return ""
+    # A plain cursor, so the EXPLAIN itself isn't recorded
+    cursor = sqlite3.Cursor(conn)
+    try:
+        rows = cursor.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error as e:
+        return f"(no plan: {e})"
+    finally:
+        cursor.close()
+    depth = {0: 0}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, 0) + 1
+        lines.append("  " * (depth[node] - 1) + detail)
+    return "\n".join(lines)
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+# Per (page, statement) counters for every statement run on a pooled
+# connection, plus a ring buffer of recent slow statements with their plans
+class QueryStats:
+    def __init__(self, slow_seconds=SLOW_QUERY_SECONDS, metrics_file=METRICS_FILE):
+        self.slow_seconds = slow_seconds
+        self.metrics_file = metrics_file
+        self._lock = threading.Lock()
+        self._totals = {}
+        self.slow = deque(maxlen=SLOW_LOG_SIZE)
+        self._written = time.monotonic()
+
+    def record(self, conn, sql, params, seconds, rows):
+        timer = query_timer.get()
+        if timer is not None:
+            timer(seconds)
+        key = (current_page.get(), normalize(sql))
+        with self._lock:
+            totals = self._totals.get(key)
+            if totals is None:
+                totals = self._totals[key] = [0, 0.0, 0.0, 0, 0]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            totals[3] += rows
+            slow = seconds >= self.slow_seconds
+            if slow:
+                totals[4] += 1
+        if slow:
+            plan = explain(conn, sql, params)
+            logger.warning("slow query on %s: %.1f ms, %d rows: %s\n%s",
+                           key[0], seconds * 1000, rows, key[1], plan)
+            self.slow.append({
+                "page": key[0], "ms": round(seconds * 1000, 2), "rows": rows,
+                "query": key[1], "plan": plan, "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        if self.metrics_file and time.monotonic() - self._written >= METRICS_INTERVAL:
+            self.write_metrics()
+
+    # Aggregates ordered by total time, the most expensive statements first
+    def summary(self):
+        with self._lock:
+            items = [(key, list(totals)) for key, totals in self._totals.items()]
+        items.sort(key=lambda item: item[1][1], reverse=True)
+        return [
+            {
+                "page": page_name, "query": sql, "calls": calls,
+                "total_ms": seconds * 1000, "avg_ms": seconds * 1000 / calls,
+                "max_ms": max_seconds * 1000, "rows": rows, "slow": slow,
+            }
+            for (page_name, sql), (calls, seconds, max_seconds, rows, slow) in items
+        ]
+
+    def prometheus(self):
+        metrics = (
+            ("meal_planner_queries_total", "counter", "SQL statements executed", 0),
+            ("meal_planner_query_seconds_total", "counter", "Time spent executing and fetching", 1),
+            ("meal_planner_query_max_seconds", "gauge", "Slowest single execution", 2),
+            ("meal_planner_query_rows_total", "counter", "Rows returned or changed", 3),
+            ("meal_planner_slow_queries_total", "counter", "Executions above the slow-query threshold", 4),
+        )
+        with self._lock:
+            items = [(key, list(totals)) for key, totals in self._totals.items()]
+        lines = []
+        for name, kind, help_text, index in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (page_name, sql), totals in items:
+                lines.append(f'{name}{{page="{_label(page_name)}",query="{_label(sql[:120])}"}} {totals[index]}')
+        return "\n".join(lines) + "\n"
+
+    # Atomically replace the metrics file (for node_exporter's textfile collector)
+    def write_metrics(self, path=None):
+        path = path or self.metrics_file
+        self._written = time.monotonic()
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, suffix=".tmp") as f:
+                f.write(self.prometheus())
+            os.replace(f.name, path)
+        except OSError as e:
+            logger.warning("could not write query metrics to %s: %s", path, e)
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self.slow.clear()
+
+
+# Cursor that times each statement from execute() until its rows are
+# fetched (or the cursor is closed) and reports it to the connection's
+# QueryStats. Row counts are fetched rows for queries, rowcount otherwise.
+class InstrumentedCursor(sqlite3.Cursor):
+    _pending = None
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        stats = getattr(self.connection, "query_stats", None)
+        if pending is not None and stats is not None:
+            stats.record(self.connection, *pending)
+
+    def _timed(self, started):
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - started
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._pending = [sql, parameters, time.perf_counter() - started, 0]
+        if self.description is None:
+            self._pending[3] = max(self.rowcount, 0)
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        # No parameters kept: the sequence may be a consumed generator
+        self._pending = [sql, None, time.perf_counter() - started, max(self.rowcount, 0)]
+        self._finish()
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._timed(started)
+        if row is None:
+            self._finish()
+        elif self._pending is not None:
+            self._pending[3] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._timed(started)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._timed(started)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._timed(started)
+            self._finish()
+            raise
+        self._timed(started)
+        if self._pending is not None:
+            self._pending[3] += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    # Cursors dropped without being exhausted or closed
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
@@ -1,5 +1,5 @@
 -- Users Table (Enhanced)
-CREATE TABLE Users (
+CREATE TABLE IF NOT EXISTS Users (
     user_id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT NOT NULL UNIQUE,
     password TEXT NOT NULL,
@@ -21,7 +21,7 @@ CREATE TABLE Users (
 );
 
 -- Meals Table (Enhanced)
-CREATE TABLE Meals (
+CREATE TABLE IF NOT EXISTS Meals (
     meal_id INTEGER PRIMARY KEY AUTOINCREMENT,
     meal_name TEXT NOT NULL,
     description TEXT,
@@ -51,7 +51,7 @@ CREATE TABLE Meals (
 );
 
 -- UserMealPlans Table (Enhanced)
-CREATE TABLE UserMealPlans (
+CREATE TABLE IF NOT EXISTS UserMealPlans (
     plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
     meal_id INTEGER NOT NULL REFERENCES Meals(meal_id) ON DELETE CASCADE,
@@ -67,7 +67,7 @@ CREATE TABLE UserMealPlans (
 );
 
 -- Progress Tracking Table (Enhanced)
-CREATE TABLE Progress (
+CREATE TABLE IF NOT EXISTS Progress (
     progress_id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
     date TEXT NOT NULL,
@@ -81,7 +81,7 @@ CREATE TABLE Progress (
 );
 
 -- Exercises Table
-CREATE TABLE Exercises (
+CREATE TABLE IF NOT EXISTS Exercises (
     exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
     exercise_name TEXT NOT NULL UNIQUE,
     calories_burned_per_hour INTEGER CHECK (calories_burned_per_hour >= 0),
@@ -95,7 +95,7 @@ CREATE TABLE Exercises (
 );
 
 -- User Exercises Log Table
-CREATE TABLE UserExercises (
+CREATE TABLE IF NOT EXISTS UserExercises (
     log_id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
     exercise_id INTEGER NOT NULL REFERENCES Exercises(exercise_id) ON DELETE CASCADE,
@@ -107,6 +107,6 @@ CREATE TABLE UserExercises (
 );
 
 -- Indexes for better performance
-CREATE INDEX idx_user_meal_plans ON UserMealPlans(user_id, date);
-CREATE INDEX idx_progress ON Progress(user_id, date);
-CREATE INDEX idx_user_exercises ON UserExercises(user_id, date);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_user_meal_plans ON UserMealPlans(user_id, date);
+CREATE INDEX IF NOT EXISTS idx_progress ON Progress(user_id, date);
+CREATE INDEX IF NOT EXISTS idx_user_exercises ON UserExercises(user_id, date);
\ No newline at end of file
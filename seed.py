@@ -0,0 +1,224 @@
+import argparse
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import auth
+from bulk import DIETARY_PREFERENCES, MEAL_TYPES
+from db import Database, migrate, rebuild_daily_nutrition, rebuild_exercise_totals
+
+# Full-size volumes; pass --scale to generate a fraction of them
+DEFAULT_USERS = 100000
+DEFAULT_MEALS = 50000
+DEFAULT_DAYS = 3 * 365
+# Users generated (and committed) per transaction
+USER_CHUNK = 1000
+# Every seeded account logs in with this password
+SEED_PASSWORD = "password123"
+
+GENDERS = ("Male", "Female", "Other")
+FITNESS_GOALS = ("Weight Loss", "Muscle Gain", "Maintenance")
+ACTIVITY_LEVELS = ("sedentary", "lightly active", "moderately active", "very active", "extra active")
+# Share of a user's days with meal plans, progress entries and workouts at full engagement
+PLAN_RATE = 0.35
+PROGRESS_RATE = 0.6
+EXERCISE_RATE = 0.4
+
+MEAL_WORDS = {
+    "Breakfast": ("Oatmeal", "Omelette", "Pancakes", "Smoothie Bowl", "Granola", "Toast", "Yogurt Parfait"),
+    "Lunch": ("Salad", "Wrap", "Grain Bowl", "Soup", "Sandwich", "Burrito Bowl", "Poke"),
+    "Dinner": ("Stir Fry", "Curry", "Pasta", "Roast", "Tacos", "Risotto", "Stew"),
+    "Snack": ("Energy Bites", "Hummus Plate", "Trail Mix", "Protein Bar", "Fruit Cup", "Rice Cakes"),
+}
+FLAVOURS = (
+    "Spicy", "Lemon", "Garlic", "Herb", "Smoky", "Honey", "Ginger", "Sesame", "Chipotle",
+    "Pesto", "Teriyaki", "Mediterranean", "Cajun", "Coconut", "Maple", "Miso",
+)
+MAIN_INGREDIENTS = (
+    "Chicken", "Tofu", "Salmon", "Beef", "Lentil", "Chickpea", "Turkey", "Shrimp", "Quinoa",
+    "Mushroom", "Egg", "Tempeh", "Bean", "Spinach", "Sweet Potato", "Berry",
+)
+CALORIE_RANGES = {"Breakfast": (250, 600), "Lunch": (350, 800), "Dinner": (400, 950), "Snack": (80, 350)}
+EXERCISES = (
+    ("Walking", 280, "Low"), ("Yoga", 240, "Low"), ("Stretching", 150, "Low"),
+    ("Pilates", 300, "Low"), ("Cycling", 500, "Medium"), ("Swimming", 550, "Medium"),
+    ("Elliptical", 450, "Medium"), ("Rowing", 520, "Medium"), ("Weight Training", 400, "Medium"),
+    ("Dancing", 420, "Medium"), ("Hiking", 430, "Medium"), ("Running", 700, "High"),
+    ("HIIT", 750, "High"), ("Jump Rope", 800, "High"), ("Boxing", 650, "High"),
+    ("Stair Climbing", 600, "High"), ("CrossFit", 720, "High"), ("Spinning", 680, "High"),
+)
+
+
+def scaled(value, scale):
+    return max(1, int(value * scale))
+
+
+def meal_row(rng, meal_id):
+    meal_type = rng.choice(MEAL_TYPES)
+    preference = rng.choices(DIETARY_PREFERENCES, weights=(40, 15, 10, 15, 10, 10))[0]
+    calories = rng.randint(*CALORIE_RANGES[meal_type])
+    # Split calories into macros (4/4/9 kcal per gram) with some per-meal variation
+    protein_share, fat_share = rng.uniform(0.15, 0.4), rng.uniform(0.2, 0.4)
+    if preference == "Keto":
+        fat_share = rng.uniform(0.6, 0.75)
+    carb_share = max(0.05, 1 - protein_share - fat_share)
+    name = f"{rng.choice(FLAVOURS)} {rng.choice(MAIN_INGREDIENTS)} {rng.choice(MEAL_WORDS[meal_type])}"
+    return (
+        f"{name} #{meal_id}",
+        f"{preference} {meal_type.lower()}: {name.lower()}",
+        calories,
+        round(calories * protein_share / 4, 1),
+        round(calories * carb_share / 4, 1),
+        round(calories * fat_share / 9, 1),
+        round(rng.uniform(0, 12), 1),
+        round(rng.uniform(0, 25), 1),
+        round(rng.uniform(50, 1200), 0),
+        preference,
+        meal_type,
+    )
+
+
+def user_row(rng, user_id, password):
+    gender = rng.choice(GENDERS)
+    height = round(rng.gauss(176 if gender == "Male" else 164, 8), 1)
+    weight = round(max(40.0, rng.gauss(height - 100, 12)), 1)
+    return (
+        f"user{user_id}", password, f"user{user_id}@example.com", rng.randint(16, 80), gender,
+        height, weight, rng.choice(FITNESS_GOALS), rng.choice(ACTIVITY_LEVELS),
+        rng.randrange(1500, 3500, 50),
+    )
+
+
+# Activity rows for one user. Engagement is skewed so most users log
+# occasionally and a few log nearly every day, as in real usage.
+def user_activity(rng, user_id, weight, days, end, meals_by_type, exercises):
+    engagement = rng.random() ** 2
+    active_days = rng.randint(1, days)
+    first = end - timedelta(days=active_days - 1)
+    plans, progress, workouts = [], [], []
+
+    def sample(rate):
+        count = int(active_days * rate * engagement)
+        return sorted(rng.sample(range(active_days), count)) if count else []
+
+    for offset in sample(PLAN_RATE):
+        day = (first + timedelta(days=offset)).isoformat()
+        for meal_type in MEAL_TYPES:
+            if meal_type != "Snack" or rng.random() < 0.4:
+                portion = rng.choice((0.5, 1.0, 1.0, 1.0, 1.5, 2.0))
+                plans.append((user_id, rng.choice(meals_by_type[meal_type]), day, portion, meal_type))
+    for offset in sample(PROGRESS_RATE):
+        weight = round(max(35.0, weight + rng.gauss(-0.01, 0.15)), 1)
+        calories = rng.randint(1200, 3500)
+        progress.append((
+            user_id, (first + timedelta(days=offset)).isoformat(), weight, calories,
+            round(calories * 0.25 / 4, 1), round(calories * 0.45 / 4, 1), round(calories * 0.3 / 9, 1),
+            None,
+        ))
+    for offset in sample(EXERCISE_RATE):
+        exercise_id, per_hour = rng.choice(exercises)
+        minutes = rng.choice((15, 20, 30, 30, 45, 60, 90))
+        workouts.append((
+            user_id, exercise_id, (first + timedelta(days=offset)).isoformat(),
+            minutes, int(per_hour * minutes / 60),
+        ))
+    return plans, progress, workouts
+
+
+# Fill a database with deterministic synthetic users, catalog and history.
+# Rollups (DailyNutrition, ExerciseTotals) are rebuilt once at the end.
+def generate(db, users=DEFAULT_USERS, meals=DEFAULT_MEALS, days=DEFAULT_DAYS, seed=42, progress=print):
+    rng = random.Random(seed)
+    end = date.today()
+    password = auth.compute_hash(SEED_PASSWORD)
+
+    with db.write() as conn:
+        if conn.execute("SELECT EXISTS (SELECT 1 FROM Users)").fetchone()[0]:
+            raise ValueError("database already has users; seed an empty database")
+        conn.executemany('''
+            INSERT INTO Exercises (exercise_name, calories_burned_per_hour, intensity)
+            VALUES (?, ?, ?)
+        ''', EXERCISES)
+        exercises = conn.execute("SELECT exercise_id, calories_burned_per_hour FROM Exercises").fetchall()
+        conn.executemany('''
+            INSERT INTO Meals (meal_name, description, calories, protein, carbs, fats,
+                               fiber, sugar, sodium, dietary_preference, meal_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (meal_row(rng, i) for i in range(1, meals + 1)))
+        meals_by_type = {meal_type: [] for meal_type in MEAL_TYPES}
+        for meal_id, meal_type in conn.execute("SELECT meal_id, meal_type FROM Meals"):
+            meals_by_type[meal_type].append(meal_id)
+    db.catalog.invalidate()
+    progress(f"catalog: {meals} meals, {len(exercises)} exercises")
+
+    counts = {"plans": 0, "progress": 0, "exercise_logs": 0}
+    for chunk_start in range(1, users + 1, USER_CHUNK):
+        rows = [user_row(rng, i, password) for i in range(chunk_start, min(users, chunk_start + USER_CHUNK - 1) + 1)]
+        with db.write() as conn:
+            cursor = conn.cursor()
+            plans, entries, workouts = [], [], []
+            for row in rows:
+                cursor.execute('''
+                    INSERT INTO Users (username, password, email, age, gender, height, weight,
+                                       fitness_goal, activity_level, daily_calorie_goal)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', row)
+                activity = user_activity(rng, cursor.lastrowid, row[6], days, end, meals_by_type, exercises)
+                plans += activity[0]
+                entries += activity[1]
+                workouts += activity[2]
+            cursor.executemany('''
+                INSERT INTO UserMealPlans (user_id, meal_id, date, portion_size, meal_type)
+                VALUES (?, ?, ?, ?, ?)
+            ''', plans)
+            cursor.executemany('''
+                INSERT INTO Progress (user_id, date, weight, total_calories,
+                                      total_protein, total_carbs, total_fats, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', entries)
+            cursor.executemany('''
+                INSERT INTO UserExercises (user_id, exercise_id, date, duration_minutes, calories_burned)
+                VALUES (?, ?, ?, ?, ?)
+            ''', workouts)
+        counts["plans"] += len(plans)
+        counts["progress"] += len(entries)
+        counts["exercise_logs"] += len(workouts)
+        progress(f"users: {min(users, chunk_start + USER_CHUNK - 1)}/{users}")
+
+    with db.write() as conn:
+        rebuild_daily_nutrition(conn)
+        rebuild_exercise_totals(conn)
+        conn.execute("ANALYZE")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill a meal planner database with synthetic data")
+    parser.add_argument("--db", default="meal_planner.db", help="SQLite database file (must have no users)")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS)
+    parser.add_argument("--meals", type=int, default=DEFAULT_MEALS)
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS, help="days of history")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply users and meals by this")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    try:
+        migrate(db)
+        started = time.perf_counter()
+        counts = generate(
+            db, scaled(args.users, args.scale), scaled(args.meals, args.scale), args.days, args.seed
+        )
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    print(", ".join(f"{count} {kind}" for kind, count in counts.items())
+          + f" in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
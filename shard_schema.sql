@@ -0,0 +1,91 @@
+-- Schema of a shard file (shard version 1). These are the per-user tables
+-- of schema.sql and its migrations. The global database is attached to
+-- every shard connection as `shared`, so queries joining Meals, Exercises
+-- or Users run unchanged. SQLite foreign keys cannot span files, so they
+-- are dropped here; the app only writes ids it read from the global tables.
+
+CREATE TABLE IF NOT EXISTS UserMealPlans (
+    plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    meal_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    portion_size REAL DEFAULT 1.0 CHECK (portion_size > 0),
+    meal_type TEXT CHECK (meal_type IN (
+        'Breakfast',
+        'Lunch',
+        'Dinner',
+        'Snack'
+    )),
+    UNIQUE(user_id, meal_id, date, meal_type)
+);
+
+CREATE TABLE IF NOT EXISTS Progress (
+    progress_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    weight REAL CHECK (weight > 0),           -- in kg
+    total_calories INTEGER CHECK (total_calories >= 0),
+    total_protein REAL CHECK (total_protein >= 0),    -- in grams
+    total_carbs REAL CHECK (total_carbs >= 0),        -- in grams
+    total_fats REAL CHECK (total_fats >= 0),          -- in grams
+    notes TEXT,
+    UNIQUE(user_id, date)
+);
+
+CREATE TABLE IF NOT EXISTS UserExercises (
+    log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    duration_minutes REAL CHECK (duration_minutes > 0),
+    calories_burned INTEGER CHECK (calories_burned >= 0),
+    notes TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS DailyNutrition (
+    user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    meal_count INTEGER NOT NULL DEFAULT 0,
+    calories REAL NOT NULL DEFAULT 0,
+    protein REAL NOT NULL DEFAULT 0,    -- in grams
+    carbs REAL NOT NULL DEFAULT 0,      -- in grams
+    fats REAL NOT NULL DEFAULT 0,       -- in grams
+    fiber REAL NOT NULL DEFAULT 0,      -- in grams
+    sugar REAL NOT NULL DEFAULT 0,      -- in grams
+    sodium REAL NOT NULL DEFAULT 0,     -- in mg
+    PRIMARY KEY (user_id, date)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ExerciseTotals (
+    user_id INTEGER PRIMARY KEY,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    calories_burned INTEGER NOT NULL DEFAULT 0,
+    duration_minutes REAL NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_meal_plans ON UserMealPlans(user_id, date);
+CREATE INDEX IF NOT EXISTS idx_progress ON Progress(user_id, date);
+CREATE INDEX IF NOT EXISTS idx_user_exercises ON UserExercises(user_id, date);
+
+-- Users moved off this shard. A process that still routes such a user here
+-- (its shard map is refreshed every few seconds) gets its write rejected
+-- instead of leaving rows behind on the wrong shard.
+CREATE TABLE IF NOT EXISTS MovedUsers (
+    user_id INTEGER PRIMARY KEY
+);
+
+CREATE TRIGGER IF NOT EXISTS moved_user_plans BEFORE INSERT ON UserMealPlans
+WHEN EXISTS (SELECT 1 FROM MovedUsers WHERE user_id = new.user_id) BEGIN
+    SELECT RAISE(ABORT, 'user moved to another shard');
+END;
+
+CREATE TRIGGER IF NOT EXISTS moved_user_progress BEFORE INSERT ON Progress
+WHEN EXISTS (SELECT 1 FROM MovedUsers WHERE user_id = new.user_id) BEGIN
+    SELECT RAISE(ABORT, 'user moved to another shard');
+END;
+
+CREATE TRIGGER IF NOT EXISTS moved_user_exercises BEFORE INSERT ON UserExercises
+WHEN EXISTS (SELECT 1 FROM MovedUsers WHERE user_id = new.user_id) BEGIN
+    SELECT RAISE(ABORT, 'user moved to another shard');
+END;
@@ -0,0 +1,399 @@
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from db import NUTRIENTS, SHARD_MIGRATIONS_DIR, SHARD_SCHEMA_FILE, Database, load_migrations, table_columns
+
+# Seconds a process trusts its cached user -> shard entries. After a user is
+# moved, other processes may route them to the old shard for this long;
+# their writes there are rejected by the shard's MovedUsers triggers.
+SHARD_MAP_TTL = float(os.environ.get("MEAL_PLANNER_SHARD_MAP_TTL", "5"))
+SHARD_MAP_SIZE = 100000
+# Schema name of the global database on shard connections
+ATTACH_NAME = "shared"
+
+# Per-user tables kept on shards: (order, columns copied when a user moves).
+# Surrogate keys are reassigned on the target shard, in their original order.
+SHARD_TABLES = {
+    "UserMealPlans": ("plan_id", ("user_id", "meal_id", "date", "portion_size", "meal_type")),
+    "Progress": ("progress_id", (
+        "user_id", "date", "weight", "total_calories", "total_protein", "total_carbs",
+        "total_fats", "notes",
+    )),
+    "UserExercises": ("log_id", (
+        "user_id", "exercise_id", "date", "duration_minutes", "calories_burned", "notes", "created_at",
+    )),
+    "DailyNutrition": ("date", ("user_id", "date", "meal_count") + NUTRIENTS),
+    "ExerciseTotals": ("user_id", ("user_id", "sessions", "calories_burned", "duration_minutes")),
+    "ArchivedExerciseTotals": ("user_id", ("user_id", "sessions", "calories_burned", "duration_minutes")),
+    "UserSummaries": ("period, period_start", (
+        "user_id", "period", "period_start", "days_logged", "avg_weight", "min_weight", "max_weight",
+        "avg_calories", "planned_days", "avg_planned_calories", "workouts", "exercise_minutes",
+        "calories_burned", "updated_at",
+    )),
+}
+# Tables whose rows count towards a user's weight when rebalancing
+WEIGHTED_TABLES = ("UserMealPlans", "Progress", "UserExercises")
+
+
+# One shard file. The global database is attached read-only to each of its
+# connections, so per-user queries joining Meals, Exercises or Users work
+# unchanged; writes only ever lock this file.
+class Shard(Database):
+    def __init__(self, shard_id, path, global_path, queries, **options):
+        self.shard_id = shard_id
+        self.global_uri = Path(global_path).absolute().as_uri() + "?mode=ro"
+        super().__init__(path, **options)
+        # Report into the global database's query stats
+        self.queries = queries
+        self._writer.query_stats = queries
+
+    def _connect(self, uri):
+        conn = super()._connect(uri)
+        conn.execute(f"ATTACH DATABASE ? AS {ATTACH_NAME}", (self.global_uri,))
+        return conn
+
+
+# Database whose per-user tables can be split across shard files listed in
+# its Shards table, each with its own write lock. Users, Meals, Exercises
+# and everything else stay in this (global) database. Without registered
+# shards it behaves exactly like Database.
+class ShardedDatabase(Database):
+    def __init__(self, path, readers=4, busy_timeout=5.0, group_commit=False):
+        super().__init__(path, readers, busy_timeout, group_commit)
+        self._options = {"readers": readers, "busy_timeout": busy_timeout, "group_commit": group_commit}
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        self._map = {}  # user_id -> (shard_id, expires)
+
+    # Migrating the global database also opens the registered shards and
+    # brings their schema up to date
+    def apply_migrations(self, steps):
+        applied = super().apply_migrations(steps)
+        self.open_shards()
+        return applied
+
+    # Relative shard paths are relative to the global database's directory
+    def shard_path(self, path):
+        return Path(self.path).absolute().parent / path
+
+    def open_shards(self, create=()):
+        with self.read() as conn:
+            rows = conn.execute("SELECT shard_id, path FROM Shards ORDER BY shard_id").fetchall()
+        with self._shards_lock:
+            for shard_id, path in rows:
+                if shard_id in self._shards:
+                    continue
+                path = self.shard_path(path)
+                if shard_id not in create and not path.exists():
+                    raise sqlite3.OperationalError(f"Shard {shard_id} is missing: {path}")
+                self._shards[shard_id] = self._open_shard(shard_id, path, shard_id in create)
+
+    # Open a shard file and bring its schema up to date. A newly created one
+    # starts with the global database's archive watermarks: archived dates
+    # stay closed for users moved onto it, and reads of those dates go to
+    # the archive.
+    def _open_shard(self, shard_id, path, create=False):
+        shard = Shard(shard_id, path, self.path, self.queries, **self._options)
+        try:
+            shard.apply_migrations(load_migrations(SHARD_SCHEMA_FILE, SHARD_MIGRATIONS_DIR))
+            if create:
+                with shard.write() as conn:
+                    conn.execute(f'''
+                        INSERT INTO main.ArchiveWatermarks (table_name, through_date)
+                        SELECT table_name, through_date FROM {ATTACH_NAME}.ArchiveWatermarks
+                    ''')
+        except Exception:
+            shard.close()
+            raise
+        return shard
+
+    def _shard_by_id(self, shard_id):
+        shard = self._shards.get(shard_id)
+        if shard is None:  # registered by another process since we opened ours
+            self.open_shards()
+            shard = self._shards[shard_id]
+        return shard
+
+    # The user's shard from UserShards. Users seen for the first time are
+    # assigned to the shard with the fewest users, so new shards fill first.
+    def locate(self, user_id):
+        with self.read() as conn:
+            row = conn.execute("SELECT shard_id FROM UserShards WHERE user_id = ?", (user_id,)).fetchone()
+        if row is not None:
+            return row[0]
+        with self.write() as conn:
+            row = conn.execute("SELECT shard_id FROM UserShards WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                row = conn.execute("SELECT shard_id FROM Shards ORDER BY user_count, shard_id LIMIT 1").fetchone()
+                conn.execute("INSERT INTO UserShards (user_id, shard_id) VALUES (?, ?)", (user_id, row[0]))
+        return row[0]
+
+    def shard(self, user_id):
+        if not self._shards:
+            return self
+        now = time.monotonic()
+        entry = self._map.get(user_id)
+        if entry is None or entry[1] <= now:
+            entry = (self.locate(user_id), now + SHARD_MAP_TTL)
+            if len(self._map) >= SHARD_MAP_SIZE:
+                self._map.clear()
+            self._map[user_id] = entry
+        return self._shard_by_id(entry[0])
+
+    def all_shards(self):
+        return [self._shards[shard_id] for shard_id in sorted(self._shards)] or [self]
+
+    def group_users(self, user_ids):
+        if not self._shards:
+            return [(self, list(user_ids))]
+        groups = {}
+        for user_id in user_ids:
+            groups.setdefault(self.shard(user_id), []).append(user_id)
+        return list(groups.items())
+
+    # Run a read-only statement on every shard in parallel: [(shard_id, rows)].
+    # The global tables are visible as `shared.<table>` (or unqualified).
+    def query_all(self, sql, params=()):
+        shards = self.all_shards()
+
+        def run(shard):
+            with shard.read() as conn:
+                return getattr(shard, "shard_id", None), conn.execute(sql, params).fetchall()
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            return list(pool.map(run, shards))
+
+    # Register and create a new, empty shard file
+    def add_shard(self, path):
+        resolved = self.shard_path(path)
+        if resolved.exists():
+            raise ValueError(f"{resolved} already exists")
+        resolved.parent.mkdir(parents=True, exist_ok=True)
+        with self.write() as conn:
+            shard_id = conn.execute("INSERT INTO Shards (path) VALUES (?)", (str(path),)).lastrowid
+        self.open_shards(create=(shard_id,))
+        return shard_id
+
+    # Split a single-file database into shard files: copy every user's rows,
+    # round-robin by user_id, into new shard files, then in one global
+    # transaction register the shards, assign the users and delete the rows
+    # from the global database. If anything fails before that commit, the
+    # new files are removed and the database is left unsharded. Columns the
+    # global tables lack (a database not yet migrated) are left to their
+    # defaults. Run with the app stopped.
+    def create_shards(self, paths):
+        if self._shards:
+            raise ValueError("Database is already sharded; use add_shard and rebalance")
+        resolved = [self.shard_path(path) for path in paths]
+        for path in resolved:
+            if path.exists():
+                raise ValueError(f"{path} already exists")
+        created = []
+        try:
+            for slot, path in enumerate(resolved):
+                path.parent.mkdir(parents=True, exist_ok=True)
+                created.append(self._open_shard(None, path, create=True))
+                self._copy_users(created[-1], slot, len(resolved))
+            with self.write() as conn:
+                for slot, (path, shard) in enumerate(zip(paths, created)):
+                    shard.shard_id = conn.execute("INSERT INTO Shards (path) VALUES (?)", (str(path),)).lastrowid
+                    conn.execute('''
+                        INSERT INTO UserShards (user_id, shard_id)
+                        SELECT user_id, ? FROM Users WHERE user_id % ? = ?
+                    ''', (shard.shard_id, len(created), slot))
+                for table in SHARD_TABLES:
+                    conn.execute(f"DELETE FROM {table}")
+        except BaseException:
+            for shard in created:
+                shard.close()
+            # None of the files existed before
+            for path in resolved:
+                for suffix in ("", "-wal", "-shm"):
+                    Path(f"{path}{suffix}").unlink(missing_ok=True)
+            raise
+        counts = {}
+        with self._shards_lock:
+            for shard in created:
+                self._shards[shard.shard_id] = shard
+        for shard in created:
+            with shard.read() as conn:
+                counts[shard.shard_id] = conn.execute("SELECT " + " + ".join(
+                    f"(SELECT COUNT(*) FROM main.{table})" for table in WEIGHTED_TABLES
+                )).fetchone()[0]
+        return counts
+
+    # Copy the per-user rows of users with user_id % count == slot from the
+    # global database into a new shard, in one shard transaction
+    def _copy_users(self, shard, slot, count):
+        with shard.write() as conn:
+            for table, (order, columns) in SHARD_TABLES.items():
+                present = table_columns(conn, table, ATTACH_NAME)
+                names = ", ".join(column for column in columns if column in present)
+                conn.execute(f'''
+                    INSERT INTO main.{table} ({names})
+                    SELECT {names} FROM {ATTACH_NAME}.{table}
+                    WHERE user_id IN (SELECT user_id FROM {ATTACH_NAME}.Users WHERE user_id % ? = ?)
+                    ORDER BY {order}
+                ''', (count, slot))
+
+    # Copy a user's rows to another shard, repoint UserShards, then delete
+    # them from the source, all while holding the source shard's write lock.
+    # The source keeps a MovedUsers tombstone so writes from processes still
+    # routing the user there fail instead of being lost. Both shards must
+    # have archived the same dates. Returns rows moved.
+    def move_user(self, user_id, target_id):
+        source = self._shard_by_id(self.locate(user_id))
+        target = self._shard_by_id(target_id)
+        if source is target:
+            return 0
+        with source.write() as src:
+            src.execute("INSERT OR IGNORE INTO MovedUsers (user_id) VALUES (?)", (user_id,))
+            rows = {
+                table: src.execute(
+                    f"SELECT {', '.join(columns)} FROM main.{table} WHERE user_id = ? ORDER BY {order}",
+                    (user_id,)
+                ).fetchall()
+                for table, (order, columns) in SHARD_TABLES.items()
+            }
+            with target.write() as dst:
+                watermarks = "SELECT table_name, through_date FROM main.ArchiveWatermarks ORDER BY table_name"
+                if src.execute(watermarks).fetchall() != dst.execute(watermarks).fetchall():
+                    raise ValueError(
+                        f"Shards {source.shard_id} and {target_id} have different archive watermarks; "
+                        "run the archive job before moving users"
+                    )
+                dst.execute("DELETE FROM MovedUsers WHERE user_id = ?", (user_id,))
+                for table, (_, columns) in SHARD_TABLES.items():
+                    # An interrupted earlier move may have left a copy here
+                    dst.execute(f"DELETE FROM main.{table} WHERE user_id = ?", (user_id,))
+                    dst.executemany(
+                        f"INSERT INTO main.{table} ({', '.join(columns)}) "
+                        f"VALUES ({', '.join('?' for _ in columns)})",
+                        rows[table]
+                    )
+            with self.write() as conn:
+                conn.execute("UPDATE UserShards SET shard_id = ? WHERE user_id = ?", (target_id, user_id))
+            for table in SHARD_TABLES:
+                src.execute(f"DELETE FROM main.{table} WHERE user_id = ?", (user_id,))
+        self._map.pop(user_id, None)
+        return sum(len(table_rows) for table_rows in rows.values())
+
+    # {shard_id: {user_id: rows}} over the weighted per-user tables
+    def user_weights(self):
+        union = " UNION ALL ".join(
+            f"SELECT user_id, COUNT(*) AS n FROM main.{table} GROUP BY user_id" for table in WEIGHTED_TABLES
+        )
+        weights = {shard_id: dict(rows) for shard_id, rows in self.query_all(
+            f"SELECT user_id, SUM(n) FROM ({union}) GROUP BY user_id"
+        )}
+        # Users assigned to a shard but without any rows yet
+        with self.read() as conn:
+            for user_id, shard_id in conn.execute("SELECT user_id, shard_id FROM UserShards"):
+                weights.setdefault(shard_id, {}).setdefault(user_id, 0)
+        return weights
+
+    # Rows left on a shard for users UserShards assigns elsewhere (from an
+    # interrupted move): [(shard_id, user_id)]
+    def orphans(self):
+        union = " UNION ".join(f"SELECT user_id FROM main.{table}" for table in SHARD_TABLES)
+        return [
+            (shard_id, user_id)
+            for shard_id, rows in self.query_all(f'''
+                SELECT t.user_id, us.shard_id FROM ({union}) t
+                JOIN {ATTACH_NAME}.UserShards us ON us.user_id = t.user_id
+            ''')
+            for user_id, owner in rows
+            if owner != shard_id
+        ]
+
+    def purge_orphans(self):
+        orphans = self.orphans()
+        for shard_id, user_id in orphans:
+            with self._shards[shard_id].write() as conn:
+                for table in SHARD_TABLES:
+                    conn.execute(f"DELETE FROM main.{table} WHERE user_id = ?", (user_id,))
+        return len(orphans)
+
+    # Move users until rows are spread evenly (see plan_rebalance). Run one
+    # rebalance at a time; the app can keep serving while it runs.
+    def rebalance(self, max_moves=None, dry_run=False, progress=print):
+        if not dry_run:
+            purged = self.purge_orphans()
+            if purged:
+                progress(f"purged rows of {purged} orphaned users")
+        moves = plan_rebalance(self.user_weights(), max_moves)
+        for done, (user_id, source_id, target_id, weight) in enumerate(moves, start=1):
+            if not dry_run:
+                self.move_user(user_id, target_id)
+            if dry_run or done % 100 == 0 or done == len(moves):
+                progress(f"{'would move' if dry_run else 'moved'} user {user_id} "
+                         f"({weight} rows) {source_id} -> {target_id} [{done}/{len(moves)}]")
+        return moves
+
+    # Users, rows per table and file size of each shard
+    def shard_status(self):
+        with self.read() as conn:
+            shards = conn.execute("SELECT shard_id, path, user_count FROM Shards ORDER BY shard_id").fetchall()
+        counts = dict(self.query_all(
+            "SELECT " + ", ".join(f"(SELECT COUNT(*) FROM main.{table})" for table in WEIGHTED_TABLES)
+        ))
+        return [
+            {
+                "shard_id": shard_id,
+                "path": str(self.shard_path(path)),
+                "users": users,
+                **dict(zip(WEIGHTED_TABLES, counts.get(shard_id, [(0,) * len(WEIGHTED_TABLES)])[0])),
+                "bytes": self.shard_path(path).stat().st_size,
+            }
+            for shard_id, path, users in shards
+        ]
+
+    def stats(self):
+        stats = super().stats()
+        stats["shards"] = len(self._shards)
+        stats["shard_map_entries"] = len(self._map)
+        for shard in self._shards.values():
+            for key, value in shard.stats().items():
+                if key.endswith(("_checkouts", "_contention", "timeouts")):
+                    stats[f"shard_{key}"] = stats.get(f"shard_{key}", 0) + value
+        return stats
+
+    def close(self):
+        with self._shards_lock:
+            shards, self._shards = list(self._shards.values()), {}
+        for shard in shards:
+            shard.close()
+        super().close()
+
+
+# Greedy moves evening out rows per shard: repeatedly move, from the
+# heaviest to the lightest shard, the largest user that fits in half of
+# the gap between them. Returns [(user_id, from_shard, to_shard, rows)].
+def plan_rebalance(weights, max_moves=None):
+    loads = {shard_id: sum(users.values()) for shard_id, users in weights.items()}
+    # Per shard, parallel lists of user weights (ascending) and ids
+    users = {}
+    for shard_id, by_user in weights.items():
+        ordered = sorted(by_user.items(), key=lambda item: item[1])
+        users[shard_id] = ([weight for _, weight in ordered], [user_id for user_id, _ in ordered])
+    moves = []
+    while len(loads) > 1 and (max_moves is None or len(moves) < max_moves):
+        heavy = max(loads, key=loads.get)
+        light = min(loads, key=loads.get)
+        shard_weights, shard_users = users[heavy]
+        index = bisect_right(shard_weights, (loads[heavy] - loads[light]) / 2) - 1
+        if index < 0 or shard_weights[index] == 0:
+            break
+        weight, user_id = shard_weights.pop(index), shard_users.pop(index)
+        loads[heavy] -= weight
+        loads[light] += weight
+        target_weights, target_users = users[light]
+        position = bisect_right(target_weights, weight)
+        target_weights.insert(position, weight)
+        target_users.insert(position, user_id)
+        moves.append((user_id, heavy, light, weight))
+    return moves
@@ -0,0 +1,15 @@
+import pytest
+
+import manage
+
+pytest.importorskip("streamlit")
+
+
+# The app's cold import stays under STARTUP_BUDGET_MS, with the heavy
+# modules only the progress and exercise pages need left unimported
+def test_startup_budget():
+    total_ms, _, eager = manage.check_startup("n", runs=3)
+    assert not eager, f"imported at startup but should be lazy: {', '.join(eager)}"
+    assert total_ms <= manage.STARTUP_BUDGET_MS, (
+        f"import n took {total_ms:.1f} ms, budget {manage.STARTUP_BUDGET_MS} ms"
+    )